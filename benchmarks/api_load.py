@@ -0,0 +1,471 @@
+"""Load test of the API's hot paths against a seeded scratch database.
+
+`seed` fills a database with synthetic users, books (each with a PDF) and
+borrows at a preset scale. `run` drives the app with concurrent clients, one
+flow at a time: in process through httpx's ASGI transport, or over HTTP
+against a local uvicorn it starts itself. For every request step it reports
+RPS, p50/p95/p99 latency, errors and SQL statements per request. The
+statement counts come from the app's own /metrics, so with several uvicorn
+workers they cover only the worker that answered the scrape.
+`--baseline` compares against a saved result and exits 1 on a regression.
+
+Usage: python -m benchmarks.api_load seed [--scale 10k|100k|1m] [--url sqlite:///./bench_api.db]
+       python -m benchmarks.api_load run [--mode inprocess|uvicorn] [--flows catalog_list search ...]
+           [--requests 1000] [--concurrency 32] [--out result.json] [--baseline old.json]
+Run from the repository root (main.py serves ./frontend). Needs httpx.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, create_engine, func, insert, select, text, update
+
+DEFAULT_URL = "sqlite:///./bench_api.db"
+# users, books, borrows
+SCALES = {"10k": (1_000, 2_000, 10_000), "100k": (10_000, 20_000, 100_000), "1m": (100_000, 200_000, 1_000_000)}
+PASSWORD = "bench-password"
+ADMIN = "bench_admin"
+# Users with no seeded borrows; each borrow_cycle client owns one
+CYCLE_USERS = 256
+COPIES = 5
+STATUSES = ["returned"] * 6 + ["rejected"] * 2 + ["approved", "pending"]
+WORDS = [
+    "river", "shadow", "garden", "empire", "winter", "silent", "golden", "storm", "forest", "ocean",
+    "machine", "history", "secret", "journey", "island", "mountain", "letters", "city", "night", "fire",
+]
+PDF_BYTES = b"%PDF-1.4\n" + b"%" + b"x" * 64 * 1024 + b"\n%%EOF\n"
+
+FLOWS = ["catalog_list", "search", "login", "borrow_cycle", "pdf_view", "my_borrows"]
+# Step name -> route template, matching the labels on http_request_db_queries
+ROUTES = {
+    "catalog_list": ("GET", "/books/"),
+    "search": ("GET", "/books/search"),
+    "login": ("POST", "/auth/login"),
+    "borrow_request": ("POST", "/borrow/request"),
+    "borrow_approve": ("POST", "/borrow/approve"),
+    "borrow_return": ("POST", "/borrow/return"),
+    "pdf_view": ("GET", "/books/{book_id}/view"),
+    "my_borrows": ("GET", "/borrow/my"),
+}
+METRIC_LINE = re.compile(r'^http_request_db_queries_(sum|count)\{method="(\w+)",route="([^"]*)"\} (\S+)$')
+
+
+# -- seeding ------------------------------------------------------------------
+
+def _reset(engine):
+    from database.database import Base
+    from models import books, borrow, change, job, user, waitlist  # noqa: F401
+
+    if engine.dialect.name == "sqlite":
+        # Also drops the FTS tables, which are not in the metadata
+        engine.dispose()
+        if engine.url.database and os.path.exists(engine.url.database):
+            os.remove(engine.url.database)
+        return
+    Base.metadata.drop_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS schema_version"))
+
+
+def seed(url: str, users: int, books: int, borrows: int, batch: int = 50_000) -> dict:
+    from database.migrations import upgrade
+    from models.books import Book
+    from models.borrow import Borrow
+    from models.user import User
+    from utils import blob_store
+    from utils.passwords import pwd
+
+    engine = create_engine(url)
+    _reset(engine)
+    upgrade(engine)
+    # Every user shares one hash; hashing per user would dominate seeding
+    password = pwd.hash(PASSWORD)
+    pdf_ref = blob_store.store_bytes(PDF_BYTES)
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    first_reader = CYCLE_USERS + 2
+
+    def user_row(i: int, name: str, is_admin: bool = False) -> dict:
+        return {"id": i, "username": name, "full_name": name, "email": f"{name}@example.com", "password": password, "is_admin": is_admin}
+
+    with engine.begin() as conn:
+        conn.execute(insert(User), [user_row(1, ADMIN, True)] + [user_row(i + 2, f"cycle{i}") for i in range(CYCLE_USERS)])
+        for start in range(0, users, batch):
+            conn.execute(insert(User), [
+                user_row(first_reader + i, f"reader{i}") for i in range(start, min(start + batch, users))
+            ])
+        for start in range(1, books + 1, batch):
+            conn.execute(insert(Book), [
+                {
+                    "id": i,
+                    "title": f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}",
+                    "author": f"Author {i % 5000}",
+                    "category": f"category{i % 40}",
+                    "description": f"A synthetic book about the {rng.choice(WORDS)}",
+                    "file_path": pdf_ref,
+                    "total_copies": COPIES,
+                    "available_copies": COPIES,
+                }
+                for i in range(start, min(start + batch, books + 1))
+            ])
+
+        open_pairs = set()
+        on_loan = defaultdict(int)
+        done = 0
+        while done < borrows:
+            chunk = []
+            for _ in range(min(batch, borrows - done)):
+                user_id, book_id = rng.randint(first_reader, first_reader + users - 1), rng.randint(1, books)
+                status = rng.choice(STATUSES)
+                # Respect uq_borrows_open_user_book and leave every book one free copy
+                if status in ("pending", "approved") and (
+                    (user_id, book_id) in open_pairs or (status == "approved" and on_loan[book_id] >= COPIES - 1)
+                ):
+                    status = "returned"
+                if status in ("pending", "approved"):
+                    open_pairs.add((user_id, book_id))
+                if status == "approved":
+                    on_loan[book_id] += 1
+                requested = now - timedelta(days=rng.randint(0, 365))
+                chunk.append({
+                    "user_id": user_id,
+                    "book_id": book_id,
+                    "request_date": requested,
+                    "requested_borrow_date": requested + timedelta(days=1),
+                    "requested_return_date": requested + timedelta(days=8),
+                    "borrow_date": requested + timedelta(days=1) if status in ("approved", "returned") else None,
+                    "status": status,
+                    "is_returned": status == "returned",
+                })
+            conn.execute(insert(Borrow), chunk)
+            done += len(chunk)
+        if on_loan:
+            conn.execute(
+                update(Book.__table__)
+                .where(Book.__table__.c.id == bindparam("book_id"))
+                .values(available_copies=COPIES - bindparam("loans")),
+                [{"book_id": book_id, "loans": loans} for book_id, loans in on_loan.items()],
+            )
+    engine.dispose()
+    return {"url": url, "users": users, "books": books, "borrows": borrows}
+
+
+# -- running ------------------------------------------------------------------
+
+class Context:
+    """What the flows need from the seeded database, plus tokens."""
+
+    def __init__(self, url: str, concurrency: int):
+        from models.books import Book
+        from models.borrow import Borrow
+        from models.user import User
+
+        engine = create_engine(url)
+        with engine.connect() as conn:
+            self.books = conn.execute(select(func.max(Book.id))).scalar() or 0
+            self.borrows = conn.execute(select(func.count(Borrow.id))).scalar()
+            self.readers = conn.execute(select(func.count(User.id)).where(User.username.like("reader%"))).scalar()
+            self.cycle_users = [f"cycle{i}" for i in range(min(concurrency, CYCLE_USERS))]
+            # Readers with an approved loan may view that book's PDF
+            self.pdf_pairs = conn.execute(
+                select(User.username, Borrow.book_id)
+                .join(User, User.id == Borrow.user_id)
+                .where(Borrow.status == "approved", Borrow.is_returned == False)
+                .order_by(Borrow.id)
+                .limit(concurrency)
+            ).all()
+        engine.dispose()
+        if not self.books or not self.pdf_pairs:
+            raise SystemExit("Database is not seeded; run `python -m benchmarks.api_load seed` first")
+        self.tokens = {}
+
+    async def login(self, client, usernames):
+        semaphore = asyncio.Semaphore(16)
+
+        async def one(username):
+            async with semaphore:
+                response = await client.post("/auth/login", data={"username": username, "password": PASSWORD})
+                response.raise_for_status()
+                self.tokens[username] = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        await asyncio.gather(*(one(name) for name in usernames))
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, client, step: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies[step].append((time.perf_counter() - start) * 1000)
+        if response.status_code >= 400:
+            self.errors[step] += 1
+        return response
+
+
+async def catalog_list(client, ctx, rec, worker, rng):
+    after_id = rng.randint(0, max(ctx.books - 50, 0))
+    await rec.call(client, "catalog_list", "GET", "/books/", params={"after_id": after_id, "limit": 50})
+
+
+async def search(client, ctx, rec, worker, rng):
+    await rec.call(client, "search", "GET", "/books/search", params={"query": rng.choice(WORDS), "limit": 20})
+
+
+async def login(client, ctx, rec, worker, rng):
+    username = ctx.cycle_users[worker % len(ctx.cycle_users)]
+    await rec.call(client, "login", "POST", "/auth/login", data={"username": username, "password": PASSWORD})
+
+
+async def borrow_cycle(client, ctx, rec, worker, rng):
+    """request -> admin approve -> return, as one user per client"""
+    headers = ctx.tokens[ctx.cycle_users[worker % len(ctx.cycle_users)]]
+    book_id = rng.randint(1, ctx.books)
+    now = datetime.utcnow()
+    response = await rec.call(client, "borrow_request", "POST", "/borrow/request", headers=headers, json={
+        "book_id": book_id,
+        "requested_borrow_date": (now + timedelta(days=1)).isoformat(),
+        "requested_return_date": (now + timedelta(days=8)).isoformat(),
+    })
+    if response.status_code != 201:
+        return
+    response = await rec.call(client, "borrow_approve", "POST", "/borrow/approve", headers=ctx.tokens[ADMIN], json={
+        "borrow_id": response.json()["id"], "approve": True,
+    })
+    if response.status_code != 200:
+        return
+    await rec.call(client, "borrow_return", "POST", "/borrow/return", headers=headers, json={"book_id": book_id})
+
+
+async def pdf_view(client, ctx, rec, worker, rng):
+    username, book_id = ctx.pdf_pairs[worker % len(ctx.pdf_pairs)]
+    await rec.call(client, "pdf_view", "GET", f"/books/{book_id}/view", headers=ctx.tokens[username])
+
+
+async def my_borrows(client, ctx, rec, worker, rng):
+    username, _ = ctx.pdf_pairs[worker % len(ctx.pdf_pairs)]
+    await rec.call(client, "my_borrows", "GET", "/borrow/my", headers=ctx.tokens[username], params={"limit": 100})
+
+
+FLOW_FUNCTIONS = {fn.__name__: fn for fn in (catalog_list, search, login, borrow_cycle, pdf_view, my_borrows)}
+
+
+async def scrape_queries(client) -> dict:
+    """(method, route) -> [statement sum, request count] from /metrics."""
+    totals = defaultdict(lambda: [0.0, 0])
+    response = await client.get("/metrics")
+    for line in response.text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            kind, method, route, value = match.groups()
+            totals[(method, route)][0 if kind == "sum" else 1] = float(value)
+    return totals
+
+
+def percentile(values: list, q: float) -> float:
+    # Nearest rank on sorted values
+    return values[max(0, min(len(values) - 1, int(round(q * len(values))) - 1))]
+
+
+async def run_flow(client, ctx, flow: str, iterations: int, concurrency: int) -> dict:
+    fn = FLOW_FUNCTIONS[flow]
+    rec = Recorder()
+    remaining = [iterations]
+
+    async def worker(index: int):
+        rng = random.Random(index)
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            await fn(client, ctx, rec, index, rng)
+
+    before = await scrape_queries(client)
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    after = await scrape_queries(client)
+
+    steps = {}
+    for step, samples in rec.latencies.items():
+        samples.sort()
+        queries_before, queries_after = before[ROUTES[step]], after[ROUTES[step]]
+        count = queries_after[1] - queries_before[1]
+        steps[step] = {
+            "requests": len(samples),
+            "errors": rec.errors[step],
+            "rps": round(len(samples) / elapsed, 1),
+            "p50_ms": round(percentile(samples, 0.50), 2),
+            "p95_ms": round(percentile(samples, 0.95), 2),
+            "p99_ms": round(percentile(samples, 0.99), 2),
+            "db_queries": round((queries_after[0] - queries_before[0]) / count, 2) if count else None,
+        }
+    return {
+        "iterations": iterations,
+        "seconds": round(elapsed, 2),
+        "rps": round(sum(len(s) for s in rec.latencies.values()) / elapsed, 1),
+        "steps": steps,
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_uvicorn(workers: int):
+    port = _free_port()
+    proc = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(workers), "--log-level", "warning", "--no-access-log",
+    ])
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"uvicorn exited with {proc.returncode}")
+        try:
+            urllib.request.urlopen(f"{base_url}/books/?limit=1", timeout=1).read()
+            return proc, base_url
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("uvicorn did not start within 60s")
+
+
+async def run(args) -> dict:
+    import httpx
+
+    ctx = Context(args.url, args.concurrency)
+    server = None
+    if args.mode == "uvicorn":
+        server, base_url = start_uvicorn(args.workers)
+        client = httpx.AsyncClient(base_url=base_url, timeout=60, limits=httpx.Limits(max_connections=args.concurrency))
+    else:
+        from main import app
+
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60)
+    try:
+        async with client:
+            await ctx.login(client, [ADMIN] + ctx.cycle_users + sorted({name for name, _ in ctx.pdf_pairs}))
+            flows = {}
+            for flow in args.flows:
+                flows[flow] = await run_flow(client, ctx, flow, args.requests, args.concurrency)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        else:
+            # The ASGI transport skips lifespan, so close the async pool here
+            from database.database import async_engine
+
+            if async_engine is not None:
+                await async_engine.dispose()
+    return {
+        "mode": args.mode,
+        "workers": args.workers if args.mode == "uvicorn" else None,
+        "url": args.url,
+        "db_async": os.getenv("DB_ASYNC", "false"),
+        "data": {"books": ctx.books, "readers": ctx.readers, "borrows": ctx.borrows},
+        "concurrency": args.concurrency,
+        "flows": flows,
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> dict:
+    """Per step changes against baseline. Slower RPS or p95 beyond tolerance,
+    or any extra SQL statement per request, counts as a regression."""
+    steps = {}
+    regressions = []
+    for flow, result in current["flows"].items():
+        for step, stats in result["steps"].items():
+            base = baseline.get("flows", {}).get(flow, {}).get("steps", {}).get(step)
+            if not base:
+                continue
+            change = {
+                "rps": round(stats["rps"] / base["rps"] - 1, 3) if base["rps"] else None,
+                "p95_ms": round(stats["p95_ms"] / base["p95_ms"] - 1, 3) if base["p95_ms"] else None,
+                "db_queries": (
+                    round(stats["db_queries"] - base["db_queries"], 2)
+                    if stats["db_queries"] is not None and base["db_queries"] is not None else None
+                ),
+            }
+            steps[f"{flow}.{step}"] = change
+            if (
+                (change["rps"] is not None and change["rps"] < -tolerance)
+                or (change["p95_ms"] is not None and change["p95_ms"] > tolerance)
+                or (change["db_queries"] is not None and change["db_queries"] > 0)
+            ):
+                regressions.append(f"{flow}.{step}")
+    # Numbers from a different setup are not comparable; say so next to them
+    mismatched = [key for key in ("mode", "workers", "url", "db_async", "concurrency") if current.get(key) != baseline.get(key)]
+    # borrow_cycle adds borrows on every run, so only the catalog and readers must match
+    mismatched += [
+        f"data.{key}" for key in ("books", "readers")
+        if current["data"][key] != baseline.get("data", {}).get(key)
+    ]
+    return {"tolerance": tolerance, "mismatched_settings": mismatched, "steps": steps, "regressions": regressions}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = commands.add_parser("seed", help="create and fill the scratch database")
+    seed_parser.add_argument("--scale", choices=SCALES, default="10k")
+    seed_parser.add_argument("--users", type=int, help="override the scale's reader count")
+    seed_parser.add_argument("--books", type=int)
+    seed_parser.add_argument("--borrows", type=int)
+    seed_parser.add_argument("--url", default=DEFAULT_URL)
+
+    run_parser = commands.add_parser("run", help="drive the app and report per-step numbers")
+    run_parser.add_argument("--url", default=DEFAULT_URL)
+    run_parser.add_argument("--mode", choices=["inprocess", "uvicorn"], default="inprocess")
+    run_parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    run_parser.add_argument("--flows", nargs="+", choices=FLOWS, default=FLOWS)
+    run_parser.add_argument("--requests", type=int, default=1000, help="iterations per flow")
+    run_parser.add_argument("--concurrency", type=int, default=32)
+    run_parser.add_argument("--out", help="also write the JSON result here")
+    run_parser.add_argument("--baseline", help="saved result to compare against")
+    run_parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args()
+
+    # The app reads its database from the environment at import time
+    os.environ["DATABASE_URL"] = args.url
+    os.environ.setdefault("SCHEDULER_ENABLED", "false")
+    # Every simulated client shares one address; the limits would measure themselves
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    # Keeps stdout clean for the JSON report (httpx logs every request at INFO)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    if args.command == "seed":
+        users, books, borrows = SCALES[args.scale]
+        print(json.dumps(seed(args.url, args.users or users, args.books or books, args.borrows or borrows), indent=2))
+        return
+
+    if args.concurrency > CYCLE_USERS and "borrow_cycle" in args.flows:
+        parser.error(f"borrow_cycle supports at most {CYCLE_USERS} concurrent clients")
+    report = asyncio.run(run(args))
+    if args.out:
+        with open(args.out, "w") as out:
+            json.dump(report, out, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["comparison"] = compare(report, json.load(f), args.tolerance)
+    print(json.dumps(report, indent=2))
+    if args.baseline and report["comparison"]["regressions"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Query plans and latencies of the borrow ledger lookups, with and without indexes.
+
+Seeds a separate database (SQLite file by default) with synthetic borrows and
+times the queries behind request_borrow/view_pdf, /borrow/pending,
+/borrow/status and /borrow/my.
+
+Usage: python -m benchmarks.borrow_indexes [--rows 1000000] [--url sqlite:///./bench_borrows.db]
+"""
+import argparse
+import random
+import time
+from datetime import datetime
+from sqlalchemy import create_engine, insert, text
+from models.borrow import Borrow
+from models.books import Book
+from models.user import User
+
+STATUSES = ["returned"] * 6 + ["rejected"] * 2 + ["approved", "pending"]
+
+QUERIES = {
+    "open_borrow_lookup": (
+        "SELECT id FROM borrows WHERE user_id = :user_id AND book_id = :book_id "
+        "AND status = 'approved' AND is_returned = false LIMIT 1"
+    ),
+    "pending_page": "SELECT id FROM borrows WHERE status = 'pending' ORDER BY id LIMIT 100",
+    "book_not_returned_count": "SELECT count(*) FROM borrows WHERE book_id = :book_id AND is_returned = false",
+    "my_borrows_page": "SELECT id FROM borrows WHERE user_id = :user_id ORDER BY id LIMIT 100",
+}
+
+
+def seed(engine, rows: int, users: int, books: int, batch: int = 50000):
+    tables = [User.__table__, Book.__table__, Borrow.__table__]
+    User.metadata.drop_all(engine, tables=tables)
+    User.metadata.create_all(engine, tables=tables)
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{"id": i, "username": f"user{i}", "email": f"user{i}@example.com"} for i in range(1, users + 1)])
+        conn.execute(insert(Book), [{"id": i, "title": f"Book {i}", "author": "Author", "total_copies": 5, "available_copies": 5} for i in range(1, books + 1)])
+        open_pairs = set()
+        done = 0
+        while done < rows:
+            chunk = []
+            for _ in range(min(batch, rows - done)):
+                user_id, book_id = rng.randint(1, users), rng.randint(1, books)
+                status = rng.choice(STATUSES)
+                if status in ("pending", "approved"):
+                    # Respect uq_borrows_open_user_book
+                    if (user_id, book_id) in open_pairs:
+                        status = "returned"
+                    else:
+                        open_pairs.add((user_id, book_id))
+                chunk.append({
+                    "user_id": user_id, "book_id": book_id, "request_date": now,
+                    "status": status, "is_returned": status == "returned",
+                })
+            conn.execute(insert(Borrow), chunk)
+            done += len(chunk)
+
+
+def plan(conn, sql: str, params: dict) -> str:
+    if conn.dialect.name == "sqlite":
+        rows = conn.execute(text("EXPLAIN QUERY PLAN " + sql), params).all()
+        return " | ".join(row[-1] for row in rows)
+    rows = conn.execute(text("EXPLAIN " + sql), params).all()
+    return " | ".join(row[0].strip() for row in rows)
+
+
+def measure(engine, runs: int, users: int, books: int) -> dict:
+    rng = random.Random(7)
+    results = {}
+    with engine.connect() as conn:
+        for name, sql in QUERIES.items():
+            samples = []
+            for _ in range(runs):
+                params = {"user_id": rng.randint(1, users), "book_id": rng.randint(1, books)}
+                start = time.perf_counter()
+                conn.execute(text(sql), params).all()
+                samples.append((time.perf_counter() - start) * 1000)
+            samples.sort()
+            results[name] = {
+                "plan": plan(conn, sql, {"user_id": 1, "book_id": 1}),
+                "p50_ms": round(samples[len(samples) // 2], 3),
+                "max_ms": round(samples[-1], 3),
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="sqlite:///./bench_borrows.db")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--books", type=int, default=50_000)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    start = time.perf_counter()
+    seed(engine, args.rows, args.users, args.books)
+    print(f"Seeded {args.rows} borrows in {time.perf_counter() - start:.1f}s")
+
+    indexes = list(Borrow.__table__.indexes)
+    for index in indexes:
+        index.drop(engine)
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+    without = measure(engine, args.runs, args.users, args.books)
+
+    for index in indexes:
+        index.create(engine)
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+    with_indexes = measure(engine, args.runs, args.users, args.books)
+
+    for name in QUERIES:
+        print(f"\n{name}")
+        print(f"  without indexes: p50 {without[name]['p50_ms']} ms, max {without[name]['max_ms']} ms")
+        print(f"    plan: {without[name]['plan']}")
+        print(f"  with indexes:    p50 {with_indexes[name]['p50_ms']} ms, max {with_indexes[name]['max_ms']} ms")
+        print(f"    plan: {with_indexes[name]['plan']}")
+
+
+if __name__ == "__main__":
+    main()
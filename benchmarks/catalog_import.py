@@ -0,0 +1,89 @@
+"""Bulk catalog import throughput in rows/sec.
+
+Generates a synthetic CSV feed, imports it into a separate database (all
+inserts), then imports it again (all ISBN upserts). Each pass is compared
+with the old path of one INSERT and commit per book, as POST /books/ does,
+on a sample of rows.
+
+Usage: python -m benchmarks.catalog_import [--rows 200000] [--url sqlite:///./bench_import.db]
+"""
+import argparse
+import csv
+import io
+import json
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from database.migrations import upgrade
+from models.books import Book
+from utils.catalog_import import BATCH_SIZE, import_books
+
+FIELDS = ["isbn", "title", "author", "category", "description", "total_copies", "available_copies"]
+
+
+def make_feed(rows: int, prefix: str = "978") -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for i in range(rows):
+        writer.writerow([f"{prefix}{i:010d}", f"Book {i}", f"Author {i % 5000}", f"category{i % 40}", "A synthetic book", 3, 3])
+    return buffer.getvalue()
+
+
+def timed_import(session_factory, feed: str, batch_size: int) -> dict:
+    start = time.perf_counter()
+    result = import_books(io.StringIO(feed), "csv", batch_size, session_factory)
+    elapsed = time.perf_counter() - start
+    return {
+        "rows": result["rows"],
+        "inserted": result["inserted"],
+        "updated": result["updated"],
+        "failed": result["failed"],
+        "seconds": round(elapsed, 2),
+        "rows_per_sec": round(result["rows"] / elapsed, 1),
+    }
+
+
+def one_by_one(session_factory, rows: int) -> dict:
+    db = session_factory()
+    start = time.perf_counter()
+    try:
+        for i in range(rows):
+            book = Book(isbn=f"979{i:010d}", title=f"Book {i}", author="Author", total_copies=3, available_copies=3)
+            db.add(book)
+            db.commit()
+            db.refresh(book)
+    finally:
+        db.close()
+    elapsed = time.perf_counter() - start
+    return {"rows": rows, "seconds": round(elapsed, 2), "rows_per_sec": round(rows / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--single-rows", type=int, default=2000, help="rows for the one-at-a-time baseline")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--url", default="sqlite:///./bench_import.db")
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    Book.metadata.drop_all(engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE IF EXISTS schema_version")
+    upgrade(engine)
+    session_factory = sessionmaker(bind=engine, autoflush=False)
+
+    feed = make_feed(args.rows)
+    report = {
+        "url": args.url,
+        "batch_size": args.batch_size,
+        "bulk_insert": timed_import(session_factory, feed, args.batch_size),
+        "bulk_upsert": timed_import(session_factory, feed, args.batch_size),
+        "one_by_one": one_by_one(session_factory, args.single_rows),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Login throughput and latency under concurrent clients, in process.
+
+Drives main.app through httpx's ASGI transport (no network), so the numbers
+cover routing, the DB lookup and password verification on the hash pool.
+Needs httpx and a migrated database.
+
+Usage: python -m benchmarks.login_load [--requests 500] [--concurrency 50]
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+
+USERNAME = "bench_login"
+PASSWORD = "bench-password"
+
+
+async def run(requests: int, concurrency: int) -> dict:
+    import httpx
+    from main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post("/auth/signup", json={
+            "username": USERNAME, "full_name": "Bench", "email": "bench_login@example.com", "password": PASSWORD,
+        })
+
+        latencies = []
+        statuses = Counter()
+        queue = asyncio.Queue()
+        for _ in range(requests):
+            queue.put_nowait(None)
+
+        async def client_loop():
+            while not queue.empty():
+                queue.get_nowait()
+                start = time.perf_counter()
+                response = await client.post("/auth/login", data={"username": USERNAME, "password": PASSWORD})
+                latencies.append((time.perf_counter() - start) * 1000)
+                statuses[response.status_code] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2], 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1], 2),
+        "statuses": dict(statuses),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    # Measures the login path itself, not the per-IP limit in front of it
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    print(json.dumps(asyncio.run(run(args.requests, args.concurrency)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
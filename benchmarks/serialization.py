@@ -0,0 +1,115 @@
+"""Per-row cost of serializing a borrow list page, before and after the fast path.
+
+"before" is the old route body: three Pydantic models per row, then FastAPI's
+own response handling (dump, validate against response_model, encode,
+json.dumps). "after" is router.borrow._serialize_row into plain dicts and
+utils.serialize.dump_json (one validation pass, encoded by pydantic-core).
+No database is involved; rows are synthetic LIST_COLUMNS tuples.
+
+Usage: python -m benchmarks.serialization [--rows 1000] [--repeat 20]
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from router.borrow import LIST_COLUMNS, _serialize_row
+from schema.borrow import BorrowBookInfo, BorrowPage, BorrowResponse, BorrowUserInfo
+from utils import serialize
+
+Row = namedtuple("Row", [column.key for column in LIST_COLUMNS])
+
+
+def make_rows(count: int) -> list:
+    now = datetime.utcnow()
+    return [
+        Row(
+            id=i,
+            request_date=now,
+            requested_borrow_date=now + timedelta(days=1),
+            requested_return_date=now + timedelta(days=8),
+            borrow_date=now if i % 2 else None,
+            return_date=None,
+            status="approved" if i % 2 else "pending",
+            is_returned=False,
+            overdue_since=None,
+            book_id=i % 500,
+            book_title=f"Book {i % 500}",
+            book_author="Author",
+            user_id=i % 300,
+            user_username=f"user{i % 300}",
+            user_email=f"user{i % 300}@example.com",
+        )
+        for i in range(count)
+    ]
+
+
+def legacy_row(row) -> BorrowResponse:
+    """The per-row serializer this benchmark replaces."""
+    user_info = None
+    if row.user_id is not None:
+        user_info = BorrowUserInfo(id=row.user_id, username=row.user_username, email=row.user_email)
+    return BorrowResponse(
+        id=row.id,
+        book=BorrowBookInfo(id=row.book_id, title=row.book_title, author=row.book_author),
+        user=user_info,
+        request_date=row.request_date,
+        requested_borrow_date=row.requested_borrow_date,
+        requested_return_date=row.requested_return_date,
+        borrow_date=row.borrow_date,
+        return_date=row.return_date,
+        status=row.status,
+        is_returned=row.is_returned,
+        overdue_since=row.overdue_since,
+    )
+
+
+async def before(rows: list, field) -> bytes:
+    page = BorrowPage(items=[legacy_row(row) for row in rows], next_cursor=None)
+    content = await serialize_response(field=field, response_content=page)
+    return JSONResponse(content).body
+
+
+async def after(rows: list) -> bytes:
+    return serialize.dump_json(BorrowPage, {"items": [_serialize_row(row) for row in rows], "next_cursor": None})
+
+
+async def timed(fn, rows: list, repeat: int, *args) -> float:
+    """Best per-row time over repeat runs, in microseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn(rows, *args)
+        best = min(best, time.perf_counter() - start)
+    return best / len(rows) * 1e6
+
+
+async def run(rows: int, repeat: int) -> dict:
+    field = create_model_field(name="Response", type_=BorrowPage, mode="serialization")
+    data = make_rows(rows)
+    # Both paths must produce the same document
+    assert json.loads(await before(data, field)) == json.loads(await after(data))
+    old = await timed(before, data, repeat, field)
+    new = await timed(after, data, repeat)
+    return {
+        "rows": rows,
+        "before_us_per_row": round(old, 2),
+        "after_us_per_row": round(new, 2),
+        "speedup": round(old / new, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.rows, args.repeat)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
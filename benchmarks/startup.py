@@ -0,0 +1,54 @@
+"""Cold-start time of N app workers booting at the same time.
+
+Each worker is a fresh interpreter that imports main (the same work a uvicorn
+worker does before it can serve), timed from process start.
+
+Usage: python -m benchmarks.startup [--workers 8]
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+WORKER = (
+    "import time; start = time.perf_counter(); import main; "
+    "print(time.perf_counter() - start)"
+)
+
+
+def boot(workers: int) -> dict:
+    start = time.perf_counter()
+    procs = [
+        subprocess.Popen([sys.executable, "-c", WORKER], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        for _ in range(workers)
+    ]
+    import_times = []
+    failures = 0
+    for proc in procs:
+        out, err = proc.communicate()
+        if proc.returncode != 0:
+            failures += 1
+            print(err.strip().splitlines()[-1], file=sys.stderr)
+            continue
+        import_times.append(float(out.strip().splitlines()[-1]))
+    wall = time.perf_counter() - start
+    import_times.sort()
+    return {
+        "workers": workers,
+        "failures": failures,
+        "wall_s": round(wall, 3),
+        "import_p50_s": round(import_times[len(import_times) // 2], 3) if import_times else None,
+        "import_max_s": round(import_times[-1], 3) if import_times else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+    print(json.dumps(boot(args.workers), indent=2))
+
+
+if __name__ == "__main__":
+    main()
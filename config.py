@@ -9,16 +9,103 @@ class Settings:
     DB_USER: str = os.getenv("DB_USER")
     DB_PASSWORD: str = os.getenv("DB_PASSWORD")
     DB_NAME: str = os.getenv("DB_NAME")
+    # Full SQLAlchemy URL, overriding the DB_* settings (benchmarks point it at a scratch database)
+    DATABASE_URL: str | None = os.getenv("DATABASE_URL")
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key")
     ALGORITHM: str = os.getenv("ALGORITHM", "HS256")
-    ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "1440"))
+    # Access tokens are short-lived; clients renew them with a refresh token
+    ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+    REFRESH_TOKEN_EXPIRE_DAYS: float = float(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+    TOKEN_CACHE_SIZE: int = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+    # How often a worker picks up tokens revoked by other workers
+    TOKEN_REVOCATION_SYNC_SECONDS: float = float(os.getenv("TOKEN_REVOCATION_SYNC_SECONDS", "5"))
+    PDF_STORE_DIR: str = os.getenv("PDF_STORE_DIR", "./storage/pdfs")
+    USER_CACHE_SIZE: int = int(os.getenv("USER_CACHE_SIZE", "10000"))
+    # Other workers' user changes arrive with the revocation sync; the TTL only
+    # bounds changes made to the users table outside the app
+    USER_CACHE_TTL_SECONDS: float = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+    # Run route database work on AsyncSession (asyncpg / aiosqlite) instead of the threadpool
+    DB_ASYNC: bool = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
+    # pbkdf2_sha256 work factor; hashes with other round counts are upgraded on login
+    PASSWORD_HASH_ROUNDS: int = int(os.getenv("PASSWORD_HASH_ROUNDS", "29000"))
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", "0"))  # 0 = CPU count
+    PASSWORD_MAX_CONCURRENT: int = int(os.getenv("PASSWORD_MAX_CONCURRENT", "0"))  # 0 = workers
+    PASSWORD_MAX_WAITING: int = int(os.getenv("PASSWORD_MAX_WAITING", "64"))
+    PASSWORD_WAIT_TIMEOUT: float = float(os.getenv("PASSWORD_WAIT_TIMEOUT", "5"))
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "json")  # json or text
+    # Fraction of DEBUG/INFO records kept; warnings and errors are never sampled out
+    LOG_SAMPLE_RATE: float = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+    # Let app startup apply pending migrations itself (handy for SQLite dev)
+    AUTO_MIGRATE: bool = os.getenv("AUTO_MIGRATE", "false").lower() in ("1", "true", "yes")
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    # Hot-read cache; set CACHE_BACKEND_URL (redis://...) to share it between workers
+    CACHE_BACKEND_URL: str | None = os.getenv("CACHE_BACKEND_URL")
+    READ_CACHE_TTL_SECONDS: float = float(os.getenv("READ_CACHE_TTL_SECONDS", "60"))
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+    # Background jobs; every worker runs the scheduler but a lease lets one run each job
+    SCHEDULER_ENABLED: bool = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+    OVERDUE_CHECK_INTERVAL_SECONDS: float = float(os.getenv("OVERDUE_CHECK_INTERVAL_SECONDS", "300"))
+    PENDING_EXPIRY_INTERVAL_SECONDS: float = float(os.getenv("PENDING_EXPIRY_INTERVAL_SECONDS", "900"))
+    PENDING_REQUEST_MAX_AGE_HOURS: float = float(os.getenv("PENDING_REQUEST_MAX_AGE_HOURS", "72"))
+    JOB_BATCH_SIZE: int = int(os.getenv("JOB_BATCH_SIZE", "500"))
+    # Admin dashboard change feed: how often a stream checks for other workers'
+    # changes, and how long the change log is kept
+    CHANGE_POLL_SECONDS: float = float(os.getenv("CHANGE_POLL_SECONDS", "5"))
+    CHANGE_LOG_RETENTION_HOURS: float = float(os.getenv("CHANGE_LOG_RETENTION_HOURS", "24"))
+    # Usage statistics lag the borrow ledger by at most this much
+    USAGE_ROLLUP_INTERVAL_SECONDS: float = float(os.getenv("USAGE_ROLLUP_INTERVAL_SECONDS", "60"))
+    # Responses of at least COMPRESSION_MIN_BYTES are gzip/brotli compressed when the client accepts it
+    COMPRESSION_MIN_BYTES: int = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+    GZIP_LEVEL: int = int(os.getenv("GZIP_LEVEL", "6"))
+    BROTLI_QUALITY: int = int(os.getenv("BROTLI_QUALITY", "4"))
+    STATIC_DIR: str = os.getenv("STATIC_DIR", "frontend")
+    # List ETags come from the change version, which a worker re-reads at most this often
+    LIST_ETAG_MAX_LAG_SECONDS: float = float(os.getenv("LIST_ETAG_MAX_LAG_SECONDS", "1"))
+    # Production runner (python -m utils.server): forked workers sharing one socket
+    SERVER_HOST: str = os.getenv("SERVER_HOST", "0.0.0.0")
+    SERVER_PORT: int = int(os.getenv("SERVER_PORT", "8000"))
+    SERVER_WORKERS: int = int(os.getenv("SERVER_WORKERS", "0"))  # 0 = CPU count
+    # On SIGTERM a worker stops accepting and gives requests in flight this long to finish
+    SHUTDOWN_DRAIN_SECONDS: float = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "30"))
+    # Token buckets as "N/SECONDS" (bursts of N, refilled at N per SECONDS): login and
+    # signup per client IP, borrow requests per user. Buckets are shared through
+    # RATE_LIMIT_BACKEND_URL: sqlite:///PATH (workers on one host), redis://... or memory://
+    RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+    RATE_LIMIT_BACKEND_URL: str = os.getenv("RATE_LIMIT_BACKEND_URL", "sqlite:///./storage/rate_limit.db")
+    RATE_LIMIT_LOGIN: str = os.getenv("RATE_LIMIT_LOGIN", "20/60")
+    RATE_LIMIT_SIGNUP: str = os.getenv("RATE_LIMIT_SIGNUP", "10/600")
+    RATE_LIMIT_BORROW_REQUEST: str = os.getenv("RATE_LIMIT_BORROW_REQUEST", "30/60")
+    # Cover images: sources are kept, thumbnails are a cache trimmed to COVER_CACHE_MAX_BYTES
+    COVER_STORE_DIR: str = os.getenv("COVER_STORE_DIR", "./storage/covers")
+    COVER_CACHE_MAX_BYTES: int = int(os.getenv("COVER_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+    COVER_MAX_SOURCE_BYTES: int = int(os.getenv("COVER_MAX_SOURCE_BYTES", str(10 * 1024 * 1024)))
+    COVER_WORKERS: int = int(os.getenv("COVER_WORKERS", "0"))  # 0 = min(4, CPU count)
+    COVER_FETCH_TIMEOUT: float = float(os.getenv("COVER_FETCH_TIMEOUT", "10"))
+    # Remote covers are only fetched from public addresses; for local development only
+    COVER_FETCH_ALLOW_PRIVATE: bool = os.getenv("COVER_FETCH_ALLOW_PRIVATE", "false").lower() in ("1", "true", "yes")
 
     @property
     def database_url(self) -> str:
+        if self.DATABASE_URL:
+            return self.DATABASE_URL
         if self.DB_HOST:
             return f"postgresql://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
         else:
             return "sqlite:///./library.db"
 
+    @property
+    def async_database_url(self) -> str:
+        if self.DATABASE_URL:
+            url = self.DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+            return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+        if self.DB_HOST:
+            return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
+        else:
+            return "sqlite+aiosqlite:///./library.db"
+
 
 settings =Settings()
\ No newline at end of file
@@ -1,19 +1,163 @@
+import functools
+import os
+import time
 from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
 from config import Settings
+from utils import serialize
+from utils.metrics import POOL_CHECKOUT_WAIT, instrument_engine
 
 Base = declarative_base()
 
-SQL_DB_URL = Settings().database_url
-engine = create_engine(SQL_DB_URL)
+settings = Settings()
+SQL_DB_URL = settings.database_url
+
+POOL_OPTIONS = dict(
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+)
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+
+# The sync engine is always available: startup DDL, CLI tools and sync mode use it
+engine = create_engine(SQL_DB_URL, poolclass=TimedQueuePool, **POOL_OPTIONS)
+instrument_engine(engine)
 
 # FIX: Renamed sessionlocal -> SessionLocal
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-def get_db():
+async_engine = None
+AsyncSessionLocal = None
+if settings.DB_ASYNC:
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+
+    async_engine = create_async_engine(settings.async_database_url, poolclass=TimedAsyncQueuePool, **POOL_OPTIONS)
+    instrument_engine(async_engine.sync_engine)
+    # Objects are returned to FastAPI after commit; expiring them would need
+    # lazy loads outside the session's greenlet
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+def _reset_pools_after_fork():
+    # Connections opened before a fork (startup checks in utils.server's parent)
+    # belong to the parent; the child starts with empty pools and leaves them alone
+    engine.dispose(close=False)
+    if async_engine is not None:
+        async_engine.sync_engine.dispose(close=False)
+
+os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+
+def _get_sync_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+async def _get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# The one session dependency for every router. In async mode it yields an
+# AsyncSession, which route bodies reach through db_route/run_db.
+get_db = _get_async_db if settings.DB_ASYNC else _get_sync_db
+
+
+async def run_db(db, fn, *args, **kwargs):
+    """Call fn(session, *args, **kwargs) without blocking the event loop.
+
+    With an AsyncSession the sync ORM code runs via run_sync on the async
+    driver; with a plain Session it goes to the threadpool as before.
+    """
+    if AsyncSessionLocal is not None and isinstance(db, AsyncSession):
+        return await db.run_sync(lambda session: fn(session, *args, **kwargs))
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+
+async def run_in_session(fn, *args, **kwargs):
+    """run_db with a short-lived session of its own, for code outside a route."""
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            return await run_db(db, fn, *args, **kwargs)
+
+    def call():
+        db = SessionLocal()
+        try:
+            return fn(db, *args, **kwargs)
+        finally:
+            db.close()
+
+    return await run_in_threadpool(call)
+
+
+def violates(error: IntegrityError, index) -> bool:
+    """Whether an IntegrityError was raised by the unique Index `index`.
+
+    PostgreSQL drivers report the constraint's name (asyncpg's error is the
+    cause of the adapter's); SQLite only names the indexed columns.
+    """
+    for source in (error.orig, getattr(error.orig, "__cause__", None)):
+        name = getattr(getattr(source, "diag", None), "constraint_name", None) or getattr(source, "constraint_name", None)
+        if name:
+            return name == index.name
+    columns = ", ".join(f"{index.table.name}.{column.name}" for column in index.columns)
+    return f"UNIQUE constraint failed: {columns}" in str(error.orig)
+
+
+def db_route(fn):
+    """Turn a sync route taking `db` into a native async route.
+
+    FastAPI still sees the original signature through __wrapped__, so the
+    handler body keeps using the regular Session API in both modes. In
+    DB_ASYNC mode the body runs on the event loop, so it must only do DB
+    work: file and CPU work belongs in an async route around run_db.
+    """
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        db = kwargs.pop("db")
+        if AsyncSessionLocal is not None and isinstance(db, AsyncSession):
+            result = await db.run_sync(lambda session: fn(*args, db=session, **kwargs))
+            # run_sync ran on the event loop; encoding a list response is CPU
+            # work, so it goes to the threadpool now that the DB part is done
+            if isinstance(result, serialize.PayloadResponse):
+                await run_in_threadpool(result.encode)
+            return result
+
+        def call():
+            result = fn(*args, db=db, **kwargs)
+            if isinstance(result, serialize.PayloadResponse):
+                result.encode()
+            return result
+
+        return await run_in_threadpool(call)
+
+    return wrapper
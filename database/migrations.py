@@ -0,0 +1,448 @@
+"""Versioned schema migrations.
+
+Usage: python -m database.migrations [upgrade|status]
+
+The schema_version table holds the version the database is at. `upgrade` runs
+every newer step in one transaction while holding a lock, so when several
+processes run it at once exactly one applies the steps and the others find
+nothing left to do. App startup only compares the stored version (see
+check_schema_version).
+"""
+import argparse
+import logging
+from sqlalchemy import (
+    Boolean, Column, Date, DateTime, Float, ForeignKey, Index, Integer, MetaData, String, Table, inspect, text,
+)
+from database.database import engine
+from config import Settings
+from utils.log import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary key for pg_advisory_xact_lock, shared by every migrating process
+ADVISORY_LOCK_KEY = 7341001
+
+
+def _create_tables(conn):
+    # The tables as they stood before migrations existed, spelled out rather
+    # than taken from the models so that every later schema change is a step
+    # of its own. Existing tables are left alone.
+    baseline = MetaData()
+    Table(
+        "users", baseline,
+        Column("id", Integer, primary_key=True),
+        Column("full_name", String),
+        Column("username", String, unique=True),
+        Column("email", String, unique=True),
+        Column("password", String(255)),
+        Column("is_admin", Boolean),
+    )
+    Table(
+        "books", baseline,
+        Column("id", Integer, primary_key=True),
+        Column("title", String),
+        Column("author", String),
+        Column("category", String),
+        Column("description", String),
+        Column("picture_url", String),
+        Column("file_path", String),
+        Column("total_copies", Integer),
+        Column("available_copies", Integer),
+    )
+    Table(
+        "borrows", baseline,
+        Column("id", Integer, primary_key=True),
+        Column("user_id", Integer, ForeignKey("users.id")),
+        Column("book_id", Integer, ForeignKey("books.id")),
+        Column("request_date", DateTime),
+        Column("requested_borrow_date", DateTime),
+        Column("requested_return_date", DateTime),
+        Column("borrow_date", DateTime),
+        Column("return_date", DateTime),
+        Column("status", String),
+        Column("is_returned", Boolean),
+    )
+    baseline.create_all(bind=conn)
+
+
+def _add_book_inventory_columns(conn):
+    # Databases created before these columns existed on the model
+    existing = {c["name"] for c in inspect(conn).get_columns("books")}
+    if "picture_url" not in existing:
+        conn.execute(text("ALTER TABLE books ADD COLUMN picture_url TEXT"))
+    if "total_copies" not in existing:
+        conn.execute(text("ALTER TABLE books ADD COLUMN total_copies INTEGER DEFAULT 1"))
+    if "available_copies" not in existing:
+        conn.execute(text("ALTER TABLE books ADD COLUMN available_copies INTEGER DEFAULT 1"))
+
+
+def _key_table(metadata: MetaData, name: str):
+    # Stands in for an existing table that a frozen one points foreign keys at
+    Table(name, metadata, Column("id", Integer, primary_key=True))
+
+
+def _create_frozen(conn, metadata: MetaData, *names: str):
+    """Create the named tables of a step's own metadata, with their indexes,
+    unless they exist. Any other table in it is only a foreign key target."""
+    metadata.create_all(bind=conn, tables=[metadata.tables[name] for name in names])
+
+
+def _create_borrow_indexes(conn):
+    # The baseline tables have no indexes. The unique one fails if the ledger
+    # already holds two open borrows for the same user and book.
+    borrows = Table(
+        "borrows", MetaData(),
+        Column("id", Integer),
+        Column("user_id", Integer),
+        Column("book_id", Integer),
+        Column("status", String),
+        Column("is_returned", Boolean),
+    )
+    open_borrow = text("is_returned = false AND status IN ('pending', 'approved')")
+    not_returned = text("is_returned = false")
+    for index in (
+        Index(
+            "uq_borrows_open_user_book", borrows.c.user_id, borrows.c.book_id,
+            unique=True, postgresql_where=open_borrow, sqlite_where=open_borrow,
+        ),
+        Index("ix_borrows_status_id", borrows.c.status, borrows.c.id),
+        Index("ix_borrows_user_id", borrows.c.user_id, borrows.c.id),
+        Index(
+            "ix_borrows_book_not_returned", borrows.c.book_id,
+            postgresql_where=not_returned, sqlite_where=not_returned,
+        ),
+    ):
+        index.create(bind=conn, checkfirst=True)
+
+
+SEARCH_PG_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_books_search ON books USING GIN (("
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(author, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(category, '')), 'C') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'D')))",
+    "CREATE INDEX IF NOT EXISTS ix_books_search_trgm ON books USING GIN ("
+    "(coalesce(title, '') || ' ' || coalesce(author, '')) gin_trgm_ops)",
+]
+
+SEARCH_SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE books_fts USING fts5(
+        title, author, category, description,
+        content='books', content_rowid='id', prefix='2 3'
+    )""",
+    """CREATE VIRTUAL TABLE books_trgm USING fts5(
+        title, author,
+        content='books', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER books_search_ai AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts(rowid, title, author, category, description)
+        VALUES (new.id, new.title, new.author, new.category, new.description);
+        INSERT INTO books_trgm(rowid, title, author) VALUES (new.id, new.title, new.author);
+    END""",
+    """CREATE TRIGGER books_search_ad AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author, category, description)
+        VALUES ('delete', old.id, old.title, old.author, old.category, old.description);
+        INSERT INTO books_trgm(books_trgm, rowid, title, author)
+        VALUES ('delete', old.id, old.title, old.author);
+    END""",
+    """CREATE TRIGGER books_search_au AFTER UPDATE OF title, author, category, description ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author, category, description)
+        VALUES ('delete', old.id, old.title, old.author, old.category, old.description);
+        INSERT INTO books_fts(rowid, title, author, category, description)
+        VALUES (new.id, new.title, new.author, new.category, new.description);
+        INSERT INTO books_trgm(books_trgm, rowid, title, author)
+        VALUES ('delete', old.id, old.title, old.author);
+        INSERT INTO books_trgm(rowid, title, author) VALUES (new.id, new.title, new.author);
+    END""",
+    # Index whatever was in books before the search tables existed
+    "INSERT INTO books_fts(books_fts) VALUES ('rebuild')",
+    "INSERT INTO books_trgm(books_trgm) VALUES ('rebuild')",
+]
+
+
+def _create_search_index(conn):
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        for stmt in SEARCH_PG_DDL:
+            conn.execute(text(stmt))
+    elif conn.dialect.name == "sqlite":
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'")
+        ).first()
+        if not exists:
+            for stmt in SEARCH_SQLITE_DDL:
+                conn.execute(text(stmt))
+
+
+def _add_book_isbn(conn):
+    existing = {c["name"] for c in inspect(conn).get_columns("books")}
+    if "isbn" not in existing:
+        conn.execute(text("ALTER TABLE books ADD COLUMN isbn VARCHAR"))
+    books = Table("books", MetaData(), Column("isbn", String))
+    # External key for catalog imports; books without an ISBN may repeat
+    Index("uq_books_isbn", books.c.isbn, unique=True).create(bind=conn, checkfirst=True)
+
+
+def _add_background_jobs(conn):
+    metadata = MetaData()
+    Table(
+        "job_leases", metadata,
+        Column("name", String, primary_key=True),
+        Column("owner", String),
+        Column("lease_until", DateTime),
+        Column("last_started_at", DateTime),
+        Column("last_finished_at", DateTime),
+        Column("last_duration", Float),
+        Column("last_rows", Integer),
+        Column("last_error", String),
+    )
+    _create_frozen(conn, metadata, "job_leases")
+    existing = {c["name"] for c in inspect(conn).get_columns("borrows")}
+    if "overdue_since" not in existing:
+        conn.execute(text("ALTER TABLE borrows ADD COLUMN overdue_since TIMESTAMP"))
+
+
+def _create_waitlist(conn):
+    metadata = MetaData()
+    _key_table(metadata, "books")
+    _key_table(metadata, "users")
+    Table(
+        "waitlist", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("book_id", Integer, ForeignKey("books.id", ondelete="CASCADE"), nullable=False),
+        Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        Column("position", Integer, nullable=False),
+        Column("loan_days", Integer, nullable=False),
+        Column("created_at", DateTime),
+        Index("uq_waitlist_book_position", "book_id", "position", unique=True),
+        Index("uq_waitlist_book_user", "book_id", "user_id", unique=True),
+    )
+    _create_frozen(conn, metadata, "waitlist")
+
+
+def _create_change_log(conn):
+    metadata = MetaData()
+    Table(
+        "change_log", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("version", Integer, nullable=False),
+        Column("entity", String, nullable=False),
+        Column("entity_id", Integer, nullable=False),
+        Column("action", String, nullable=False),
+        Column("created_at", DateTime),
+        Index("ix_change_log_version", "version"),
+    )
+    Table(
+        "change_counter", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("version", Integer, nullable=False),
+        Column("pruned_through", Integer, nullable=False),
+    )
+    _create_frozen(conn, metadata, "change_log", "change_counter")
+    conn.execute(text(
+        "INSERT INTO change_counter (id, version, pruned_through) SELECT 1, 0, 0 "
+        "WHERE NOT EXISTS (SELECT 1 FROM change_counter WHERE id = 1)"
+    ))
+
+
+def _add_book_cover(conn):
+    existing = {c["name"] for c in inspect(conn).get_columns("books")}
+    if "cover_digest" not in existing:
+        conn.execute(text("ALTER TABLE books ADD COLUMN cover_digest VARCHAR"))
+
+
+# Fills the usage tables from the ledger as utils.analytics.rebuild did when
+# they were introduced; a hand-over counts as both a request and an approval
+USAGE_BACKFILL = [
+    "INSERT INTO daily_usage (day, requests, approvals, rejections, returns) "
+    "SELECT day, sum(requests), sum(approvals), sum(rejections), sum(returns) FROM ("
+    " SELECT date(request_date) AS day, 1 AS requests, 0 AS approvals,"
+    "  CASE WHEN status = 'rejected' THEN 1 ELSE 0 END AS rejections, 0 AS returns"
+    "  FROM borrows WHERE request_date IS NOT NULL"
+    " UNION ALL SELECT date(borrow_date), 0, 1, 0, 0 FROM borrows WHERE borrow_date IS NOT NULL"
+    " UNION ALL SELECT date(return_date), 0, 0, 0, 1 FROM borrows"
+    "  WHERE is_returned = true AND return_date IS NOT NULL"
+    ") AS ledger GROUP BY day",
+    "INSERT INTO book_usage (book_id, requests, borrows) "
+    "SELECT borrows.book_id, count(*), count(borrows.borrow_date) FROM borrows "
+    "JOIN books ON books.id = borrows.book_id GROUP BY borrows.book_id",
+    "INSERT INTO category_usage (category, requests, borrows) "
+    "SELECT coalesce(books.category, ''), count(*), count(borrows.borrow_date) FROM borrows "
+    "JOIN books ON books.id = borrows.book_id GROUP BY coalesce(books.category, '')",
+    "INSERT INTO user_usage (user_id, active_borrows, total_borrows) "
+    "SELECT borrows.user_id,"
+    " count(CASE WHEN borrows.status = 'approved' AND borrows.is_returned = false THEN 1 END),"
+    " count(borrows.borrow_date) FROM borrows "
+    "JOIN users ON users.id = borrows.user_id WHERE borrows.borrow_date IS NOT NULL "
+    "GROUP BY borrows.user_id",
+]
+
+
+def _create_usage_tables(conn):
+    metadata = MetaData()
+    _key_table(metadata, "books")
+    _key_table(metadata, "users")
+    Table(
+        "usage_events", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("kind", String, nullable=False),
+        Column("book_id", Integer, nullable=False),
+        Column("user_id", Integer, nullable=False),
+        Column("created_at", DateTime),
+    )
+    Table(
+        "book_usage", metadata,
+        Column("book_id", Integer, ForeignKey("books.id", ondelete="CASCADE"), primary_key=True),
+        Column("requests", Integer, nullable=False),
+        Column("borrows", Integer, nullable=False),
+        Index("ix_book_usage_borrows", "borrows", "book_id"),
+    )
+    Table(
+        "category_usage", metadata,
+        Column("category", String, primary_key=True),
+        Column("requests", Integer, nullable=False),
+        Column("borrows", Integer, nullable=False),
+    )
+    Table(
+        "user_usage", metadata,
+        Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+        Column("active_borrows", Integer, nullable=False),
+        Column("total_borrows", Integer, nullable=False),
+        Index("ix_user_usage_active_borrows", "active_borrows", "user_id"),
+    )
+    Table(
+        "daily_usage", metadata,
+        Column("day", Date, primary_key=True),
+        Column("requests", Integer, nullable=False),
+        Column("approvals", Integer, nullable=False),
+        Column("rejections", Integer, nullable=False),
+        Column("returns", Integer, nullable=False),
+    )
+    names = ("usage_events", "book_usage", "category_usage", "user_usage", "daily_usage")
+    _create_frozen(conn, metadata, *names)
+
+    if conn.dialect.name == "postgresql":
+        # Holds off borrow writes until commit so the ledger and the tables agree
+        conn.execute(text("LOCK TABLE borrows IN SHARE MODE"))
+    for name in names:
+        conn.execute(text(f"DELETE FROM {name}"))
+    for stmt in USAGE_BACKFILL:
+        conn.execute(text(stmt))
+
+
+def _create_token_tables(conn):
+    metadata = MetaData()
+    _key_table(metadata, "users")
+    Table(
+        "refresh_tokens", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("token_hash", String, nullable=False),
+        Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        Column("created_at", DateTime),
+        Column("expires_at", DateTime, nullable=False),
+        Column("revoked_at", DateTime),
+        Index("uq_refresh_tokens_hash", "token_hash", unique=True),
+        Index("ix_refresh_tokens_user_id", "user_id"),
+    )
+    Table(
+        "revoked_tokens", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("jti", String),
+        Column("user_id", Integer),
+        Column("revoked_at", DateTime, nullable=False),
+        Column("expires_at", DateTime, nullable=False),
+        Index("ix_revoked_tokens_revoked_at", "revoked_at"),
+        Index("ix_revoked_tokens_expires_at", "expires_at"),
+    )
+    _create_frozen(conn, metadata, "refresh_tokens", "revoked_tokens")
+
+
+# (version, description, step). Append only; never renumber or edit a shipped step.
+# Steps spell out their own DDL instead of reading the models, so a model
+# change needs a step of its own and never alters what a shipped one does.
+MIGRATIONS = [
+    (1, "create tables", _create_tables),
+    (2, "add book picture and inventory columns", _add_book_inventory_columns),
+    (3, "borrow ledger indexes", _create_borrow_indexes),
+    (4, "catalog search index", _create_search_index),
+    (5, "book isbn for catalog imports", _add_book_isbn),
+    (6, "job leases and borrow overdue flag", _add_background_jobs),
+    (7, "book waitlist", _create_waitlist),
+    (8, "change log for dashboard updates", _create_change_log),
+    (9, "book cover digest", _add_book_cover),
+    (10, "usage statistics", _create_usage_tables),
+    (11, "refresh tokens and token revocations", _create_token_tables),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _lock(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version (id INTEGER PRIMARY KEY, version INTEGER NOT NULL)"
+    ))
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+    # On SQLite this first write takes the database write lock, which is held
+    # until the transaction ends
+    conn.execute(text(
+        "INSERT INTO schema_version (id, version) SELECT 1, 0 "
+        "WHERE NOT EXISTS (SELECT 1 FROM schema_version WHERE id = 1)"
+    ))
+    conn.execute(text("UPDATE schema_version SET version = version WHERE id = 1"))
+
+
+def current_version(conn) -> int:
+    if not inspect(conn).has_table("schema_version"):
+        return 0
+    version = conn.execute(text("SELECT version FROM schema_version WHERE id = 1")).scalar()
+    return version or 0
+
+
+def upgrade(bind=engine) -> list[int]:
+    """Apply pending migrations; returns the versions that were applied."""
+    applied = []
+    with bind.begin() as conn:
+        _lock(conn)
+        version = current_version(conn)
+        for step_version, description, step in MIGRATIONS:
+            if step_version <= version:
+                continue
+            logger.info("applying migration %s: %s", step_version, description)
+            step(conn)
+            applied.append(step_version)
+        if applied:
+            conn.execute(text("UPDATE schema_version SET version = :v WHERE id = 1"), {"v": applied[-1]})
+    return applied
+
+
+def check_schema_version(bind=engine):
+    """Startup check: one SELECT, no DDL. Migrates only when AUTO_MIGRATE is set."""
+    with bind.connect() as conn:
+        version = current_version(conn)
+    if version == LATEST_VERSION:
+        return
+    if version < LATEST_VERSION and Settings().AUTO_MIGRATE:
+        upgrade(bind)
+        return
+    raise RuntimeError(
+        f"Database schema is at version {version}, this code expects {LATEST_VERSION}. "
+        "Run `python -m database.migrations upgrade`."
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Database schema migrations")
+    parser.add_argument("command", nargs="?", default="upgrade", choices=["upgrade", "status"])
+    args = parser.parse_args()
+    setup_logging()
+    if args.command == "status":
+        with engine.connect() as conn:
+            print(f"Database is at version {current_version(conn)}, latest is {LATEST_VERSION}")
+        return
+    applied = upgrade()
+    print(f"Applied {len(applied)} migration(s)" if applied else "Already up to date")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+// Access tokens expire after a few minutes. Every fetch that sends a bearer
+// token goes out with the latest stored one, and a 401 is retried once after
+// trading the refresh token for a new pair at /auth/refresh.
+(function () {
+    const originalFetch = window.fetch.bind(window);
+    let refreshing = null;
+
+    function hasBearer(init) {
+        const headers = new Headers(init && init.headers);
+        return (headers.get('Authorization') || '').startsWith('Bearer ');
+    }
+
+    function withToken(init, token) {
+        const headers = new Headers(init && init.headers);
+        headers.set('Authorization', `Bearer ${token}`);
+        return { ...init, headers };
+    }
+
+    // Concurrent 401s share one refresh: a refresh token only works once
+    function refresh() {
+        const refreshToken = localStorage.getItem('refreshToken');
+        if (!refreshToken) return Promise.resolve(null);
+        if (!refreshing) {
+            refreshing = originalFetch('/auth/refresh', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ refresh_token: refreshToken }),
+            })
+                .then(async response => {
+                    if (!response.ok) {
+                        localStorage.removeItem('refreshToken');
+                        return null;
+                    }
+                    const data = await response.json();
+                    localStorage.setItem('token', data.access_token);
+                    localStorage.setItem('refreshToken', data.refresh_token);
+                    return data.access_token;
+                })
+                .catch(() => null)
+                .finally(() => { refreshing = null; });
+        }
+        return refreshing;
+    }
+
+    window.fetch = async function (input, init) {
+        const token = localStorage.getItem('token');
+        if (!token || !hasBearer(init)) return originalFetch(input, init);
+        const response = await originalFetch(input, withToken(init, token));
+        if (response.status !== 401) return response;
+        const renewed = await refresh();
+        return renewed ? originalFetch(input, withToken(init, renewed)) : response;
+    };
+
+    window.auth = {
+        refresh,
+        // Revokes the tokens server-side; the page clears the rest of its storage
+        logout() {
+            const token = localStorage.getItem('token');
+            const refreshToken = localStorage.getItem('refreshToken');
+            localStorage.removeItem('refreshToken');
+            if (!token) return;
+            originalFetch('/auth/logout', {
+                method: 'POST',
+                // Survives the redirect that usually follows
+                keepalive: true,
+                headers: { 'Authorization': `Bearer ${token}`, 'Content-Type': 'application/json' },
+                body: JSON.stringify({ refresh_token: refreshToken }),
+            }).catch(() => {});
+        },
+    };
+})();
@@ -1,35 +1,82 @@
-from fastapi import FastAPI
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
-from sqlalchemy import text
-from database.database import Base, engine
-from models.user import User
-from models.books import Book
-from models.borrow import Borrow
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+from database.database import async_engine, engine
+from database.migrations import check_schema_version
+from router.analytics import router as analytics_router
 from router.auth import router as auth_router
 from router.books import router as books_router
 from router.borrow import router as borrow_router
+from router.covers import router as covers_router
+from router.events import router as events_router
+from config import Settings
+from utils import analytics, assets, events, metrics, token
+from utils.borrow_jobs import JOBS
+from utils.compression import CompressionMiddleware
+from utils.log import setup_logging
+from utils.scheduler import Scheduler
+from utils.user_cache import user_cache
 
-app = FastAPI()
+setup_logging()
 
-Base.metadata.create_all(bind=engine)
 
-# Temporary lightweight migrations to align DB schema with models
-def _apply_simple_migrations():
-    # Uses PostgreSQL IF NOT EXISTS to avoid errors on repeated runs
-    with engine.begin() as conn:
-        conn.execute(text("ALTER TABLE books ADD COLUMN IF NOT EXISTS picture_url TEXT"))
-        conn.execute(text("ALTER TABLE books ADD COLUMN IF NOT EXISTS total_copies INTEGER DEFAULT 1"))
-        conn.execute(text("ALTER TABLE books ADD COLUMN IF NOT EXISTS available_copies INTEGER DEFAULT 1"))
+@asynccontextmanager
+async def lifespan(app):
+    scheduler = Scheduler(JOBS + events.JOBS + analytics.JOBS + token.JOBS)
+    if Settings().SCHEDULER_ENABLED:
+        scheduler.start()
+    yield
+    await scheduler.stop()
+    # aiosqlite connections run on non-daemon threads that block exit until closed
+    if async_engine is not None:
+        await async_engine.dispose()
 
-_apply_simple_migrations()
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(CompressionMiddleware)
+
+# Schema changes are applied by `python -m database.migrations`; workers only
+# check that the database is at the expected version
+check_schema_version(engine)
 
 app.include_router(auth_router)
 app.include_router(books_router)
 app.include_router(borrow_router)
+app.include_router(covers_router)
+app.include_router(events_router)
+app.include_router(analytics_router)
+
+
+def _user_cache_metrics():
+    stats = user_cache.stats()
+    return [
+        ("user_cache_hits_total", "Principal cache hits.", "counter", stats["hits"]),
+        ("user_cache_misses_total", "Principal cache misses.", "counter", stats["misses"]),
+        ("user_cache_size", "Principals currently cached.", "gauge", stats["size"]),
+    ]
+
+metrics.COLLECTORS.append(_user_cache_metrics)
+
+
+def _token_metrics():
+    claims = token.claims_cache.stats()
+    revoked = token.revocations.stats()
+    return [
+        ("token_cache_hits_total", "Decoded access-token cache hits.", "counter", claims["hits"]),
+        ("token_cache_misses_total", "Decoded access-token cache misses.", "counter", claims["misses"]),
+        ("token_revocations", "Unexpired revoked access tokens held by this worker.", "gauge", revoked["tokens"]),
+    ]
+
+metrics.COLLECTORS.append(_token_metrics)
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-app.mount("/static", StaticFiles(directory="frontend"), name="static")
+# Fingerprinted and precompressed in memory once, at startup
+static_assets = assets.StaticAssets()
+app.mount("/static", static_assets, name="static")
 
 @app.get("/")
-def home():
-    return FileResponse("frontend/index.html")
+def home(request: Request):
+    return assets.response(static_assets.get("index.html"), request.headers)
@@ -0,0 +1,56 @@
+from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, Index
+from datetime import datetime
+from database.database import Base
+
+class UsageEvent(Base):
+    """A borrow request, approval, rejection or return not yet rolled up into the usage tables."""
+    __tablename__ = "usage_events"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)  # request, approve, reject, return
+    # No foreign keys: events outlive deleted books and users until rolled up
+    book_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class BookUsage(Base):
+    __tablename__ = "book_usage"
+    __table_args__ = (
+        # "Most borrowed" reads the top of this index
+        Index("ix_book_usage_borrows", "borrows", "book_id"),
+    )
+
+    book_id = Column(Integer, ForeignKey("books.id", ondelete="CASCADE"), primary_key=True)
+    requests = Column(Integer, nullable=False, default=0)
+    borrows = Column(Integer, nullable=False, default=0)
+
+
+class CategoryUsage(Base):
+    """Demand per category, counted under the book's category at the time."""
+    __tablename__ = "category_usage"
+
+    category = Column(String, primary_key=True)  # "" for uncategorized books
+    requests = Column(Integer, nullable=False, default=0)
+    borrows = Column(Integer, nullable=False, default=0)
+
+
+class UserUsage(Base):
+    __tablename__ = "user_usage"
+    __table_args__ = (
+        Index("ix_user_usage_active_borrows", "active_borrows", "user_id"),
+    )
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    active_borrows = Column(Integer, nullable=False, default=0)
+    total_borrows = Column(Integer, nullable=False, default=0)
+
+
+class DailyUsage(Base):
+    __tablename__ = "daily_usage"
+
+    day = Column(Date, primary_key=True)  # UTC
+    requests = Column(Integer, nullable=False, default=0)
+    approvals = Column(Integer, nullable=False, default=0)
+    rejections = Column(Integer, nullable=False, default=0)
+    returns = Column(Integer, nullable=False, default=0)
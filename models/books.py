@@ -1,16 +1,22 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, String, Index
 from database.database import Base
 
 class Book(Base):
     __tablename__ = "books"
+    __table_args__ = (
+        # External key for catalog imports; books without an ISBN may repeat
+        Index("uq_books_isbn", "isbn", unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
+    isbn = Column(String, nullable=True)
     title = Column(String)
     author = Column(String)
     category = Column(String)
     description = Column(String)
     picture_url = Column(String, nullable=True)
+    # sha256 of the ingested cover image; thumbnails are served from /covers
+    cover_digest = Column(String, nullable=True)
     file_path = Column(String, nullable=True)
     total_copies = Column(Integer, default=1)
     available_copies = Column(Integer, default=1)
-
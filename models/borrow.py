@@ -1,10 +1,29 @@
-from sqlalchemy import Column, Integer, ForeignKey, Boolean, DateTime, String
+from sqlalchemy import Column, Integer, ForeignKey, Boolean, DateTime, String, Index, text
 from datetime import datetime
 from sqlalchemy.orm import relationship
 from database.database import Base
 
+# A borrow is "open" until it is returned or rejected
+OPEN_BORROW = text("is_returned = false AND status IN ('pending', 'approved')")
+
 class Borrow(Base):
     __tablename__ = "borrows"
+    __table_args__ = (
+        # One open request/borrow per user per book, enforced by the database
+        Index(
+            "uq_borrows_open_user_book", "user_id", "book_id",
+            unique=True, postgresql_where=OPEN_BORROW, sqlite_where=OPEN_BORROW,
+        ),
+        # /borrow/pending and status-filtered listings
+        Index("ix_borrows_status_id", "status", "id"),
+        # /borrow/my
+        Index("ix_borrows_user_id", "user_id", "id"),
+        # /borrow/status/{book_id} counts books that are not returned
+        Index(
+            "ix_borrows_book_not_returned", "book_id",
+            postgresql_where=text("is_returned = false"), sqlite_where=text("is_returned = false"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -14,8 +33,10 @@ class Borrow(Base):
     requested_return_date = Column(DateTime, nullable=True)
     borrow_date = Column(DateTime, nullable=True)
     return_date = Column(DateTime, nullable=True)
-    status = Column(String, default="pending")  # pending, approved, rejected, returned
+    status = Column(String, default="pending")  # pending, approved, rejected, returned, expired
     is_returned = Column(Boolean, default=False)
+    # Set by the overdue job once an approved borrow passes requested_return_date
+    overdue_since = Column(DateTime, nullable=True)
 
     book = relationship("Book")
     user = relationship("User")
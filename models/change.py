@@ -0,0 +1,32 @@
+from sqlalchemy import Column, Integer, String, DateTime, Index
+from datetime import datetime
+from database.database import Base
+
+class ChangeLog(Base):
+    """One row per changed entity; all rows written by one commit share a version."""
+    __tablename__ = "change_log"
+    __table_args__ = (
+        Index("ix_change_log_version", "version"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+    entity = Column(String, nullable=False)  # borrow, book, user
+    entity_id = Column(Integer, nullable=False)
+    action = Column(String, nullable=False)  # upsert, delete
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ChangeCounter(Base):
+    """Single row handing out change versions.
+
+    It is bumped as a transaction commits (utils.events), so its row lock lasts
+    only for the commit, versions become visible in order, and "everything up
+    to version N" is complete once N can be read.
+    """
+    __tablename__ = "change_counter"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    # Log rows up to this version have been pruned
+    pruned_through = Column(Integer, nullable=False, default=0)
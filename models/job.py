@@ -0,0 +1,15 @@
+from sqlalchemy import Column, DateTime, Float, Integer, String
+from database.database import Base
+
+class JobLease(Base):
+    """One row per background job: who may run it until when, and how the last run went."""
+    __tablename__ = "job_leases"
+
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=True)
+    lease_until = Column(DateTime, nullable=True)
+    last_started_at = Column(DateTime, nullable=True)
+    last_finished_at = Column(DateTime, nullable=True)
+    last_duration = Column(Float, nullable=True)
+    last_rows = Column(Integer, nullable=True)
+    last_error = Column(String, nullable=True)
@@ -0,0 +1,36 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
+from datetime import datetime
+from database.database import Base
+
+class RefreshToken(Base):
+    """An issued refresh token, stored as its sha256 so the table cannot be replayed."""
+    __tablename__ = "refresh_tokens"
+    __table_args__ = (
+        Index("uq_refresh_tokens_hash", "token_hash", unique=True),
+        Index("ix_refresh_tokens_user_id", "user_id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    token_hash = Column(String, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+    # Set when it is used (rotated) or revoked; a second use is refused
+    revoked_at = Column(DateTime, nullable=True)
+
+
+class RevokedToken(Base):
+    """A revoked access token (by jti), or with jti NULL every access token of
+    user_id issued before revoked_at. Kept until such tokens have expired."""
+    __tablename__ = "revoked_tokens"
+    __table_args__ = (
+        # Workers sync what was revoked since their last look
+        Index("ix_revoked_tokens_revoked_at", "revoked_at"),
+        Index("ix_revoked_tokens_expires_at", "expires_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    jti = Column(String, nullable=True)
+    user_id = Column(Integer, nullable=True)
+    revoked_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, Index
+from datetime import datetime
+from database.database import Base
+
+class WaitlistEntry(Base):
+    """A user queued for a book with no copies left, served in position order."""
+    __tablename__ = "waitlist"
+    __table_args__ = (
+        # Head of the queue and "how many are ahead of me" are both range
+        # reads on this index; unique so two joins cannot share a position
+        Index("uq_waitlist_book_position", "book_id", "position", unique=True),
+        Index("uq_waitlist_book_user", "book_id", "user_id", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    book_id = Column(Integer, ForeignKey("books.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    position = Column(Integer, nullable=False)
+    loan_days = Column(Integer, nullable=False, default=14)
+    created_at = Column(DateTime, default=datetime.utcnow)
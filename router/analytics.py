@@ -0,0 +1,136 @@
+from datetime import datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from database.database import get_db, db_route
+from models.analytics import BookUsage, CategoryUsage, DailyUsage, UserUsage
+from models.books import Book
+from models.user import User
+from router.auth import get_current_user
+from schema.analytics import BookUsageResponse, CategoryUsageResponse, DailyUsageResponse, UserUsageResponse
+from utils import serialize
+
+# Every endpoint reads the summary tables kept by utils.analytics: primary key
+# lookups or the top of an index, never a scan of borrows. Figures trail the
+# ledger by up to USAGE_ROLLUP_INTERVAL_SECONDS.
+router = APIRouter(prefix="/analytics", tags=["Analytics"])
+
+MAX_TOP = 100
+
+
+def _require_admin(user: User):
+    if not user.is_admin:
+        raise HTTPException(status_code=403, detail="Only admin can view analytics")
+
+
+@router.get("/daily", response_model=list[DailyUsageResponse])
+@db_route
+def daily_usage(
+    days: int = Query(30, ge=1, le=366),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Admin gets request, approval, rejection and return counts for the last `days` UTC days, oldest first"""
+    _require_admin(current_user)
+    today = datetime.utcnow().date()
+    first = today - timedelta(days=days - 1)
+    stored = {row.day: row for row in db.query(DailyUsage).filter(DailyUsage.day >= first)}
+    # Days without activity have no row; they are reported as zeros
+    return serialize.json_response(list[DailyUsageResponse], [
+        stored.get(day) or {"day": day}
+        for day in (first + timedelta(days=i) for i in range(days))
+    ])
+
+
+@router.get("/books", response_model=list[BookUsageResponse])
+@db_route
+def top_books(
+    limit: int = Query(20, ge=1, le=MAX_TOP),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Admin gets the most borrowed books"""
+    _require_admin(current_user)
+    rows = db.execute(
+        select(BookUsage.book_id, Book.title, BookUsage.requests, BookUsage.borrows)
+        .join(Book, Book.id == BookUsage.book_id)
+        .order_by(BookUsage.borrows.desc(), BookUsage.book_id.desc())
+        .limit(limit)
+    ).mappings().all()
+    return serialize.json_response(list[BookUsageResponse], rows)
+
+
+@router.get("/books/{book_id}", response_model=BookUsageResponse)
+@db_route
+def book_usage(
+    book_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    _require_admin(current_user)
+    row = db.execute(
+        select(
+            Book.id.label("book_id"),
+            Book.title,
+            func.coalesce(BookUsage.requests, 0).label("requests"),
+            func.coalesce(BookUsage.borrows, 0).label("borrows"),
+        )
+        .outerjoin(BookUsage, BookUsage.book_id == Book.id)
+        .where(Book.id == book_id)
+    ).mappings().first()
+    if not row:
+        raise HTTPException(404, "Book not found")
+    return row
+
+
+@router.get("/categories", response_model=list[CategoryUsageResponse])
+@db_route
+def category_usage(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Admin gets demand per category, most requested first"""
+    _require_admin(current_user)
+    rows = db.query(CategoryUsage).order_by(CategoryUsage.requests.desc(), CategoryUsage.category).all()
+    return serialize.json_response(list[CategoryUsageResponse], rows)
+
+
+@router.get("/users", response_model=list[UserUsageResponse])
+@db_route
+def top_users(
+    limit: int = Query(20, ge=1, le=MAX_TOP),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Admin gets the users with the most active borrows"""
+    _require_admin(current_user)
+    rows = db.execute(
+        select(UserUsage.user_id, User.username, UserUsage.active_borrows, UserUsage.total_borrows)
+        .join(User, User.id == UserUsage.user_id)
+        .order_by(UserUsage.active_borrows.desc(), UserUsage.user_id.desc())
+        .limit(limit)
+    ).mappings().all()
+    return serialize.json_response(list[UserUsageResponse], rows)
+
+
+@router.get("/users/{user_id}", response_model=UserUsageResponse)
+@db_route
+def user_usage(
+    user_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    _require_admin(current_user)
+    row = db.execute(
+        select(
+            User.id.label("user_id"),
+            User.username,
+            func.coalesce(UserUsage.active_borrows, 0).label("active_borrows"),
+            func.coalesce(UserUsage.total_borrows, 0).label("total_borrows"),
+        )
+        .outerjoin(UserUsage, UserUsage.user_id == User.id)
+        .where(User.id == user_id)
+    ).mappings().first()
+    if not row:
+        raise HTTPException(404, "User not found")
+    return row
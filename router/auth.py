@@ -1,116 +1,235 @@
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
-from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import jwt, JWTError
+from jose import JWTError
 from sqlalchemy.orm import Session
-from database.database import SessionLocal , get_db
-from schema.auth import SignupRequest , UserResponse,AdminCreateRequest
+from database.database import get_db, db_route, run_db, run_in_session
+from schema.auth import SignupRequest , UserResponse,AdminCreateRequest, UserSummary, Token, RefreshRequest, LogoutRequest
 from models.user import User
-from utils.token import create_token
+from utils import token as tokens
+from utils.user_cache import CachedUser, user_cache
+from utils.passwords import hash_password, verify_password
+from utils import events, rate_limit, serialize
 from config import Settings
+import logging
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
+logger = logging.getLogger(__name__)
 
 
-pwd = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
-SECRET_KEY = Settings().SECRET_KEY 
-ALGORITHM = Settings().ALGORITHM
+ACCESS_TOKEN_SECONDS = Settings().ACCESS_TOKEN_EXPIRE_MINUTES * 60
 
 
-def hash_password(password: str):
-    return pwd.hash(password)
 # -----------------------------
 # SIGNUp
 # -----------------------------
 
 
-@router.post("/signup")
+@router.post("/signup", dependencies=[Depends(rate_limit.signup_limit.per_ip)])
 async def signup(data: SignupRequest, db: Session = Depends(get_db)):
-    print(f"Signup attempt for email: {data.email}, username: {data.username}")
-    user = db.query(User).filter(User.email == data.email).first()
-    if user:
-        print("Signup failed: email already exists")
+    logger.debug("signup attempt", extra={"username": data.username})
+    if await run_db(db, _email_taken, data.email):
+        logger.info("signup rejected: email exists", extra={"username": data.username})
         raise HTTPException(400, "Email already exists")
-    hashed_password = hash_password(data.password)
-    print(f"Password hashed: {hashed_password}")
+    # Hashing runs on the password pool so it does not block the event loop
+    hashed_password = await hash_password(data.password)
     user = User(
         username=data.username,
         full_name=data.full_name,
         email=data.email,
         password=hashed_password
     )
+    await run_db(db, _save_user, user)
+    logger.info("user created", extra={"user_id": user.id, "username": user.username})
+    return UserResponse(id=user.id, username=user.username, email=user.email)
+
+
+def _email_taken(db: Session, email: str) -> bool:
+    return db.query(User.id).filter(User.email == email).first() is not None
+
+
+def _save_user(db: Session, user: User):
     db.add(user)
+    db.flush()
+    events.record(db, "user", [user.id])
     db.commit()
-    print(f"User {data.username} created successfully")
-    return UserResponse(id=user.id, username=user.username, email=user.email)
+    db.refresh(user)
 
 # -----------------------------
 # LOGIN
 # -----------------------------
-@router.post("/login")
-def login(form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    print(f"Login attempt for username: {form.username}")
-    user = db.query(User).filter(User.username == form.username).first()
-    print(f"User found: {user is not None}")
+@router.post("/login", dependencies=[Depends(rate_limit.login_limit.per_ip)])
+async def login(form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    user = await run_db(db, _find_login_user, form.username)
+    valid, new_hash = (False, None)
     if user:
-        print(f"Stored password hash: {user.password}")
-        print(f"Password verify: {pwd.verify(form.password, user.password)}")
-    if not user or not pwd.verify(form.password, user.password):
-        print("Login failed: invalid credentials")
+        valid, new_hash = await verify_password(form.password, user.password)
+    if not valid:
+        logger.info("login failed", extra={"username": form.username})
         raise HTTPException(401, "Invalid credentials")
+    if new_hash:
+        # Stored with an old work factor; replace it while we have the password
+        await run_db(db, _update_password_hash, user.id, new_hash)
+
+    refresh_token = await run_db(db, _issue_refresh_token, user.id)
+    logger.debug("login succeeded", extra={"user_id": user.id})
+    return {
+        **_token_pair(user, refresh_token),
+        "is_admin": user.is_admin,
+        "username": user.username,
+    }
+
+
+def _token_pair(user, refresh_token: str) -> dict:
+    return {
+        "access_token": tokens.create_token({"sub": user.username, "id": user.id}),
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+        "expires_in": ACCESS_TOKEN_SECONDS,
+    }
+
+
+def _issue_refresh_token(db: Session, user_id: int) -> str:
+    refresh_token = tokens.issue_refresh_token(db, user_id)
+    db.commit()
+    return refresh_token
+
+
+def _find_login_user(db: Session, username: str):
+    return db.query(User.id, User.username, User.password, User.is_admin).filter(User.username == username).first()
+
+
+def _update_password_hash(db: Session, user_id: int, new_hash: str):
+    db.query(User).filter(User.id == user_id).update({User.password: new_hash}, synchronize_session=False)
+    db.commit()
+
+# -----------------------------
+# REFRESH / LOGOUT
+# -----------------------------
+@router.post("/refresh", response_model=Token)
+async def refresh(data: RefreshRequest, db: Session = Depends(get_db)):
+    """Trade a refresh token for a new access and refresh token; each refresh token works once"""
+    result = await run_db(db, _rotate_refresh_token, data.refresh_token)
+    if not result:
+        raise HTTPException(401, "Invalid or expired refresh token")
+    user, refresh_token = result
+    return _token_pair(user, refresh_token)
+
+
+def _rotate_refresh_token(db: Session, refresh_token: str):
+    user_id = tokens.use_refresh_token(db, refresh_token)
+    user = None
+    if user_id is not None:
+        user = db.query(User.id, User.username).filter(User.id == user_id).first()
+    if not user:
+        # Keeps the revocations a reused token triggers
+        db.commit()
+        return None
+    new_token = tokens.issue_refresh_token(db, user.id)
+    db.commit()
+    return user, new_token
+
+
+@router.post("/logout")
+async def logout(data: LogoutRequest | None = None, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    """Revoke the access token and, if given, the refresh token issued with it"""
+    claims = _decode(token)
+    row = await run_db(db, _revoke_token, claims, data.refresh_token if data else None)
+    tokens.revoked(row)
+    return {"message": "Logged out"}
+
+
+def _revoke_token(db: Session, claims: dict, refresh_token: str | None):
+    row = tokens.revoke_token(db, claims, refresh_token)
+    db.commit()
+    return row
 
-    token = create_token({"sub": user.username, "id": user.id})
-    print(f"Login successful for {form.username}")
-    return {"access_token": token, "token_type": "bearer", "is_admin": user.is_admin, "username": user.username}
 
 # -----------------------------
 # CURRENT USER
 # -----------------------------
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def _decode(token: str) -> dict:
     try:
-        data = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = data.get("sub")
-        print(f"Decoded username: {username}")
-        user = db.query(User).filter(User.username == username).first()
-        print(f"User found: {user}")
-        if not user:
-            raise HTTPException(401, "User not found")
-        return user
-    except Exception as e:
-        print(f"Token decode error: {e}")
+        return tokens.claims_cache.decode(token)
+    except JWTError as e:
+        logger.debug("token rejected", extra={"error": str(e)})
         raise HTTPException(401, "Invalid or expired token")
 
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    """Resolve the token to a CachedUser without the database, except on a
+    principal cache miss and a revocation sync every few seconds."""
+    return await principal_for(_decode(token))
+
+
+async def sync_revocations():
+    """Pick up other workers' revocations and user changes, at most every
+    TOKEN_REVOCATION_SYNC_SECONDS."""
+    if tokens.revocations.sync_due():
+        try:
+            await run_in_session(_sync_revocations)
+        except Exception:
+            # Checked against what was last synced; retried after the next interval
+            logger.warning("token revocation sync failed", exc_info=True)
+
+
+def _sync_revocations(db: Session):
+    tokens.revocations.sync(db)
+    user_cache.sync(db)
+
+
+async def principal_for(data: dict):
+    """CachedUser for verified access-token claims; 401 if revoked or the user is gone."""
+    await sync_revocations()
+    if tokens.revocations.is_revoked(data):
+        raise HTTPException(401, "Token has been revoked")
+
+    user_id = data["id"]
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
+    generation = user_cache.generation()
+
+    principal = await run_in_session(_load_principal, user_id)
+    if not principal:
+        raise HTTPException(401, "User not found")
+    user_cache.put(principal, generation)
+    return principal
+
+
+def _load_principal(db: Session, user_id: int):
+    user = db.query(User).filter(User.id == user_id).first()
+    return CachedUser.from_user(user) if user else None
+
 @router.get("/me")
 def me(user: User = Depends(get_current_user)):
     return {"id": user.id, "username": user.username, "email": user.email, "full_name": user.full_name}
 
 @router.put("/me")
-def update_me(data: dict, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+@db_route
+def update_me(data: dict, current_user: CachedUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    user = db.query(User).filter(User.id == current_user.id).first()
+    if not user:
+        raise HTTPException(404, "User not found")
     user.full_name = data.get('full_name', user.full_name)
+    events.record(db, "user", [user.id])
     db.commit()
     db.refresh(user)
+    user_cache.invalidate(user.id)
     return {"id": user.id, "username": user.username, "email": user.email, "full_name": user.full_name}
 
-@router.get("/users")
+@router.get("/users", response_model=list[UserSummary])
+@db_route
 def list_users(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Only admin can list users")
-    users = db.query(User).all()
-    return [
-        {
-            "id": u.id,
-            "username": u.username,
-            "email": u.email,
-            "full_name": u.full_name,
-            "is_admin": u.is_admin,
-        }
-        for u in users
-    ]
+    rows = db.query(User.id, User.username, User.email, User.full_name, User.is_admin).order_by(User.id).all()
+    return serialize.json_response(list[UserSummary], [row._asdict() for row in rows])
 
 @router.delete("/users/{user_id}")
+@db_route
 def delete_user(user_id: int, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Only admin can delete users")
@@ -118,19 +237,43 @@ def delete_user(user_id: int, db: Session = Depends(get_db), current_user: dict
     if not user:
         raise HTTPException(404, "User not found")
     db.delete(user)
+    row = tokens.revoke_user(db, user_id)
+    events.record(db, "user", [user_id], "delete")
     db.commit()
+    tokens.revoked(row)
+    user_cache.invalidate(user_id)
     return {"message": "User deleted"}
+
+@router.post("/users/{user_id}/revoke")
+@db_route
+def revoke_user_tokens(user_id: int, db: Session = Depends(get_db), current_user: CachedUser = Depends(get_current_user)):
+    """Admin ends every session of a user: their tokens stop working on all workers
+    within TOKEN_REVOCATION_SYNC_SECONDS"""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only admin can revoke tokens")
+    if not db.query(User.id).filter(User.id == user_id).first():
+        raise HTTPException(404, "User not found")
+    row = tokens.revoke_user(db, user_id)
+    db.commit()
+    tokens.revoked(row)
+    return {"message": "Tokens revoked"}
+
+@router.get("/cache-stats")
+def cache_stats(current_user: User = Depends(get_current_user)):
+    """Hit/miss counters of the principal cache, for sizing USER_CACHE_SIZE/TTL"""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only admin can view cache stats")
+    return user_cache.stats()
 # -----------------------------
 # CREATE ADMIN
 # -----------------------------
 @router.post("/create-admin")
-def create_admin(data: AdminCreateRequest, db: Session = Depends(get_db)):
+async def create_admin(data: AdminCreateRequest, db: Session = Depends(get_db)):
     user = User(
         username=data.username,
         email=data.email,
-        password=pwd.hash(data.password),
+        password=await hash_password(data.password),
         is_admin=True
     )
-    db.add(user)
-    db.commit()
+    await run_db(db, _save_user, user)
     return {"message": "Admin created"}
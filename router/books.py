@@ -1,57 +1,126 @@
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from database.database import get_db
+from database.database import get_db, db_route, run_db
 from models.books import Book
 from models.user import User
-from schema.book import BookCreate, BookResponse
+from schema.book import BookCreate, BookResponse, BookPage, BookImportResult
 from router.auth import get_current_user
+from utils import blob_store, catalog_import, covers, events, export, read_cache, serialize, waitlist
+from utils.search import search_books as run_search
+import io
 import os
 
 router = APIRouter(prefix="/books", tags=["Books"])
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Columns needed for catalog cards. file_path is left out on purpose because it
+# can hold a whole base64 PDF; only whether one exists is reported.
+SUMMARY_COLUMNS = (
+    Book.id,
+    Book.isbn,
+    Book.title,
+    Book.author,
+    Book.description,
+    Book.category,
+    covers.cover_url_column("sm"),
+    (Book.file_path.isnot(None)).label("has_pdf"),
+    Book.total_copies,
+    Book.available_copies,
+)
+
+
+def _page(rows, limit: int) -> dict:
+    """Turn up to limit + 1 summary rows into a BookPage-shaped dict with a keyset cursor."""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = rows[-1].id if has_more else None
+    return {"items": [row._asdict() for row in rows], "next_cursor": next_cursor}
+
 
 # Create book admin api
 @router.post("/", status_code=201)
-def create_book(data: BookCreate, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
+async def create_book(data: BookCreate, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Only admin can create books")
     
+    # Decoding, hashing and storing the cover and PDF is CPU and disk work; it
+    # runs on the threadpool before the (short) database step
+    picture_url, cover_digest = await run_in_threadpool(_ingest_cover, data.picture_url)
+    file_path = await run_in_threadpool(_ingest_pdf, data.file_path)
+    new_book = await run_db(db, _insert_book, data, picture_url, cover_digest, file_path)
+    _process_cover(new_book)
+
+    return BookResponse(
+        id=new_book.id,
+        isbn=new_book.isbn,
+        title=new_book.title,
+        author=new_book.author,
+        description=new_book.description,
+        category=new_book.category,
+        picture_url=new_book.picture_url,
+        file_path=new_book.file_path,
+        total_copies=new_book.total_copies,
+        available_copies=new_book.available_copies,
+        cover_digest=new_book.cover_digest,
+        )
+
+
+def _insert_book(db: Session, data: BookCreate, picture_url, cover_digest, file_path) -> Book:
     #Create new book entry
     new_book = Book(
+        isbn=data.isbn,
         title=data.title,
         author=data.author,
         description=data.description,
         category=data.category,
-        picture_url=data.picture_url,
-        file_path=data.file_path,
+        picture_url=picture_url,
+        cover_digest=cover_digest,
+        file_path=file_path,
         total_copies=data.total_copies,
         available_copies=data.available_copies
 
     )
     db.add(new_book)
+    _flush_unique_isbn(db)
+    events.record(db, "book", [new_book.id])
     db.commit()
     db.refresh(new_book)
-
-    return BookResponse(
-        id=new_book.id,
-        title=new_book.title,
-        author=new_book.author,
-        description=new_book.description,
-        category=new_book.category,
-        picture_url=new_book.picture_url,
-        file_path=new_book.file_path,
-        total_copies=new_book.total_copies,
-        available_copies=new_book.available_copies
-        )
+    read_cache.invalidate_book(new_book.id)
+    return new_book
 
 
 
-@router.get("/")
-def get_books(db: Session = Depends(get_db)):
-    return db.query(Book).all()
+@router.get("/", response_model=BookPage)
+@db_route
+def get_books(
+    request: Request,
+    after_id: int | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    category: str | None = None,
+    author: str | None = None,
+    db: Session = Depends(get_db),
+):
+    """Keyset-paginated catalog listing. Pass next_cursor back as after_id."""
+    not_modified, headers = read_cache.list_validators(db, request)
+    if not_modified:
+        return not_modified
+    query = db.query(*SUMMARY_COLUMNS)
+    if after_id is not None:
+        query = query.filter(Book.id > after_id)
+    if category:
+        query = query.filter(Book.category == category)
+    if author:
+        query = query.filter(Book.author == author)
+    rows = query.order_by(Book.id).limit(limit + 1).all()
+    return serialize.json_response(BookPage, _page(rows, limit), headers=headers)
 
 @router.delete("/{book_id}")
+@db_route
 def delete_book(book_id: int, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Only admin can delete books")
@@ -61,52 +130,264 @@ def delete_book(book_id: int, db: Session = Depends(get_db), current_user: dict
         raise HTTPException(404, "Book not found")
     
     db.delete(book)
+    events.record(db, "book", [book_id], "delete")
     db.commit()
+    read_cache.invalidate_book(book_id)
     return {"message": "Book deleted"}
 
 @router.put("/{book_id}", response_model=BookResponse)
-def update_book(book_id: int, data: BookCreate, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
+async def update_book(book_id: int, data: BookCreate, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Only admin can update books")
     
+    stored = await run_db(db, _stored_picture_url, book_id)
+    if stored is None:
+        raise HTTPException(404, "Book not found")
+    # The edit form resends the stored picture_url; only a new one is ingested
+    cover = None
+    if data.picture_url != stored.picture_url:
+        cover = await run_in_threadpool(_ingest_cover, data.picture_url)
+    # The edit form does not resend the PDF, so only replace it when one is given
+    file_path = None
+    if data.file_path is not None:
+        file_path = await run_in_threadpool(_ingest_pdf, data.file_path)
+
+    book = await run_db(db, _update_book, book_id, data, cover, file_path)
+    if cover is not None:
+        _process_cover(book)
+    return book
+
+
+def _stored_picture_url(db: Session, book_id: int):
+    return db.query(Book.picture_url).filter(Book.id == book_id).first()
+
+
+def _update_book(db: Session, book_id: int, data: BookCreate, cover, file_path):
     book = db.query(Book).filter(Book.id == book_id).first()
     if not book:
         raise HTTPException(404, "Book not found")
     
+    book.isbn = data.isbn
     book.title = data.title
     book.author = data.author
     book.description = data.description
     book.category = data.category
-    book.picture_url = data.picture_url
-    book.file_path = data.file_path
+    if cover is not None:
+        book.picture_url, book.cover_digest = cover
+    if file_path is not None:
+        book.file_path = file_path
+    raised = data.available_copies > book.available_copies
     book.total_copies = data.total_copies
     book.available_copies = data.available_copies
     
+    _flush_unique_isbn(db)
+    filled = waitlist.fill(db, [book_id]) if raised else []
+    events.record(db, "book", [book_id])
     db.commit()
     db.refresh(book)
-    
+    read_cache.invalidate_book(book_id)
+    read_cache.invalidate_borrows(*filled)
     return book
 
-@router.get("/search")
-def search_books(query: str, db: Session = Depends(get_db)):
-    return db.query(Book).filter(Book.title.ilike(f"%{query}%")).all()
+@router.get("/search", response_model=BookPage)
+@db_route
+def search_books(
+    request: Request,
+    query: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+):
+    """Ranked full-text search over title, author, category and description.
+    next_cursor is the offset of the next page."""
+    not_modified, headers = read_cache.list_validators(db, request)
+    if not_modified:
+        return not_modified
+    rows = run_search(db, query, SUMMARY_COLUMNS, limit, offset)
+    page = _page(rows, limit)
+    if page["next_cursor"] is not None:
+        page["next_cursor"] = offset + limit
+    return serialize.json_response(BookPage, page, headers=headers)
+
+
+@router.get("/categories")
+async def categories(request: Request, db: Session = Depends(get_db)):
+    """Distinct categories, served from the read cache until a book changes"""
+    cached, generation = read_cache.get_json(read_cache.categories_key())
+    if cached is None:
+        cached = await run_db(db, _load_categories)
+        read_cache.set_json(read_cache.categories_key(), cached, generation)
+    return read_cache.json_response(request, cached)
+
+
+def _load_categories(db: Session):
+    raw = db.query(Book.category).distinct().all()
+    return [c[0] for c in raw]
+
+
+@router.post("/import", response_model=BookImportResult)
+async def import_books(
+    file: UploadFile = File(...),
+    format: str | None = Query(None, pattern="^(csv|jsonl)$"),
+    current_user: User = Depends(get_current_user),
+):
+    """Admin bulk-loads a CSV or JSONL catalog feed, upserting on ISBN.
+    Bad rows are reported in errors and skipped; the rest are imported."""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only admin can import books")
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        return await run_in_threadpool(
+            catalog_import.import_books, stream, format or catalog_import.guess_format(file.filename)
+        )
+    except UnicodeDecodeError:
+        # Batches before the bad bytes are already committed
+        raise HTTPException(400, "Import file must be UTF-8 encoded")
+
+
+@router.get("/export")
+async def export_books(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    category: str | None = None,
+    author: str | None = None,
+    current_user: User = Depends(get_current_user),
+):
+    """Admin streams the whole (filtered) catalog as NDJSON or CSV"""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only admin can export books")
+    chunks = export.export_books(format, category=category, author=author)
+    return StreamingResponse(
+        chunks,
+        media_type=export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="books.{format}"'},
+    )
 
 
 @router.get("/{book_id}", response_model=BookResponse)
+@db_route
 def get_book(book_id: int, db: Session = Depends(get_db)):
     book = db.query(Book).filter(Book.id == book_id).first()
     if not book:
         raise HTTPException(404, "Book not found")
     return book
 
+@router.post("/{book_id}/pdf", response_model=BookResponse)
+async def upload_pdf(
+    book_id: int,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Admin uploads the PDF for a book into the content-addressed store"""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only admin can upload PDFs")
+    if file.content_type and file.content_type != "application/pdf":
+        raise HTTPException(400, "Only PDF files are accepted")
+    if not await run_db(db, _book_exists, book_id):
+        raise HTTPException(404, "Book not found")
+
+    # Hashing and writing the file is disk work, keep it off the event loop
+    ref = await run_in_threadpool(blob_store.store_file, file.file)
+    return await run_db(db, _set_pdf, book_id, ref)
+
+
+@router.post("/{book_id}/cover", response_model=BookResponse)
+async def upload_cover(
+    book_id: int,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Admin uploads a cover image; thumbnails are rendered in the background"""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only admin can upload covers")
+    if file.content_type and not file.content_type.startswith("image/"):
+        raise HTTPException(400, "Only image files are accepted")
+    if not await run_db(db, _book_exists, book_id):
+        raise HTTPException(404, "Book not found")
+
+    data = await file.read(covers.MAX_SOURCE_BYTES + 1)
+    try:
+        digest = await run_in_threadpool(covers.store_source, data)
+    except ValueError as e:
+        raise HTTPException(400, f"Invalid cover image: {str(e)}")
+    book = await run_db(db, _set_cover, book_id, digest)
+    covers.generate(digest)
+    return book
+
+
+def _book_exists(db: Session, book_id: int) -> bool:
+    return db.query(Book.id).filter(Book.id == book_id).first() is not None
+
+
+def _set_pdf(db: Session, book_id: int, ref: str):
+    book = db.query(Book).filter(Book.id == book_id).first()
+    if not book:
+        raise HTTPException(404, "Book not found")
+    book.file_path = ref
+    events.record(db, "book", [book_id])
+    db.commit()
+    db.refresh(book)
+    return book
+
+def _set_cover(db: Session, book_id: int, digest: str):
+    book = db.query(Book).filter(Book.id == book_id).first()
+    if not book:
+        raise HTTPException(404, "Book not found")
+    book.picture_url = covers.cover_url(digest, "lg")
+    book.cover_digest = digest
+    events.record(db, "book", [book_id])
+    db.commit()
+    db.refresh(book)
+    read_cache.invalidate_book(book_id)
+    return book
+
 @router.get("/{book_id}/view")
-def view_pdf(
+async def view_pdf(
     book_id: int, 
+    request: Request,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Stream PDF for inline viewing - download disabled"""
-    book = db.query(Book).filter(Book.id == book_id).first()
+    """Serve PDF for inline viewing - download disabled. Supports Range and If-None-Match."""
+    book = await run_db(db, _viewable_pdf, book_id, current_user)
+
+    # Rows that still hold an inline data URL are moved into the store on first
+    # view; decoding and writing it is done on the threadpool
+    file_path = book.file_path
+    if file_path.startswith('data:'):
+        ref = await run_in_threadpool(_ingest_pdf, file_path)
+        await run_db(db, _replace_inline_pdf, book_id, file_path, ref)
+        file_path = ref
+
+    headers = {
+        "Content-Disposition": f"inline; filename={book.title}.pdf",
+        "Content-Security-Policy": "default-src 'self'",
+        "Cache-Control": "private, no-cache",
+    }
+
+    if blob_store.is_blob_ref(file_path):
+        digest = blob_store.digest_from_ref(file_path)
+        path = blob_store.blob_path(digest)
+        # Content-addressed, so the digest is a strong validator
+        etag = f'"{digest}"'
+        headers["ETag"] = etag
+        if read_cache.etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+    else:
+        path = file_path
+
+    if not os.path.exists(path):
+        raise HTTPException(404, "PDF file not found on server")
+
+    # FileResponse streams from disk (pathsend where the server supports it)
+    # and answers Range requests itself
+    return FileResponse(path, media_type="application/pdf", headers=headers)
+
+
+def _viewable_pdf(db: Session, book_id: int, current_user: User):
+    """The book's title and file_path, if it has a PDF this user may view."""
+    book = db.query(Book.title, Book.file_path).filter(Book.id == book_id).first()
     if not book:
         raise HTTPException(404, "Book not found")
     
@@ -115,7 +396,7 @@ def view_pdf(
     
     # Check if user has approved borrow
     from models.borrow import Borrow
-    borrow = db.query(Borrow).filter(
+    borrow = db.query(Borrow.id).filter(
         Borrow.user_id == current_user.id,
         Borrow.book_id == book_id,
         Borrow.status == "approved",
@@ -124,44 +405,46 @@ def view_pdf(
     
     if not borrow and not current_user.is_admin:
         raise HTTPException(403, "You must have an approved borrow to view this book")
-    
-    # If file_path is a data URL (base64), decode and serve it
-    if book.file_path.startswith('data:'):
-        import base64
-        import io
-        
-        # Extract base64 data after the comma
-        try:
-            base64_data = book.file_path.split(',')[1]
-            pdf_bytes = base64.b64decode(base64_data)
-            
-            return StreamingResponse(
-                io.BytesIO(pdf_bytes),
-                media_type="application/pdf",
-                headers={
-                    "Content-Disposition": f"inline; filename={book.title}.pdf",
-                    "Content-Security-Policy": "default-src 'self'"
-                }
-            )
-        except Exception as e:
-            raise HTTPException(400, f"Invalid PDF data: {str(e)}")
-    
-    # If it's a file path, stream it
-    if not os.path.exists(book.file_path):
-        raise HTTPException(404, "PDF file not found on server")
-    
-    def iterfile():
-        with open(book.file_path, mode="rb") as file:
-            yield from file
-    
-    return StreamingResponse(
-        iterfile(),
-        media_type="application/pdf",
-        headers={
-            "Content-Disposition": f"inline; filename={book.title}.pdf",
-            "Content-Security-Policy": "default-src 'self'"
-        }
+    return book
+
+
+def _replace_inline_pdf(db: Session, book_id: int, inline: str, ref: str):
+    # Only if no one replaced the PDF meanwhile
+    db.query(Book).filter(Book.id == book_id, Book.file_path == inline).update(
+        {Book.file_path: ref}, synchronize_session=False
     )
+    db.commit()
+
+
+def _ingest_pdf(file_path: str | None):
+    try:
+        return blob_store.ingest_file_path(file_path)
+    except ValueError as e:
+        raise HTTPException(400, f"Invalid PDF data: {str(e)}")
+
+
+def _ingest_cover(picture_url: str | None):
+    try:
+        return covers.ingest_picture_url(picture_url)
+    except ValueError as e:
+        raise HTTPException(400, f"Invalid cover image: {str(e)}")
+
+
+def _process_cover(book: Book):
+    """Start thumbnails for a stored cover, or the fetch of a remote one."""
+    if book.cover_digest:
+        covers.generate(book.cover_digest)
+    elif book.picture_url and book.picture_url.startswith(("http://", "https://")):
+        covers.schedule_remote(book.id, book.picture_url)
+
+
+def _flush_unique_isbn(db: Session):
+    try:
+        db.flush()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(400, "A book with this ISBN already exists")
+
 
 # @router.get("/{book_id}/read")
 # def read_online(book_id: int, db: Session = Depends(get_db)):
@@ -172,8 +455,3 @@ def view_pdf(
 # def download_book(book_id: int, db: Session = Depends(get_db)):
 #     book = db.query(Book).filter(Book.id == book_id).first()
 #     return FileResponse(book.file_path, filename=f"{book.title}.pdf")
-
-@router.get("/categories")
-def categories(db: Session = Depends(get_db)):
-    raw = db.query(Book.category).distinct().all()
-    return [c[0] for c in raw]
@@ -1,68 +1,89 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import case, delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from datetime import datetime
-from database.database import SessionLocal
+from database.database import get_db, db_route, run_db, violates
 from models.borrow import Borrow
 from models.books import Book
 from models.user import User
+from models.job import JobLease
+from models.waitlist import WaitlistEntry
 from router.auth import get_current_user
+from utils import analytics, events, export, rate_limit, read_cache, serialize, waitlist
 from schema.borrow import (
     BorrowRequest,
     BorrowReturnRequest,
     BorrowApprovalRequest,
     BorrowResponse,
-    BorrowUserInfo,
+    BorrowPage,
+    BorrowBatchApprovalRequest,
+    BorrowBatchReturnRequest,
+    BorrowBatchResult,
+    JobStatus,
+    WaitlistRequest,
+    WaitlistPosition,
 )
 
 router = APIRouter(prefix="/borrow", tags=["Borrow"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+OPEN_BORROW_INDEX = next(i for i in Borrow.__table__.indexes if i.name == "uq_borrows_open_user_book")
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Everything BorrowResponse needs, fetched with one joined SELECT instead of
+# lazy-loading borrow.book and borrow.user per row
+LIST_COLUMNS = (
+    Borrow.id,
+    Borrow.request_date,
+    Borrow.requested_borrow_date,
+    Borrow.requested_return_date,
+    Borrow.borrow_date,
+    Borrow.return_date,
+    Borrow.status,
+    Borrow.is_returned,
+    Borrow.overdue_since,
+    Book.id.label("book_id"),
+    Book.title.label("book_title"),
+    Book.author.label("book_author"),
+    User.id.label("user_id"),
+    User.username.label("user_username"),
+    User.email.label("user_email"),
+)
 
-@router.post("/request", response_model=BorrowResponse, status_code=201)
+SORT_FIELDS = {
+    "id": Borrow.id,
+    "request_date": Borrow.request_date,
+    "requested_borrow_date": Borrow.requested_borrow_date,
+    "requested_return_date": Borrow.requested_return_date,
+    "borrow_date": Borrow.borrow_date,
+    "return_date": Borrow.return_date,
+    "status": Borrow.status,
+}
+
+async def _limit_requests(user: User = Depends(get_current_user)):
+    # get_current_user is resolved once per request, so the route reuses this principal
+    await rate_limit.borrow_request_limit.check(f"user:{user.id}")
+
+
+@router.post("/request", response_model=BorrowResponse, status_code=201, dependencies=[Depends(_limit_requests)])
+@db_route
 def request_borrow(
     data: BorrowRequest,
     user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     """User requests to borrow a book with requested dates"""
-    book = db.query(Book).filter(Book.id == data.book_id).first()
+    book = db.query(Book.available_copies).filter(Book.id == data.book_id).first()
     if not book:
         raise HTTPException(404, "Book not found")
     
     # Check if book has available copies
     if book.available_copies <= 0:
-        raise HTTPException(400, "No copies available for this book")
-    
-    # Check for any existing request or borrow for this book by this user (not returned/rejected)
-    existing = db.query(Borrow).filter(
-        Borrow.user_id == user.id,
-        Borrow.book_id == data.book_id,
-        Borrow.status.in_(["pending", "approved"]),
-        Borrow.is_returned == False
-    ).first()
-    
-    if existing:
-        if existing.status == "pending":
-            raise HTTPException(400, "You already have a pending request for this book. Please wait for admin approval.")
-        elif existing.status == "approved":
-            raise HTTPException(400, "You have already borrowed this book. Please return it before requesting again.")
+        raise HTTPException(400, "No copies available for this book. Join the waitlist to get the next returned copy.")
     
-    # Check if user has any active approved borrow (not returned) for this same book
-    active_borrow = db.query(Borrow).filter(
-        Borrow.user_id == user.id,
-        Borrow.book_id == data.book_id,
-        Borrow.status == "approved",
-        Borrow.is_returned == False
-    ).first()
-    
-    if active_borrow:
-        raise HTTPException(400, "You currently have this book borrowed. Please return it first.")
-
     borrow = Borrow(
         user_id=user.id,
         book_id=data.book_id,
@@ -71,12 +92,36 @@ def request_borrow(
         status="pending"
     )
 
+    # uq_borrows_open_user_book rejects a second open borrow for this user and
+    # book, so the insert itself is the duplicate check
     db.add(borrow)
+    try:
+        db.flush()
+    except IntegrityError as error:
+        db.rollback()
+        if not violates(error, OPEN_BORROW_INDEX):
+            # The book's foreign key, once the book was deleted after the check above
+            if not db.query(Book.id).filter(Book.id == data.book_id).first():
+                raise HTTPException(404, "Book not found")
+            raise
+        existing = db.query(Borrow.status).filter(
+            Borrow.user_id == user.id,
+            Borrow.book_id == data.book_id,
+            Borrow.status.in_(["pending", "approved"]),
+            Borrow.is_returned == False
+        ).first()
+        if existing and existing.status == "approved":
+            raise HTTPException(400, "You have already borrowed this book. Please return it before requesting again.")
+        raise HTTPException(400, "You already have a pending request for this book. Please wait for admin approval.")
+    events.record(db, "borrow", [borrow.id])
+    analytics.record(db, "request", [(user.id, data.book_id)])
     db.commit()
     db.refresh(borrow)
+    read_cache.invalidate_borrows(borrow.book_id)
     return _serialize_borrow(borrow, user)
 
 @router.post("/approve", response_model=BorrowResponse)
+@db_route
 def approve_borrow(
     data: BorrowApprovalRequest,
     current_user: User = Depends(get_current_user),
@@ -86,36 +131,115 @@ def approve_borrow(
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Only admin can approve borrows")
     
-    borrow = db.query(Borrow).filter(Borrow.id == data.borrow_id).first()
+    borrow = db.query(Borrow.id, Borrow.user_id, Borrow.book_id, Borrow.status).filter(Borrow.id == data.borrow_id).first()
     if not borrow:
         raise HTTPException(404, "Borrow request not found")
     
     if borrow.status != "pending":
         raise HTTPException(400, f"Request is already {borrow.status}")
     
+    # Both writes are conditional single statements, so concurrent approvals can
+    # neither approve the same request twice nor take a copy that is not there
     if data.approve:
-        book = db.query(Book).filter(Book.id == borrow.book_id).first()
-        if book.available_copies <= 0:
+        if not _transition(db, borrow.id, "pending", status="approved", borrow_date=datetime.utcnow()):
+            db.rollback()
+            raise HTTPException(400, "Request is no longer pending")
+        if _take_copy(db, borrow.book_id) is None:
+            db.rollback()
             raise HTTPException(400, "No copies available")
-        
-        borrow.status = "approved"
-        borrow.borrow_date = datetime.utcnow()
-        book.available_copies -= 1
-    else:
-        borrow.status = "rejected"
+    elif not _transition(db, borrow.id, "pending", status="rejected"):
+        db.rollback()
+        raise HTTPException(400, "Request is no longer pending")
     
+    events.record(db, "borrow", [borrow.id])
+    if data.approve:
+        events.record(db, "book", [borrow.book_id])
+    analytics.record(db, "approve" if data.approve else "reject", [(borrow.user_id, borrow.book_id)])
     db.commit()
-    db.refresh(borrow)
-    return _serialize_borrow(borrow, None)
+    read_cache.invalidate_borrows(borrow.book_id)
+    return _serialize_borrow(db.get(Borrow, borrow.id), None)
+
+@router.post("/approve/batch", response_model=list[BorrowBatchResult])
+@db_route
+def approve_borrow_batch(
+    data: BorrowBatchApprovalRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Admin approves or rejects many requests in one transaction.
+
+    Copies are handed out per book in request order, so the same input always
+    gives the same outcomes; approvals past the last copy get "no_copies".
+    """
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only admin can approve borrows")
+
+    ids = [d.borrow_id for d in data.decisions]
+    borrows = {
+        row.id: row
+        for row in db.query(Borrow.id, Borrow.user_id, Borrow.book_id, Borrow.status)
+        .filter(Borrow.id.in_(ids))
+        .with_for_update()
+    }
+    book_ids = {borrows[i].book_id for i in ids if i in borrows}
+    available = dict(
+        db.query(Book.id, Book.available_copies)
+        .filter(Book.id.in_(book_ids))
+        .order_by(Book.id)
+        .with_for_update()
+        .all()
+    )
+
+    outcomes = []
+    seen = set()
+    approved, rejected = [], []
+    taken = {}
+    for decision in data.decisions:
+        borrow = borrows.get(decision.borrow_id)
+        if decision.borrow_id in seen:
+            outcome = "duplicate"
+        elif not borrow:
+            outcome = "not_found"
+        elif borrow.status != "pending":
+            outcome = "not_pending"
+        elif not decision.approve:
+            outcome = "rejected"
+            rejected.append(borrow.id)
+        elif (available.get(borrow.book_id) or 0) - taken.get(borrow.book_id, 0) > 0:
+            outcome = "approved"
+            approved.append(borrow.id)
+            taken[borrow.book_id] = taken.get(borrow.book_id, 0) + 1
+        else:
+            outcome = "no_copies"
+        seen.add(decision.borrow_id)
+        outcomes.append(BorrowBatchResult(borrow_id=decision.borrow_id, outcome=outcome))
+
+    now = datetime.utcnow()
+    ok = _transition_many(db, rejected, "pending", status="rejected")
+    ok = ok and _transition_many(db, approved, "pending", status="approved", borrow_date=now)
+    ok = ok and _adjust_copies(db, {book_id: -n for book_id, n in taken.items()})
+    if not ok:
+        # Another request changed these rows between our read and write (SQLite
+        # has no row locks); nothing was applied
+        db.rollback()
+        raise HTTPException(409, "Borrows or inventory changed concurrently, please retry")
+    events.record(db, "borrow", approved + rejected)
+    events.record(db, "book", taken)
+    analytics.record(db, "approve", [(borrows[i].user_id, borrows[i].book_id) for i in approved])
+    analytics.record(db, "reject", [(borrows[i].user_id, borrows[i].book_id) for i in rejected])
+    db.commit()
+    read_cache.invalidate_borrows(*book_ids)
+    return outcomes
 
 @router.post("/return", response_model=BorrowResponse)
+@db_route
 def return_book(
     data: BorrowReturnRequest,
     user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     borrow = (
-        db.query(Borrow)
+        db.query(Borrow.id)
         .filter(
             Borrow.book_id == data.book_id,
             Borrow.user_id == user.id,
@@ -125,40 +249,159 @@ def return_book(
         .first()
     )
 
-    if not borrow:
+    if not borrow or not _mark_returned(db, borrow.id):
+        db.rollback()
         raise HTTPException(400, "No approved borrow found for this book")
+    if not waitlist.hand_over_copies(db, data.book_id, 1):
+        _release_copy(db, data.book_id)
 
-    borrow.is_returned = True
-    borrow.status = "returned"
-    borrow.return_date = datetime.utcnow()
-    book = db.query(Book).filter(Book.id == data.book_id).first()
-    book.available_copies += 1
-
+    events.record(db, "borrow", [borrow.id])
+    events.record(db, "book", [data.book_id])
+    analytics.record(db, "return", [(user.id, data.book_id)])
     db.commit()
-    db.refresh(borrow)
-    return _serialize_borrow(borrow, user)
+    read_cache.invalidate_borrows(data.book_id)
+    return _serialize_borrow(db.get(Borrow, borrow.id), user)
 
-@router.get("/my", response_model=list[BorrowResponse])
-def my_borrowed(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    borrows = db.query(Borrow).filter(Borrow.user_id == user.id).all()
-    return [_serialize_borrow(b, user) for b in borrows]
+@router.get("/my", response_model=BorrowPage)
+@db_route
+def my_borrowed(
+    request: Request,
+    status: str | None = None,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    sort: str = "id",
+    offset: int = Query(0, ge=0),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    return _list_borrows(db, request, user, status, date_from, date_to, sort, offset, limit, user_id=user.id)
 
-@router.get("/pending", response_model=list[BorrowResponse])
-def pending_requests(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+@router.get("/pending", response_model=BorrowPage)
+@db_route
+def pending_requests(
+    request: Request,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    sort: str = "id",
+    offset: int = Query(0, ge=0),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
     """Admin gets all pending borrow requests"""
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Only admin can view pending requests")
-    borrows = db.query(Borrow).filter(Borrow.status == "pending").all()
-    return [_serialize_borrow(b, None) for b in borrows]
+    return _list_borrows(db, request, current_user, "pending", date_from, date_to, sort, offset, limit)
 
-@router.get("/all", response_model=list[BorrowResponse])
-def all_borrows(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+@router.get("/all", response_model=BorrowPage)
+@db_route
+def all_borrows(
+    request: Request,
+    status: str | None = None,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    sort: str = "id",
+    offset: int = Query(0, ge=0),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Only admin can view borrows")
-    borrows = db.query(Borrow).all()
-    return [_serialize_borrow(b, None) for b in borrows]
+    return _list_borrows(db, request, current_user, status, date_from, date_to, sort, offset, limit)
+
+@router.get("/export")
+async def export_borrows(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    status: str | None = None,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    current_user: User = Depends(get_current_user),
+):
+    """Admin streams the whole (filtered) borrow ledger as NDJSON or CSV"""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only admin can export borrows")
+    chunks = export.export_borrows(format, status=status, date_from=date_from, date_to=date_to)
+    return StreamingResponse(
+        chunks,
+        media_type=export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="borrows.{format}"'},
+    )
+
+@router.get("/jobs", response_model=list[JobStatus])
+@db_route
+def job_status(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Admin sees the last run of each background job (overdue flagging, request expiry)"""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only admin can view jobs")
+    return db.query(JobLease).order_by(JobLease.name).all()
+
+@router.post("/admin/return/batch", response_model=list[BorrowBatchResult])
+@db_route
+def admin_return_batch(
+    data: BorrowBatchReturnRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Admin marks many borrows returned in one transaction"""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only admin can mark returns")
+
+    borrows = {
+        row.id: row
+        for row in db.query(Borrow.id, Borrow.user_id, Borrow.book_id, Borrow.status, Borrow.is_returned)
+        .filter(Borrow.id.in_(data.borrow_ids))
+        .with_for_update()
+    }
+
+    outcomes = []
+    seen = set()
+    returned = []
+    released = {}
+    for borrow_id in data.borrow_ids:
+        borrow = borrows.get(borrow_id)
+        if borrow_id in seen:
+            outcome = "duplicate"
+        elif not borrow:
+            outcome = "not_found"
+        elif borrow.is_returned:
+            outcome = "already_returned"
+        elif borrow.status != "approved":
+            outcome = "not_approved"
+        else:
+            outcome = "returned"
+            returned.append(borrow_id)
+            released[borrow.book_id] = released.get(borrow.book_id, 0) + 1
+        seen.add(borrow_id)
+        outcomes.append(BorrowBatchResult(borrow_id=borrow_id, outcome=outcome))
+
+    ok = _transition_many(
+        db, returned, "approved", status="returned", is_returned=True, return_date=datetime.utcnow()
+    )
+    if not ok:
+        db.rollback()
+        raise HTTPException(409, "Borrows changed concurrently, please retry")
+    # Copies go to waitlisted users first; only the rest become available
+    deltas = {}
+    for book_id, copies in released.items():
+        remaining = copies - waitlist.hand_over_copies(db, book_id, copies)
+        if remaining:
+            deltas[book_id] = remaining
+    # Books deleted since the borrow was made have nothing to give back to
+    _adjust_copies(db, deltas)
+    events.record(db, "borrow", returned)
+    events.record(db, "book", released)
+    analytics.record(db, "return", [(borrows[i].user_id, borrows[i].book_id) for i in returned])
+    db.commit()
+    read_cache.invalidate_borrows(*released)
+    return outcomes
 
 @router.post("/admin/return/{borrow_id}", response_model=BorrowResponse)
+@db_route
 def admin_return(
     borrow_id: int,
     current_user: User = Depends(get_current_user),
@@ -167,65 +410,321 @@ def admin_return(
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Only admin can mark returns")
 
-    borrow = db.query(Borrow).filter(Borrow.id == borrow_id).first()
+    borrow = db.query(Borrow.id, Borrow.user_id, Borrow.book_id).filter(Borrow.id == borrow_id).first()
     if not borrow:
         raise HTTPException(404, "Borrow not found")
-    if borrow.is_returned:
-        return _serialize_borrow(borrow, None)
-
-    borrow.is_returned = True
-    borrow.status = "returned"
-    borrow.return_date = datetime.utcnow()
-    book = db.query(Book).filter(Book.id == borrow.book_id).first()
-    if book:
-        book.available_copies += 1
+
+    # Only the request that actually flips is_returned gives the copy back
+    if _mark_returned(db, borrow.id):
+        if not waitlist.hand_over_copies(db, borrow.book_id, 1):
+            _release_copy(db, borrow.book_id)
+        events.record(db, "borrow", [borrow.id])
+        events.record(db, "book", [borrow.book_id])
+        analytics.record(db, "return", [(borrow.user_id, borrow.book_id)])
+        db.commit()
+        read_cache.invalidate_borrows(borrow.book_id)
+    return _serialize_borrow(db.get(Borrow, borrow.id), None)
+
+@router.post("/waitlist", response_model=WaitlistPosition, status_code=201)
+@db_route
+def join_waitlist(
+    data: WaitlistRequest,
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Queue for a book with no copies left. The next returned copy is handed to
+    the head of the queue as an approved borrow. Joining twice is a no-op."""
+    book = db.query(Book.available_copies).filter(Book.id == data.book_id).first()
+    if not book:
+        raise HTTPException(404, "Book not found")
+
+    position = _waitlist_position(db, data.book_id, user.id)
+    if position is not None:
+        return WaitlistPosition(book_id=data.book_id, position=position)
+    if book.available_copies > 0:
+        raise HTTPException(400, "Copies are available for this book. Please request it instead.")
+    if db.query(_open_borrow(user.id, data.book_id).exists()).scalar():
+        raise HTTPException(400, "You already have an open request or borrow for this book.")
+
+    # The next position is one index lookup; uq_waitlist_book_position makes a
+    # concurrent join that read the same tail fail, and it simply tries again
+    for _ in range(5):
+        tail = (
+            select(func.coalesce(func.max(WaitlistEntry.position), 0) + 1)
+            .where(WaitlistEntry.book_id == data.book_id)
+            .scalar_subquery()
+        )
+        db.execute(insert(WaitlistEntry).values(
+            book_id=data.book_id,
+            user_id=user.id,
+            position=tail,
+            loan_days=data.loan_days,
+            created_at=datetime.utcnow(),
+        ))
+        try:
+            db.commit()
+            break
+        except IntegrityError:
+            db.rollback()
+    else:
+        raise HTTPException(409, "Waitlist is busy, please retry")
+
+    return WaitlistPosition(book_id=data.book_id, position=_waitlist_position(db, data.book_id, user.id))
+
+@router.get("/waitlist/{book_id}", response_model=WaitlistPosition)
+@db_route
+def waitlist_position(
+    book_id: int,
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Place in the waitlist (1 = next), or the borrow created once a copy was handed over"""
+    position = _waitlist_position(db, book_id, user.id)
+    if position is not None:
+        return WaitlistPosition(book_id=book_id, position=position)
+    borrow_id = db.query(Borrow.id).filter(
+        Borrow.user_id == user.id,
+        Borrow.book_id == book_id,
+        Borrow.status == "approved",
+        Borrow.is_returned == False,
+    ).scalar()
+    if borrow_id is None:
+        raise HTTPException(404, "You are not on the waitlist for this book")
+    return WaitlistPosition(book_id=book_id, borrow_id=borrow_id)
+
+@router.delete("/waitlist/{book_id}")
+@db_route
+def leave_waitlist(
+    book_id: int,
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    result = db.execute(
+        delete(WaitlistEntry)
+        .where(WaitlistEntry.book_id == book_id, WaitlistEntry.user_id == user.id)
+        .execution_options(synchronize_session=False)
+    )
     db.commit()
-    db.refresh(borrow)
-    return _serialize_borrow(borrow, None)
+    if result.rowcount == 0:
+        raise HTTPException(404, "You are not on the waitlist for this book")
+    return {"message": "Left the waitlist"}
 
 @router.get("/status/{book_id}")
-def borrow_status(book_id: int, db: Session = Depends(get_db)):
-    count = db.query(Borrow).filter(Borrow.book_id == book_id, Borrow.is_returned == False).count()
-    return {"borrowed_count": count}
+async def borrow_status(book_id: int, request: Request, db: Session = Depends(get_db)):
+    key = read_cache.borrowed_key(book_id)
+    cached, generation = read_cache.get_json(key)
+    if cached is None:
+        cached = {"borrowed_count": await run_db(db, _borrowed_count, book_id)}
+        read_cache.set_json(key, cached, generation)
+    return read_cache.json_response(request, cached)
+
+@router.get("/availability")
+async def books_availability(
+    request: Request,
+    ids: list[int] = Query(..., max_length=500),
+    db: Session = Depends(get_db),
+):
+    """Availability for many books in one call: {book_id: {total, available}}.
+    Unknown ids are left out."""
+    keys = {book_id: read_cache.availability_key(book_id) for book_id in ids}
+    cached, generations = read_cache.get_many_json(list(keys.values()))
+    result = {str(book_id): cached[key] for book_id, key in keys.items() if key in cached}
+    missing = [book_id for book_id in keys if str(book_id) not in result]
+    if missing:
+        loaded = await run_db(db, _load_availability, missing)
+        for book_id, value in loaded.items():
+            read_cache.set_json(keys[book_id], value, generations[keys[book_id]])
+            result[str(book_id)] = value
+        result = {str(book_id): result[str(book_id)] for book_id in keys if str(book_id) in result}
+    return read_cache.json_response(request, result)
 
 @router.get("/availability/{book_id}")
-def book_availability(book_id: int, db: Session = Depends(get_db)):
-    book = db.query(Book).filter(Book.id == book_id).first()
-    return {"total": book.total_copies, "available": book.available_copies}
+async def book_availability(book_id: int, request: Request, db: Session = Depends(get_db)):
+    key = read_cache.availability_key(book_id)
+    cached, generation = read_cache.get_json(key)
+    if cached is None:
+        cached = (await run_db(db, _load_availability, [book_id])).get(book_id)
+        if cached is None:
+            raise HTTPException(404, "Book not found")
+        read_cache.set_json(key, cached, generation)
+    return read_cache.json_response(request, cached)
 
 
-def _serialize_borrow(borrow: Borrow, user_override: User | None):
+def _borrowed_count(db, book_id: int) -> int:
+    return db.query(Borrow).filter(Borrow.book_id == book_id, Borrow.is_returned == False).count()
+
+
+def _load_availability(db, book_ids: list[int]) -> dict:
+    rows = db.query(Book.id, Book.total_copies, Book.available_copies).filter(Book.id.in_(book_ids))
+    return {row.id: {"total": row.total_copies, "available": row.available_copies} for row in rows}
+
+
+def _serialize_borrow(borrow: Borrow, user_override: User | None) -> dict:
     # Use override when we already have the current user to avoid another lookup
     user_obj = user_override if user_override else None
     if not user_obj:
         user_obj = borrow.user if hasattr(borrow, "user") else None
 
-    user_info = None
-    if user_obj:
-        user_info = BorrowUserInfo(
-            id=user_obj.id,
-            username=user_obj.username,
-            email=user_obj.email,
-        )
+    # Plain dict: validated once, against the route's response_model
+    return {
+        "id": borrow.id,
+        "book": {"id": borrow.book.id, "title": borrow.book.title, "author": borrow.book.author},
+        "user": {"id": user_obj.id, "username": user_obj.username, "email": user_obj.email} if user_obj else None,
+        "request_date": borrow.request_date,
+        "requested_borrow_date": borrow.requested_borrow_date,
+        "requested_return_date": borrow.requested_return_date,
+        "borrow_date": borrow.borrow_date,
+        "return_date": borrow.return_date,
+        "status": borrow.status,
+        "is_returned": borrow.is_returned,
+        "overdue_since": borrow.overdue_since,
+    }
+
+
+def _transition(db, borrow_id: int, from_status: str, **values) -> bool:
+    """Move a borrow out of from_status; False when another request got there first."""
+    result = db.execute(
+        update(Borrow)
+        .where(Borrow.id == borrow_id, Borrow.status == from_status)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
 
-    # Convert Book object to BorrowBookInfo
-    from schema.borrow import BorrowBookInfo
-    book_info = BorrowBookInfo(
-        id=borrow.book.id,
-        title=borrow.book.title,
-        author=borrow.book.author,
+
+def _mark_returned(db, borrow_id: int) -> bool:
+    """Flip an approved, open borrow to returned."""
+    result = db.execute(
+        update(Borrow)
+        .where(Borrow.id == borrow_id, Borrow.status == "approved", Borrow.is_returned == False)
+        .values(status="returned", is_returned=True, return_date=datetime.utcnow())
+        .execution_options(synchronize_session=False)
     )
+    return result.rowcount == 1
+
+
+def _take_copy(db, book_id: int):
+    """Atomically decrement available_copies if one is left; returns the new count or None."""
+    return db.execute(
+        update(Book)
+        .where(Book.id == book_id, Book.available_copies > 0)
+        .values(available_copies=Book.available_copies - 1)
+        .returning(Book.available_copies)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+
 
-    return BorrowResponse(
-        id=borrow.id,
-        book=book_info,
-        user=user_info,
-        request_date=borrow.request_date,
-        requested_borrow_date=borrow.requested_borrow_date,
-        requested_return_date=borrow.requested_return_date,
-        borrow_date=borrow.borrow_date,
-        return_date=borrow.return_date,
-        status=borrow.status,
-        is_returned=borrow.is_returned,
+def _release_copy(db, book_id: int):
+    """Atomically give a copy back; returns the new count or None if the book is gone."""
+    return db.execute(
+        update(Book)
+        .where(Book.id == book_id)
+        .values(available_copies=Book.available_copies + 1)
+        .returning(Book.available_copies)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+
+
+def _open_borrow(user_id: int, book_id: int):
+    return select(Borrow.id).where(
+        Borrow.user_id == user_id,
+        Borrow.book_id == book_id,
+        Borrow.status.in_(["pending", "approved"]),
+        Borrow.is_returned == False,
     )
 
+
+def _waitlist_position(db, book_id: int, user_id: int) -> int | None:
+    """1-based place in line: entries ahead are counted on the (book_id, position) index."""
+    mine = db.query(WaitlistEntry.position).filter(
+        WaitlistEntry.book_id == book_id, WaitlistEntry.user_id == user_id
+    ).scalar()
+    if mine is None:
+        return None
+    ahead = db.query(func.count()).select_from(WaitlistEntry).filter(
+        WaitlistEntry.book_id == book_id, WaitlistEntry.position < mine
+    ).scalar()
+    return ahead + 1
+
+
+def _transition_many(db, borrow_ids: list[int], from_status: str, **values) -> bool:
+    """Set-based _transition; False unless every borrow was still in from_status."""
+    if not borrow_ids:
+        return True
+    result = db.execute(
+        update(Borrow)
+        .where(Borrow.id.in_(borrow_ids), Borrow.status == from_status)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == len(borrow_ids)
+
+
+def _adjust_copies(db, deltas: dict[int, int]) -> bool:
+    """Apply per-book available_copies deltas in one UPDATE.
+
+    The statement never takes a count below zero; returns False if any book
+    could not be updated for that reason (or no longer exists).
+    """
+    if not deltas:
+        return True
+    delta = case(deltas, value=Book.id)
+    result = db.execute(
+        update(Book)
+        .where(Book.id.in_(deltas), Book.available_copies + delta >= 0)
+        .values(available_copies=Book.available_copies + delta)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == len(deltas)
+
+
+def _list_borrows(db, request, viewer, status, date_from, date_to, sort, offset, limit, user_id=None):
+    """One page of borrows as a single joined query; date filters apply to request_date.
+    next_cursor is the offset of the next page."""
+    field = SORT_FIELDS.get(sort.lstrip("-"))
+    if field is None:
+        raise HTTPException(400, f"Cannot sort by {sort}. Use one of: {', '.join(SORT_FIELDS)}")
+    not_modified, headers = read_cache.list_validators(db, request, viewer.id)
+    if not_modified:
+        return not_modified
+
+    query = (
+        db.query(*LIST_COLUMNS)
+        .join(Book, Book.id == Borrow.book_id)
+        .outerjoin(User, User.id == Borrow.user_id)
+    )
+    if user_id is not None:
+        query = query.filter(Borrow.user_id == user_id)
+    if status:
+        query = query.filter(Borrow.status == status)
+    if date_from:
+        query = query.filter(Borrow.request_date >= date_from)
+    if date_to:
+        query = query.filter(Borrow.request_date < date_to)
+
+    order = field.desc() if sort.startswith("-") else field.asc()
+    rows = query.order_by(order, Borrow.id).offset(offset).limit(limit + 1).all()
+
+    items = [_serialize_row(row) for row in rows[:limit]]
+    next_cursor = offset + limit if len(rows) > limit else None
+    return serialize.json_response(BorrowPage, {"items": items, "next_cursor": next_cursor}, headers=headers)
+
+
+def _serialize_row(row) -> dict:
+    """A LIST_COLUMNS row as a BorrowResponse-shaped dict (validated later, once, with the page)."""
+    return {
+        "id": row.id,
+        "book": {"id": row.book_id, "title": row.book_title, "author": row.book_author},
+        "user": (
+            {"id": row.user_id, "username": row.user_username, "email": row.user_email}
+            if row.user_id is not None else None
+        ),
+        "request_date": row.request_date,
+        "requested_borrow_date": row.requested_borrow_date,
+        "requested_return_date": row.requested_return_date,
+        "borrow_date": row.borrow_date,
+        "return_date": row.return_date,
+        "status": row.status,
+        "is_returned": row.is_returned,
+        "overdue_since": row.overdue_since,
+    }
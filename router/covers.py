@@ -0,0 +1,25 @@
+from fastapi import APIRouter, HTTPException, Path
+from fastapi.responses import Response
+from utils import covers
+
+router = APIRouter(prefix="/covers", tags=["Covers"])
+
+# The URL names the source digest and the size, so the bytes behind it never change
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+@router.get("/{digest}/{size}.jpg")
+async def cover(
+    digest: str = Path(..., pattern="^[0-9a-f]{64}$"),
+    size: str = Path(...),
+):
+    """A cover thumbnail, rendered on first request if it is not cached"""
+    if size not in covers.SIZES:
+        raise HTTPException(404, f"Unknown cover size. Use one of: {', '.join(covers.SIZES)}")
+    try:
+        # The bytes, not a path: the cache trim may remove the file before a
+        # FileResponse would get to open it
+        data = await covers.thumbnail(digest, size)
+    except FileNotFoundError:
+        raise HTTPException(404, "Cover not found")
+    return Response(data, media_type="image/jpeg", headers={"Cache-Control": IMMUTABLE})
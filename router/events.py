@@ -0,0 +1,181 @@
+import asyncio
+import time
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from config import Settings
+from database.database import get_db, db_route, run_in_session
+from models.books import Book
+from models.borrow import Borrow
+from models.change import ChangeCounter, ChangeLog
+from models.user import User
+from jose import JWTError
+from router.auth import get_current_user, oauth2_scheme, principal_for, sync_revocations
+from router.books import SUMMARY_COLUMNS
+from router.borrow import LIST_COLUMNS, _serialize_row
+from schema.events import ChangeSet, StreamTicket
+from utils import events, serialize
+from utils import token as tokens
+
+router = APIRouter(prefix="/events", tags=["Events"])
+
+POLL_SECONDS = Settings().CHANGE_POLL_SECONDS
+# More changed rows than this since the client's version and it gets a reset
+MAX_CHANGES = 1000
+
+
+@router.get("/changes", response_model=ChangeSet)
+@db_route
+def changes(
+    since: int | None = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Admin gets every borrow, book and user changed after version `since`.
+    Without `since` only the current version is returned (with reset=true)."""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only admin can view changes")
+    return serialize.json_response(ChangeSet, _changes_since(db, since))
+
+
+@router.post("/ticket", response_model=StreamTicket)
+async def stream_ticket(
+    token: str = Depends(oauth2_scheme),
+    current_user: User = Depends(get_current_user),
+):
+    """Admin trades the access token for a ticket that opens /events/stream.
+    The ticket expires in seconds; the stream it opens ends with the access token."""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only admin can view changes")
+    # Already verified by get_current_user, so this is a cache hit
+    claims = tokens.claims_cache.decode(token)
+    return {"ticket": tokens.create_stream_ticket(claims), "expires_in": tokens.STREAM_TICKET_SECONDS}
+
+
+@router.get("/stream")
+async def stream(
+    since: int | None = None,
+    # EventSource cannot send an Authorization header; see POST /events/ticket
+    ticket: str = Query(...),
+    last_event_id: str | None = Header(None),
+):
+    """Server-sent events: one `changes` event (a ChangeSet) per new version.
+
+    Commits in this worker wake the stream immediately; other workers'
+    changes are picked up every CHANGE_POLL_SECONDS. The stream ends when the
+    access token the ticket was issued for expires or is revoked.
+    """
+    try:
+        claims = tokens.decode_stream_ticket(ticket)
+    except JWTError:
+        raise HTTPException(401, "Invalid or expired stream ticket")
+    current_user = await principal_for(claims)
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only admin can view changes")
+    # Set by the browser when EventSource reconnects
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+
+    async def event_source():
+        version = since
+        waiter = events.bus.subscribe()
+        try:
+            while not events.bus.closed:
+                await sync_revocations()
+                remaining = claims["exp"] - time.time()
+                if remaining <= 0 or tokens.revocations.is_revoked(claims):
+                    return
+                waiter.clear()
+                changes = await run_in_session(_changes_since, version)
+                if changes["reset"] or changes["version"] != version:
+                    version = changes["version"]
+                    data = serialize.dump_json(ChangeSet, changes).decode()
+                    yield f"id: {version}\nevent: changes\ndata: {data}\n\n"
+                try:
+                    await asyncio.wait_for(waiter.wait(), min(POLL_SECONDS, remaining))
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+        finally:
+            events.bus.unsubscribe(waiter)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _changes_since(db: Session, since: int | None) -> dict:
+    """A ChangeSet-shaped dict of everything changed after version `since`."""
+    counter = db.query(ChangeCounter.version, ChangeCounter.pruned_through).filter(ChangeCounter.id == 1).one()
+    if since is None or since < counter.pruned_through or since > counter.version:
+        return {"version": counter.version, "reset": True}
+    if since == counter.version:
+        return {"version": since, "reset": False}
+
+    # Reading up to the counter value we just saw is safe: a version is only
+    # visible once every lower version has committed
+    rows = (
+        db.query(ChangeLog.entity, ChangeLog.entity_id, ChangeLog.action)
+        .filter(ChangeLog.version > since, ChangeLog.version <= counter.version)
+        .order_by(ChangeLog.version)
+        .limit(MAX_CHANGES + 1)
+        .all()
+    )
+    if len(rows) > MAX_CHANGES:
+        return {"version": counter.version, "reset": True}
+
+    # Latest action per entity wins
+    latest = {entity: {} for entity in events.ENTITIES}
+    for row in rows:
+        latest[row.entity][row.entity_id] = row.action
+    upserts = {
+        entity: [i for i, action in actions.items() if action == "upsert"]
+        for entity, actions in latest.items()
+    }
+    deleted = {
+        entity: {i for i, action in actions.items() if action == "delete"}
+        for entity, actions in latest.items()
+    }
+
+    borrows, books, users = [], [], []
+    if upserts["borrow"]:
+        borrows = [
+            _serialize_row(row)
+            for row in db.query(*LIST_COLUMNS)
+            .join(Book, Book.id == Borrow.book_id)
+            .outerjoin(User, User.id == Borrow.user_id)
+            .filter(Borrow.id.in_(upserts["borrow"]))
+            .order_by(Borrow.id)
+        ]
+    if upserts["book"]:
+        books = [
+            row._asdict()
+            for row in db.query(*SUMMARY_COLUMNS).filter(Book.id.in_(upserts["book"])).order_by(Book.id)
+        ]
+    if upserts["user"]:
+        users = [
+            row._asdict()
+            for row in db.query(User.id, User.username, User.email, User.full_name, User.is_admin)
+            .filter(User.id.in_(upserts["user"]))
+            .order_by(User.id)
+        ]
+
+    # Rows changed and then deleted (or whose book is gone) count as deleted
+    deleted["borrow"] |= set(upserts["borrow"]) - {b["id"] for b in borrows}
+    deleted["book"] |= set(upserts["book"]) - {b["id"] for b in books}
+    deleted["user"] |= set(upserts["user"]) - {u["id"] for u in users}
+
+    return {
+        "version": counter.version,
+        "reset": False,
+        "borrows": borrows,
+        "books": books,
+        "users": users,
+        "deleted": {
+            "borrows": sorted(deleted["borrow"]),
+            "books": sorted(deleted["book"]),
+            "users": sorted(deleted["user"]),
+        },
+    }
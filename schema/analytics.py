@@ -0,0 +1,34 @@
+from datetime import date
+from pydantic import BaseModel, ConfigDict
+
+
+class DailyUsageResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    day: date
+    requests: int = 0
+    approvals: int = 0
+    rejections: int = 0
+    returns: int = 0
+
+
+class BookUsageResponse(BaseModel):
+    book_id: int
+    title: str
+    requests: int = 0
+    borrows: int = 0
+
+
+class CategoryUsageResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    category: str  # "" for uncategorized books
+    requests: int = 0
+    borrows: int = 0
+
+
+class UserUsageResponse(BaseModel):
+    user_id: int
+    username: str
+    active_borrows: int = 0
+    total_borrows: int = 0
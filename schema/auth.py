@@ -8,6 +8,15 @@ class LoginRequest(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    # Spend once at /auth/refresh for a new pair before the access token expires
+    refresh_token: str
+    expires_in: int  # seconds
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    refresh_token: str | None = None
 
 class SignupRequest(BaseModel):
     username: str
@@ -20,6 +29,13 @@ class UserResponse(BaseModel):
     username: str
     email: EmailStr
 
+class UserSummary(BaseModel):
+    id: int
+    username: str
+    email: str | None = None
+    full_name: str | None = None
+    is_admin: bool | None = False
+
 class AdminCreateRequest(BaseModel):
     username: str
     email: EmailStr
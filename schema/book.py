@@ -1,6 +1,8 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field, computed_field
+from utils.cover_urls import cover_url
 
 class BookCreate(BaseModel):
+    isbn: str | None = None
     title: str
     author: str
     description: str | None = None
@@ -12,6 +14,7 @@ class BookCreate(BaseModel):
 
 class BookResponse(BaseModel):
     id: int
+    isbn: str | None = None
     title: str   
     author: str
     description: str | None = None
@@ -20,6 +23,46 @@ class BookResponse(BaseModel):
     file_path: str | None = None
     total_copies: int
     available_copies: int
+    cover_digest: str | None = Field(None, exclude=True)
 
-    class Config:
-        orm_mode = True
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+
+    @computed_field
+    @property
+    def cover_url(self) -> str | None:
+        # Large thumbnail; None until the cover has been ingested
+        return cover_url(self.cover_digest, "lg") if self.cover_digest else None
+
+class BookSummary(BaseModel):
+    id: int
+    isbn: str | None = None
+    title: str
+    author: str
+    description: str | None = None
+    category: str | None = None
+    # Small thumbnail only; the source picture_url can be a multi-MB data URL
+    cover_url: str | None = None
+    has_pdf: bool = False
+    total_copies: int
+    available_copies: int
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class BookPage(BaseModel):
+    items: list[BookSummary]
+    next_cursor: int | None = None
+
+
+class BookImportError(BaseModel):
+    row: int
+    isbn: str | None = None
+    error: str
+
+
+class BookImportResult(BaseModel):
+    rows: int
+    inserted: int
+    updated: int
+    failed: int
+    errors: list[BookImportError]
@@ -1,5 +1,5 @@
 from datetime import datetime
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, ConfigDict, Field, ValidationInfo, field_validator
 
 
 class BorrowRequest(BaseModel):
@@ -7,10 +7,11 @@ class BorrowRequest(BaseModel):
     requested_borrow_date: datetime
     requested_return_date: datetime
 
-    @validator('requested_return_date')
-    def validate_return_date(cls, v, values):
-        if 'requested_borrow_date' in values:
-            borrow_date = values['requested_borrow_date']
+    @field_validator('requested_return_date')
+    @classmethod
+    def validate_return_date(cls, v, info: ValidationInfo):
+        if 'requested_borrow_date' in info.data:
+            borrow_date = info.data['requested_borrow_date']
             if v <= borrow_date:
                 raise ValueError('Return date must be after borrow date')
             days_diff = (v - borrow_date).days
@@ -19,6 +20,20 @@ class BorrowRequest(BaseModel):
         return v
 
 
+class WaitlistRequest(BaseModel):
+    book_id: int
+    # Length of the loan once a copy is handed over; same limit as a request
+    loan_days: int = Field(14, ge=1, le=15)
+
+
+class WaitlistPosition(BaseModel):
+    book_id: int
+    # 1 = next in line; None once a copy has been allocated
+    position: int | None = None
+    # The approved borrow created for this user when their turn came
+    borrow_id: int | None = None
+
+
 class BorrowReturnRequest(BaseModel):
     book_id: int
 
@@ -28,13 +43,27 @@ class BorrowApprovalRequest(BaseModel):
     approve: bool
 
 
+class BorrowBatchApprovalRequest(BaseModel):
+    decisions: list[BorrowApprovalRequest] = Field(..., min_length=1, max_length=5000)
+
+
+class BorrowBatchReturnRequest(BaseModel):
+    borrow_ids: list[int] = Field(..., min_length=1, max_length=5000)
+
+
+class BorrowBatchResult(BaseModel):
+    borrow_id: int
+    # approved, rejected, returned, no_copies, not_found, not_pending,
+    # not_approved, already_returned, duplicate
+    outcome: str
+
+
 class BorrowBookInfo(BaseModel):
     id: int
     title: str
     author: str
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class BorrowUserInfo(BaseModel):
@@ -42,8 +71,7 @@ class BorrowUserInfo(BaseModel):
     username: str
     email: str | None = None
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class BorrowResponse(BaseModel):
@@ -57,6 +85,24 @@ class BorrowResponse(BaseModel):
     return_date: datetime | None = None
     status: str
     is_returned: bool
+    overdue_since: datetime | None = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class BorrowPage(BaseModel):
+    items: list[BorrowResponse]
+    next_cursor: int | None = None
+
+
+class JobStatus(BaseModel):
+    name: str
+    owner: str | None = None
+    lease_until: datetime | None = None
+    last_started_at: datetime | None = None
+    last_finished_at: datetime | None = None
+    last_duration: float | None = None
+    last_rows: int | None = None
+    last_error: str | None = None
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
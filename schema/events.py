@@ -0,0 +1,27 @@
+from pydantic import BaseModel
+from schema.auth import UserSummary
+from schema.book import BookSummary
+from schema.borrow import BorrowResponse
+
+
+class DeletedIds(BaseModel):
+    borrows: list[int] = []
+    books: list[int] = []
+    users: list[int] = []
+
+
+class ChangeSet(BaseModel):
+    # Pass back as `since` to get the next changes
+    version: int
+    # True when the client is too far behind (or new): reload the full lists
+    reset: bool = False
+    borrows: list[BorrowResponse] = []
+    books: list[BookSummary] = []
+    users: list[UserSummary] = []
+    deleted: DeletedIds = DeletedIds()
+
+
+class StreamTicket(BaseModel):
+    # Pass as ?ticket= to /events/stream within expires_in seconds
+    ticket: str
+    expires_in: int
@@ -0,0 +1,62 @@
+import os
+import tempfile
+
+# The app reads its settings from the environment at import time, so point it
+# at a scratch SQLite database before anything imports config. TEST_DATABASE_URL
+# runs the suite against a disposable server database (e.g. PostgreSQL) instead
+_scratch = tempfile.mkdtemp(prefix="library-tests-")
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL") or f"sqlite:///{_scratch}/library.db"
+os.environ["SCHEDULER_ENABLED"] = "false"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["PASSWORD_HASH_ROUNDS"] = "1000"
+os.environ["COVER_STORE_DIR"] = f"{_scratch}/covers"
+os.environ["PDF_STORE_DIR"] = f"{_scratch}/pdfs"
+os.environ["LOG_LEVEL"] = "WARNING"
+
+import itertools
+import pytest
+from fastapi.testclient import TestClient
+from database.migrations import upgrade
+
+upgrade()
+
+from main import app  # noqa: E402  (needs the migrated database)
+
+_names = itertools.count(1)
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: stress tests; deselect with -m 'not slow'")
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+def _login(client, username: str) -> dict:
+    response = client.post("/auth/login", data={"username": username, "password": "pw"})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture(scope="session")
+def admin_headers(client):
+    client.post("/auth/create-admin", json={"username": "admin", "email": "admin@example.com", "password": "pw"})
+    return _login(client, "admin")
+
+
+@pytest.fixture
+def make_user(client):
+    """Sign up a fresh user; returns (user id, auth headers)."""
+
+    def make():
+        name = f"user{next(_names)}"
+        response = client.post("/auth/signup", json={
+            "username": name, "full_name": name, "email": f"{name}@example.com", "password": "pw",
+        })
+        assert response.status_code == 200, response.text
+        return response.json()["id"], _login(client, name)
+
+    return make
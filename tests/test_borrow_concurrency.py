@@ -0,0 +1,169 @@
+"""Concurrent approvals and returns against a book with few copies (user-006)."""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from database.database import SQL_DB_URL, SessionLocal, violates
+from models.books import Book
+from models.borrow import Borrow
+from models.user import User
+from router.borrow import OPEN_BORROW_INDEX, approve_borrow, return_book
+from schema.borrow import BorrowApprovalRequest, BorrowReturnRequest
+
+COPIES = 20
+APPROVALS = 400
+# Each worker thread holds its own database connection for the whole run; a
+# server database needs max_connections above this
+CONNECTIONS = 200
+DATES = {"requested_borrow_date": "2030-01-01T00:00:00", "requested_return_date": "2030-01-10T00:00:00"}
+
+
+def _available(book_id: int) -> int:
+    db = SessionLocal()
+    try:
+        return db.get(Book, book_id).available_copies
+    finally:
+        db.close()
+
+
+class _Watcher(threading.Thread):
+    """Samples available_copies until stopped, keeping the lowest value seen."""
+
+    def __init__(self, book_id: int):
+        super().__init__(daemon=True)
+        self.book_id = book_id
+        self.lowest = _available(book_id)
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.is_set():
+            self.lowest = min(self.lowest, _available(self.book_id))
+
+    def stop(self) -> int:
+        self.done.set()
+        self.join()
+        return self.lowest
+
+
+def _in_parallel(sessions, calls: list) -> list:
+    """Run `call(db)` for every call across CONNECTIONS threads, each with its own session.
+
+    The threads open their connections first and start together, so the calls
+    really contend in the database; returns the HTTP status of every call.
+    """
+    start = threading.Barrier(min(CONNECTIONS, len(calls)))
+
+    def worker(share):
+        db = sessions()
+        try:
+            db.connection()
+            start.wait()
+            statuses = []
+            for call in share:
+                try:
+                    call(db)
+                    statuses.append(200)
+                except HTTPException as error:
+                    db.rollback()
+                    statuses.append(error.status_code)
+            return statuses
+        finally:
+            db.close()
+
+    shares = [calls[i::CONNECTIONS] for i in range(min(CONNECTIONS, len(calls)))]
+    with ThreadPoolExecutor(max_workers=len(shares)) as pool:
+        return [status for statuses in pool.map(worker, shares) for status in statuses]
+
+
+@pytest.fixture(scope="module")
+def sessions():
+    """Sessions on a pool-less engine: every session is a separate connection."""
+    engine = create_engine(SQL_DB_URL, poolclass=NullPool)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def book_id(client, admin_headers):
+    response = client.post("/books/", headers=admin_headers, json={
+        "title": "Contended", "author": "Author", "total_copies": COPIES, "available_copies": COPIES,
+    })
+    assert response.status_code in (200, 201), response.text
+    return response.json()["id"]
+
+
+@pytest.fixture
+def borrowers(book_id):
+    """APPROVALS users, each with a pending request for the book."""
+    db = SessionLocal()
+    try:
+        user_ids = db.scalars(insert(User).returning(User.id, sort_by_parameter_order=True), [
+            {"username": f"borrower{book_id}-{n}", "email": f"borrower{book_id}-{n}@example.com", "password": "x"}
+            for n in range(APPROVALS)
+        ]).all()
+        borrow_ids = db.scalars(insert(Borrow).returning(Borrow.id, sort_by_parameter_order=True), [
+            {"user_id": user_id, "book_id": book_id, "status": "pending"} for user_id in user_ids
+        ]).all()
+        db.commit()
+        users = {user.id: user for user in db.query(User).filter(User.id.in_(user_ids))}
+        return {borrow_id: users[user_id] for borrow_id, user_id in zip(borrow_ids, user_ids)}
+    finally:
+        db.close()
+
+
+@pytest.mark.slow
+def test_parallel_approvals_hand_out_exactly_the_copies(sessions, book_id, borrowers):
+    admin = User(is_admin=True)
+
+    def approve(borrow_id):
+        return lambda db: approve_borrow.__wrapped__(
+            BorrowApprovalRequest(borrow_id=borrow_id, approve=True), current_user=admin, db=db,
+        )
+
+    watcher = _Watcher(book_id)
+    watcher.start()
+    statuses = _in_parallel(sessions, [approve(borrow_id) for borrow_id in borrowers])
+    lowest = watcher.stop()
+
+    assert sorted(statuses) == [200] * COPIES + [400] * (APPROVALS - COPIES)
+    assert lowest >= 0
+    assert _available(book_id) == 0
+    db = SessionLocal()
+    try:
+        approved = db.query(Borrow.user_id).filter(Borrow.book_id == book_id, Borrow.status == "approved").all()
+        assert len(approved) == COPIES
+    finally:
+        db.close()
+
+    # Every borrower returns twice at once; only one return each puts a copy back
+    holders = [user for user in borrowers.values() if user.id in {row.user_id for row in approved}]
+
+    def give_back(user):
+        return lambda db: return_book.__wrapped__(BorrowReturnRequest(book_id=book_id), user=user, db=db)
+
+    statuses = _in_parallel(sessions, [give_back(user) for user in holders * 2])
+    assert sorted(statuses) == [200] * COPIES + [400] * COPIES
+    assert _available(book_id) == COPIES
+
+
+def test_second_open_borrow_is_rejected_by_the_index(client, make_user, book_id):
+    user_id, headers = make_user()
+    assert client.post("/borrow/request", headers=headers, json={"book_id": book_id, **DATES}).status_code == 201
+
+    response = client.post("/borrow/request", headers=headers, json={"book_id": book_id, **DATES})
+    assert response.status_code == 400
+
+    # The database itself refuses it, whatever the route checks
+    db = SessionLocal()
+    try:
+        db.add(Borrow(user_id=user_id, book_id=book_id, status="pending"))
+        with pytest.raises(IntegrityError) as error:
+            db.commit()
+        assert violates(error.value, OPEN_BORROW_INDEX)
+    finally:
+        db.rollback()
+        db.close()
@@ -0,0 +1,33 @@
+"""An import row that leaves optional fields empty keeps the book's values (user-015)."""
+import io
+from database.database import SessionLocal
+from models.books import Book
+
+DIGEST = "ab" * 32
+
+
+def test_update_keeps_fields_the_row_leaves_out(client, admin_headers):
+    db = SessionLocal()
+    try:
+        book = Book(isbn="9780000000024", title="Old", author="Author", description="Kept", category="Kept",
+                    picture_url="https://example.com/cover.jpg", cover_digest=DIGEST,
+                    total_copies=1, available_copies=1)
+        db.add(book)
+        db.commit()
+        book_id = book.id
+    finally:
+        db.close()
+
+    feed = "isbn,title,author,total_copies\n9780000000024,New,Author,1\n"
+    response = client.post("/books/import", headers=admin_headers,
+                           files={"file": ("feed.csv", io.BytesIO(feed.encode()), "text/csv")})
+    assert response.json()["updated"] == 1, response.text
+
+    db = SessionLocal()
+    try:
+        book = db.get(Book, book_id)
+        assert book.title == "New"
+        assert (book.description, book.category) == ("Kept", "Kept")
+        assert (book.picture_url, book.cover_digest) == ("https://example.com/cover.jpg", DIGEST)
+    finally:
+        db.close()
@@ -0,0 +1,40 @@
+"""Remote covers are only fetched from public hosts, and a trimmed thumbnail
+is rendered again rather than failing (user-020)."""
+import base64
+import io
+import os
+import pytest
+from PIL import Image
+from utils import covers
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/cover.jpg",
+    "http://169.254.169.254/latest/meta-data",
+    "http://10.0.0.1/cover.jpg",
+    "http://[::1]/cover.jpg",
+    "file:///etc/passwd",
+])
+def test_fetch_refuses_non_public_urls(url):
+    with pytest.raises(ValueError):
+        covers.fetch(url)
+
+
+def test_trimmed_thumbnail_is_rendered_again(client, admin_headers):
+    image = io.BytesIO()
+    Image.new("RGB", (40, 60), "red").save(image, "PNG")
+    picture = "data:image/png;base64," + base64.b64encode(image.getvalue()).decode()
+    response = client.post("/books/", headers=admin_headers, json={
+        "title": "Covered", "author": "Author", "picture_url": picture, "total_copies": 1, "available_copies": 1,
+    })
+    assert response.status_code in (200, 201), response.text
+    url = response.json()["cover_url"]
+    digest = covers.URL_PATTERN.match(url).group(1)
+
+    assert client.get(url).status_code == 200
+    path = covers.thumb_path(digest, "lg")
+    os.remove(path)
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    assert Image.open(io.BytesIO(response.content)).size == (40, 60)
@@ -0,0 +1,59 @@
+"""List endpoints must cost the same number of statements whatever the page size (user-005)."""
+import re
+from datetime import datetime, timedelta
+import pytest
+from database.database import SessionLocal
+from models.books import Book
+from models.borrow import Borrow
+
+LIST_PATHS = ["/borrow/my", "/borrow/pending", "/borrow/all", "/books/"]
+
+
+def _seed(user_id: int, count: int):
+    """count books, each with one pending and one returned borrow of user_id."""
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        books = [Book(title=f"Book {i}", author="Author", category="Fiction", total_copies=2, available_copies=1)
+                 for i in range(count)]
+        db.add_all(books)
+        db.flush()
+        for book in books:
+            db.add(Borrow(user_id=user_id, book_id=book.id, status="pending",
+                          requested_borrow_date=now, requested_return_date=now + timedelta(days=7)))
+            db.add(Borrow(user_id=user_id, book_id=book.id, status="returned", is_returned=True,
+                          borrow_date=now - timedelta(days=9), return_date=now - timedelta(days=2)))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _queries(client, path: str) -> int:
+    """Total statements the app has run for path's route, from /metrics."""
+    text = client.get("/metrics").text
+    match = re.search(r'^http_request_db_queries_sum\{method="GET",route="%s"\} (\S+)$' % re.escape(path), text, re.M)
+    return int(float(match.group(1))) if match else 0
+
+
+def _measure(client, headers: dict, path: str) -> int:
+    # A warm-up request fills the principal cache, then the counted one runs
+    # the steady-state path
+    client.get(path, headers=headers, params={"limit": 200})
+    before = _queries(client, path)
+    response = client.get(path, headers=headers, params={"limit": 200})
+    assert response.status_code == 200, response.text
+    return _queries(client, path) - before
+
+
+@pytest.mark.parametrize("path", LIST_PATHS)
+def test_list_query_count_is_constant(client, admin_headers, make_user, path):
+    user_id, user_headers = make_user()
+    headers = admin_headers if path in ("/borrow/pending", "/borrow/all") else user_headers
+
+    _seed(user_id, 5)
+    small = _measure(client, headers, path)
+    _seed(user_id, 60)
+    large = _measure(client, headers, path)
+
+    assert small > 0
+    assert small == large, f"{path}: {small} statements for a small list, {large} for a large one"
@@ -0,0 +1,33 @@
+"""A job that outlasts its interval is not started by a second worker (user-016)."""
+import threading
+import time
+from utils.scheduler import Job, Scheduler
+
+INTERVAL = 0.4
+
+
+def test_lease_is_held_while_a_long_run_lasts():
+    release = threading.Event()
+
+    def slow(db, now):
+        release.wait(10)
+        return 1
+
+    first, second = Scheduler([Job("slow_job", INTERVAL, slow)]), Scheduler([Job("slow_job", INTERVAL, slow)])
+    holder = threading.Thread(target=first.run_once, args=("slow_job",))
+    holder.start()
+    time.sleep(0.1)
+    try:
+        # Several intervals pass while the first run is still going
+        deadline = time.monotonic() + 4 * INTERVAL
+        while time.monotonic() < deadline:
+            assert second.run_once("slow_job") is None
+            time.sleep(INTERVAL / 4)
+    finally:
+        release.set()
+        holder.join()
+
+    # The lease lasts one interval past the end of the run
+    assert second.run_once("slow_job") is None
+    time.sleep(INTERVAL * 1.5)
+    assert second.run_once("slow_job") == 1
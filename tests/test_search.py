@@ -0,0 +1,25 @@
+"""Typo-tolerant search results page like full-text ones (user-003)."""
+from database.database import SessionLocal
+from models.books import Book
+
+TITLES = [f"Zanzibarian Chronicles {i}" for i in range(5)]
+
+
+def test_fuzzy_results_page_through(client):
+    db = SessionLocal()
+    try:
+        db.add_all(Book(title=title, author="Author", total_copies=1, available_copies=1) for title in TITLES)
+        db.commit()
+    finally:
+        db.close()
+
+    # No term is a prefix of an indexed word, so only the trigram fallback matches
+    seen, offset = [], 0
+    while offset is not None:
+        response = client.get("/books/search", params={"query": "zanzibarin chronicls", "limit": 2, "offset": offset})
+        assert response.status_code == 200, response.text
+        page = response.json()
+        assert len(page["items"]) <= 2
+        seen += [book["title"] for book in page["items"]]
+        offset = page["next_cursor"]
+    assert sorted(seen) == TITLES
@@ -0,0 +1,45 @@
+"""Principal cache bookkeeping and cross-worker invalidation (user-004)."""
+from database.database import SessionLocal
+from utils import events
+from utils.user_cache import CachedUser, UserCache
+
+
+def _principal(user_id: int, name: str = "someone") -> CachedUser:
+    return CachedUser(id=user_id, username=name, email=None, full_name=name, is_admin=False)
+
+
+def test_invalidation_keeps_no_state_per_user():
+    cache = UserCache(max_size=10, ttl_seconds=60)
+    for user_id in range(10_000):
+        cache.invalidate(user_id)
+    # Nothing is kept for users that are not cached
+    assert all(len(value) == 0 for value in vars(cache).values() if hasattr(value, "__len__"))
+
+    # A load that started before an invalidation is not stored after it
+    generation = cache.generation()
+    cache.invalidate(1)
+    cache.put(_principal(1), generation)
+    assert cache.get(1) is None
+    cache.put(_principal(1), cache.generation())
+    assert cache.get(1) == _principal(1)
+
+
+def test_sync_drops_users_changed_by_another_worker(make_user):
+    user_id, _ = make_user()
+    other_id, _ = make_user()
+    cache = UserCache(max_size=10, ttl_seconds=60)
+    db = SessionLocal()
+    try:
+        cache.sync(db)
+        cache.put(_principal(user_id, "before"), cache.generation())
+        cache.put(_principal(other_id), cache.generation())
+
+        # Another worker renames the user: all this worker sees is the change feed
+        events.record(db, "user", [user_id])
+        db.commit()
+        cache.sync(db)
+    finally:
+        db.close()
+
+    assert cache.get(user_id) is None
+    assert cache.get(other_id) == _principal(other_id)
@@ -0,0 +1,52 @@
+"""Copies added by an edit or an import go to the waitlist first (user-017)."""
+import io
+
+
+def _book(client, admin_headers, **fields) -> int:
+    response = client.post("/books/", headers=admin_headers, json={
+        "title": "Waited For", "author": "Author", "total_copies": 1, "available_copies": 0, **fields,
+    })
+    assert response.status_code in (200, 201), response.text
+    return response.json()["id"]
+
+
+def _waitlisted(client, make_user, book_id: int, count: int) -> list[dict]:
+    queue = []
+    for _ in range(count):
+        _, headers = make_user()
+        response = client.post("/borrow/waitlist", headers=headers, json={"book_id": book_id})
+        assert response.status_code == 201, response.text
+        queue.append(headers)
+    return queue
+
+
+def _handed_over(client, headers: dict, book_id: int) -> bool:
+    position = client.get(f"/borrow/waitlist/{book_id}", headers=headers).json()
+    return position["position"] is None and position["borrow_id"] is not None
+
+
+def test_raising_available_copies_hands_them_to_the_waitlist(client, admin_headers, make_user):
+    book_id = _book(client, admin_headers)
+    first, second, third = _waitlisted(client, make_user, book_id, 3)
+
+    response = client.put(f"/books/{book_id}", headers=admin_headers, json={
+        "title": "Waited For", "author": "Author", "total_copies": 3, "available_copies": 2,
+    })
+    assert response.status_code == 200, response.text
+    assert response.json()["available_copies"] == 0
+    assert _handed_over(client, first, book_id) and _handed_over(client, second, book_id)
+    assert client.get(f"/borrow/waitlist/{book_id}", headers=third).json()["position"] == 1
+
+
+def test_import_raising_total_copies_hands_them_to_the_waitlist(client, admin_headers, make_user):
+    book_id = _book(client, admin_headers, isbn="9780000000017")
+    [waiting] = _waitlisted(client, make_user, book_id, 1)
+
+    feed = "isbn,title,author,total_copies\n9780000000017,Waited For,Author,2\n"
+    response = client.post("/books/import", headers=admin_headers,
+                           files={"file": ("feed.csv", io.BytesIO(feed.encode()), "text/csv")})
+    assert response.status_code == 200, response.text
+    assert response.json()["updated"] == 1
+
+    assert _handed_over(client, waiting, book_id)
+    assert client.get(f"/books/{book_id}").json()["available_copies"] == 0
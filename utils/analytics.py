@@ -0,0 +1,206 @@
+"""Usage statistics for the admin analytics endpoints (router/analytics.py).
+
+Borrow mutations call record() in their transaction, which appends one row
+per affected borrow to usage_events. The rollup_usage job folds those rows
+into the summary tables (book_usage, category_usage, user_usage,
+daily_usage) in batches and deletes them in the same transaction, so every
+event is counted once. Mutations never update a shared counter row, and
+readers only touch summary rows; the figures trail the ledger by at most
+USAGE_ROLLUP_INTERVAL_SECONDS.
+
+rebuild() recomputes the summary tables from the borrows table. The
+migration that adds them runs it once; run it again to repair drift after
+manual edits to borrows.
+
+Usage: python -m utils.analytics rebuild
+       python -m utils.analytics rollup
+"""
+import argparse
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from sqlalchemy import case, delete, func, insert, select, text, true
+from config import Settings
+from models.analytics import BookUsage, CategoryUsage, DailyUsage, UsageEvent, UserUsage
+from models.books import Book
+from models.borrow import Borrow
+from models.user import User
+from utils.scheduler import Job
+
+settings = Settings()
+
+# Event kinds and the daily_usage column each is counted in
+DAILY_COLUMNS = {"request": "requests", "approve": "approvals", "reject": "rejections", "return": "returns"}
+
+
+def record(db, kind: str, pairs):
+    """Queue (user_id, book_id) pairs as `kind` events in the caller's transaction."""
+    now = datetime.utcnow()
+    rows = [{"kind": kind, "user_id": user_id, "book_id": book_id, "created_at": now} for user_id, book_id in pairs]
+    if rows:
+        db.execute(insert(UsageEvent), rows)
+
+
+def _insert(dialect: str):
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def _add(db, dialect: str, model, totals: dict):
+    """Add {key: Counter} onto model's rows, creating the missing ones."""
+    if not totals:
+        return
+    table = model.__table__
+    key = table.primary_key.columns.values()[0].name
+    columns = [column.name for column in table.columns if column.name != key]
+    stmt = _insert(dialect)(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[key],
+        set_={column: table.c[column] + stmt.excluded[column] for column in columns},
+    )
+    # Key order, so writers lock rows in the same order
+    db.execute(stmt, [
+        {key: value, **{column: counts[column] for column in columns}}
+        for value, counts in sorted(totals.items())
+    ])
+
+
+def rollup(db, now, batch_size: int = settings.JOB_BATCH_SIZE) -> int:
+    """Fold queued usage events into the summary tables; returns how many were counted."""
+    dialect = db.get_bind().dialect.name
+    counted = 0
+    while True:
+        batch = select(UsageEvent.id).order_by(UsageEvent.id).limit(batch_size)
+        # Deleting first claims the rows: an event is counted by whoever deletes it
+        events = db.execute(
+            delete(UsageEvent)
+            .where(UsageEvent.id.in_(batch.scalar_subquery()))
+            .returning(UsageEvent.kind, UsageEvent.book_id, UsageEvent.user_id, UsageEvent.created_at)
+            .execution_options(synchronize_session=False)
+        ).all()
+        book_ids = {event.book_id for event in events}
+        user_ids = {event.user_id for event in events}
+        # Events of books and users deleted since are only counted per day
+        categories = dict(db.execute(select(Book.id, Book.category).where(Book.id.in_(book_ids))).all())
+        users = set(db.execute(select(User.id).where(User.id.in_(user_ids))).scalars())
+
+        daily, books, by_category, by_user = (defaultdict(Counter) for _ in range(4))
+        for event in events:
+            daily[event.created_at.date()][DAILY_COLUMNS[event.kind]] += 1
+            if event.kind in ("request", "approve") and event.book_id in categories:
+                column = "requests" if event.kind == "request" else "borrows"
+                books[event.book_id][column] += 1
+                by_category[categories[event.book_id] or ""][column] += 1
+            if event.user_id in users:
+                if event.kind == "approve":
+                    by_user[event.user_id]["active_borrows"] += 1
+                    by_user[event.user_id]["total_borrows"] += 1
+                elif event.kind == "return":
+                    by_user[event.user_id]["active_borrows"] -= 1
+        _add(db, dialect, DailyUsage, daily)
+        _add(db, dialect, BookUsage, books)
+        _add(db, dialect, CategoryUsage, by_category)
+        _add(db, dialect, UserUsage, by_user)
+        db.commit()
+        counted += len(events)
+        if len(events) < batch_size:
+            return counted
+
+
+def _as_date(value) -> date:
+    # SQLite's date() returns text
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+def rebuild(conn):
+    """Recompute every summary table from borrows on a Connection, in its transaction.
+
+    Rejections are counted on the request's day (the ledger does not keep
+    when a request was decided), and a waitlist hand-over counts as both a
+    request and an approval, as it does in record().
+    """
+    if conn.dialect.name == "postgresql":
+        # Holds off borrow writes until commit so the ledger and the events agree
+        conn.execute(text("LOCK TABLE borrows IN SHARE MODE"))
+    # On SQLite this first write takes the database write lock
+    conn.execute(delete(UsageEvent))
+    for model in (BookUsage, CategoryUsage, UserUsage, DailyUsage):
+        conn.execute(delete(model))
+
+    approved = Borrow.borrow_date.isnot(None)
+    active = (Borrow.status == "approved") & (Borrow.is_returned == False)
+    daily = defaultdict(Counter)
+    for column, day, condition in (
+        ("requests", Borrow.request_date, true()),
+        ("rejections", Borrow.request_date, Borrow.status == "rejected"),
+        ("approvals", Borrow.borrow_date, approved),
+        ("returns", Borrow.return_date, Borrow.is_returned & Borrow.return_date.isnot(None)),
+    ):
+        rows = conn.execute(
+            select(func.date(day), func.count()).where(condition, day.isnot(None)).group_by(func.date(day))
+        ).all()
+        for value, count in rows:
+            daily[_as_date(value)][column] += count
+
+    tables = [
+        (DailyUsage, [{"day": day, **{c: counts[c] for c in DAILY_COLUMNS.values()}} for day, counts in daily.items()]),
+        (BookUsage, [
+            {"book_id": book_id, "requests": requests, "borrows": borrows}
+            for book_id, requests, borrows in conn.execute(
+                select(Borrow.book_id, func.count(), func.count(Borrow.borrow_date))
+                .join(Book, Book.id == Borrow.book_id)
+                .group_by(Borrow.book_id)
+            )
+        ]),
+        (CategoryUsage, [
+            {"category": category, "requests": requests, "borrows": borrows}
+            for category, requests, borrows in conn.execute(
+                select(func.coalesce(Book.category, ""), func.count(), func.count(Borrow.borrow_date))
+                .join(Book, Book.id == Borrow.book_id)
+                .group_by(func.coalesce(Book.category, ""))
+            )
+        ]),
+        (UserUsage, [
+            {"user_id": user_id, "active_borrows": active_borrows, "total_borrows": total_borrows}
+            for user_id, active_borrows, total_borrows in conn.execute(
+                select(Borrow.user_id, func.count(case((active, 1))), func.count(Borrow.borrow_date))
+                .join(User, User.id == Borrow.user_id)
+                .where(approved)
+                .group_by(Borrow.user_id)
+            )
+        ]),
+    ]
+    for model, rows in tables:
+        if rows:
+            conn.execute(insert(model), rows)
+
+
+JOBS = [
+    Job("rollup_usage", settings.USAGE_ROLLUP_INTERVAL_SECONDS, rollup),
+]
+
+
+def main():
+    from database.database import SessionLocal, engine
+    from utils.log import setup_logging
+
+    parser = argparse.ArgumentParser(description="Usage statistics maintenance")
+    parser.add_argument("command", choices=["rebuild", "rollup"])
+    args = parser.parse_args()
+    setup_logging()
+    if args.command == "rebuild":
+        with engine.begin() as conn:
+            rebuild(conn)
+        print("Rebuilt usage statistics from borrows")
+        return
+    db = SessionLocal()
+    try:
+        print(f"Counted {rollup(db, datetime.utcnow())} usage events")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Static frontend assets, fingerprinted and precompressed once at startup.
+
+Every file under STATIC_DIR is read into memory with its gzip (and, when
+the optional `brotli` package is installed, brotli) encoding made at the
+highest level. CSS, JS and other non-HTML files are also served under a
+content-hashed name (style.3f2a9c01d4e5.css) marked immutable, and the
+HTML pages are rewritten to link those names; pages themselves keep their
+URLs and are revalidated with an ETag. Edits to the files take effect on
+restart.
+
+Usage: python -m utils.assets build --out DIR   (write the same files for a CDN or proxy)
+"""
+import argparse
+import hashlib
+import mimetypes
+import os
+import re
+from dataclasses import dataclass, field
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+from config import Settings
+from utils import compression
+
+settings = Settings()
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+HASH_LENGTH = 12
+
+
+@dataclass
+class Asset:
+    body: bytes
+    media_type: str
+    etag: str
+    cache_control: str
+    # encoding -> compressed body, only where it is smaller
+    encoded: dict = field(default_factory=dict)
+
+
+def _media_type(name: str) -> str:
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    if media_type.startswith("text/") or media_type == "application/javascript":
+        media_type += "; charset=utf-8"
+    return media_type
+
+
+def _hashed_name(name: str, digest: str) -> str:
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{digest[:HASH_LENGTH]}{ext}"
+
+
+def _asset(name: str, body: bytes, cache_control: str) -> Asset:
+    media_type = _media_type(name)
+    asset = Asset(body, media_type, f'"{hashlib.sha256(body).hexdigest()[:32]}"', cache_control)
+    if compression.compressible(media_type):
+        for encoding in compression.ENCODINGS:
+            data = compression.compress(body, encoding, static=True)
+            if len(data) < len(body):
+                asset.encoded[encoding] = data
+    return asset
+
+
+def build(directory: str) -> dict[str, Asset]:
+    """{url path under /static: Asset} for every file in directory."""
+    files = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                files[os.path.relpath(path, directory).replace(os.sep, "/")] = f.read()
+
+    assets = {}
+    links = {}
+    for name, body in files.items():
+        if name.endswith(".html"):
+            continue
+        hashed = _hashed_name(name, hashlib.sha256(body).hexdigest())
+        assets[hashed] = _asset(name, body, IMMUTABLE)
+        # The plain name keeps working for anything that links it directly
+        assets[name] = _asset(name, body, REVALIDATE)
+        links[name] = hashed
+    if links:
+        pattern = re.compile(r"""(["'])/static/(%s)\1""" % "|".join(re.escape(name) for name in links))
+    for name, body in files.items():
+        if not name.endswith(".html"):
+            continue
+        if links:
+            body = pattern.sub(lambda m: f"{m.group(1)}/static/{links[m.group(2)]}{m.group(1)}", body.decode()).encode()
+        assets[name] = _asset(name, body, REVALIDATE)
+    return assets
+
+
+def response(asset: Asset, request_headers: Headers) -> Response:
+    """The asset in the best encoding the client accepts, or 304 if it has it."""
+    headers = {"ETag": asset.etag, "Cache-Control": asset.cache_control}
+    if asset.encoded:
+        headers["Vary"] = "Accept-Encoding"
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match and asset.etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    encoding = compression.negotiate(request_headers.get("accept-encoding"), tuple(asset.encoded))
+    body = asset.body
+    if encoding is not None:
+        body = asset.encoded[encoding]
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type=asset.media_type, headers=headers)
+
+
+class StaticAssets:
+    """ASGI app for the /static mount, serving build() from memory."""
+
+    def __init__(self, directory: str = settings.STATIC_DIR):
+        self.assets = build(directory)
+
+    def get(self, name: str) -> Asset | None:
+        return self.assets.get(name)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        asset = self.assets.get(scope["path"].removeprefix(scope.get("root_path", "")).lstrip("/"))
+        if scope["method"] not in ("GET", "HEAD"):
+            result = Response("Method Not Allowed", status_code=405, headers={"Allow": "GET, HEAD"})
+        elif asset is None:
+            result = Response("Not Found", status_code=404)
+        else:
+            result = response(asset, Headers(scope=scope))
+        await result(scope, receive, send)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write fingerprinted, precompressed static assets")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build")
+    build_parser.add_argument("--out", required=True)
+    build_parser.add_argument("--source", default=settings.STATIC_DIR)
+    args = parser.parse_args()
+    written = 0
+    for name, asset in build(args.source).items():
+        path = os.path.join(args.out, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        outputs = {path: asset.body}
+        outputs.update({f"{path}.{'gz' if encoding == 'gzip' else encoding}": data for encoding, data in asset.encoded.items()})
+        for out_path, data in outputs.items():
+            with open(out_path, "wb") as f:
+                f.write(data)
+            written += 1
+    print(f"Wrote {written} files to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import base64
+import hashlib
+import os
+import tempfile
+from config import Settings
+
+# PDFs are stored once on disk under their sha256 digest; the books table only
+# keeps a "blob:<digest>" reference in file_path.
+BLOB_PREFIX = "blob:"
+CHUNK_SIZE = 1024 * 1024
+
+STORE_DIR = Settings().PDF_STORE_DIR
+
+
+def is_blob_ref(value: str | None) -> bool:
+    return bool(value) and value.startswith(BLOB_PREFIX)
+
+
+def digest_from_ref(ref: str) -> str:
+    return ref[len(BLOB_PREFIX):]
+
+
+def blob_path(digest: str) -> str:
+    # Fan out on the first two hex chars so no directory gets too large
+    return os.path.join(STORE_DIR, digest[:2], digest)
+
+
+def _commit_temp(tmp_path: str, digest: str) -> str:
+    path = blob_path(digest)
+    if os.path.exists(path):
+        # Same content already stored, keep the existing copy
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+    return BLOB_PREFIX + digest
+
+
+def store_stream(chunks) -> str:
+    """Write an iterable of byte chunks into the store and return its reference."""
+    os.makedirs(STORE_DIR, exist_ok=True)
+    hasher = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=STORE_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in chunks:
+                hasher.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return _commit_temp(tmp_path, hasher.hexdigest())
+
+
+def store_bytes(data: bytes) -> str:
+    return store_stream([data])
+
+
+def store_file(fileobj) -> str:
+    """Copy a readable binary file object into the store in fixed-size chunks."""
+    return store_stream(iter(lambda: fileobj.read(CHUNK_SIZE), b""))
+
+
+def decode_data_url(value: str) -> bytes:
+    try:
+        header, encoded = value.split(",", 1)
+    except ValueError:
+        raise ValueError("Malformed data URL")
+    if ";base64" not in header:
+        raise ValueError("Only base64 data URLs are supported")
+    return base64.b64decode(encoded)
+
+
+def ingest_file_path(value: str | None) -> str | None:
+    """Move an inline data: URL into the store; other values are kept as-is."""
+    if not value or not value.startswith("data:"):
+        return value
+    return store_bytes(decode_data_url(value))
@@ -0,0 +1,72 @@
+"""Periodic borrow ledger maintenance, run by utils.scheduler.
+
+Each job is a set-based UPDATE over at most JOB_BATCH_SIZE rows per
+transaction, repeated until nothing matches, so a large backlog never holds
+locks on the whole ledger at once.
+"""
+from datetime import timedelta
+from sqlalchemy import select, update
+from config import Settings
+from models.borrow import Borrow
+from utils import events, read_cache
+from utils.scheduler import Job
+
+settings = Settings()
+
+
+def _update_in_batches(db, conditions, values: dict, batch_size: int) -> int:
+    """Apply values to every borrow matching conditions, batch_size rows per commit."""
+    changed = 0
+    while True:
+        batch = select(Borrow.id).where(*conditions).order_by(Borrow.id).limit(batch_size)
+        # The conditions are repeated so rows changed since the SELECT are skipped
+        rows = db.execute(
+            update(Borrow)
+            .where(Borrow.id.in_(batch.scalar_subquery()), *conditions)
+            .values(**values)
+            .returning(Borrow.id, Borrow.book_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        events.record(db, "borrow", [row.id for row in rows])
+        db.commit()
+        if rows:
+            read_cache.invalidate_borrows(*(row.book_id for row in rows))
+        changed += len(rows)
+        if len(rows) < batch_size:
+            return changed
+
+
+def mark_overdue(db, now, batch_size: int = settings.JOB_BATCH_SIZE) -> int:
+    """Flag approved, unreturned borrows past their requested return date."""
+    return _update_in_batches(
+        db,
+        [
+            Borrow.status == "approved",
+            Borrow.is_returned == False,
+            Borrow.overdue_since.is_(None),
+            Borrow.requested_return_date < now,
+        ],
+        {"overdue_since": now},
+        batch_size,
+    )
+
+
+def expire_pending(db, now, batch_size: int = settings.JOB_BATCH_SIZE) -> int:
+    """Expire requests left pending longer than PENDING_REQUEST_MAX_AGE_HOURS.
+
+    Pending requests hold no copy, so only the status changes. An expired
+    request is no longer open, so the user may request the book again.
+    """
+    cutoff = now - timedelta(hours=settings.PENDING_REQUEST_MAX_AGE_HOURS)
+    return _update_in_batches(
+        db,
+        [Borrow.status == "pending", Borrow.request_date < cutoff],
+        {"status": "expired"},
+        batch_size,
+    )
+
+
+JOBS = [
+    Job("mark_overdue", settings.OVERDUE_CHECK_INTERVAL_SECONDS, mark_overdue),
+    Job("expire_pending", settings.PENDING_EXPIRY_INTERVAL_SECONDS, expire_pending),
+]
@@ -0,0 +1,209 @@
+"""Bulk-load books from a CSV or JSONL feed, upserting on ISBN.
+
+Usage: python -m utils.catalog_import FILE [--format csv|jsonl] [--batch-size N]
+
+Rows are validated with BookCreate as they are read and written in batches
+with one executemany per batch. Rows with an ISBN that already exists update
+that book, keeping its description, category, picture and PDF where the row
+leaves them empty; rows without an ISBN are always inserted. A bad row is
+reported and skipped without failing the rest of its batch.
+
+Covers given as data: URLs are stored and thumbnailed like those sent to
+POST /books/; remote picture URLs are fetched by `python -m utils.covers backfill`.
+"""
+import argparse
+import csv
+import json
+from pydantic import ValidationError
+from sqlalchemy import case, func, select
+from sqlalchemy.exc import DBAPIError
+from database.database import SessionLocal
+from models.books import Book
+from schema.book import BookCreate
+from utils import blob_store, covers, events, read_cache, waitlist
+
+BATCH_SIZE = 1000
+# The response stays small however broken the feed is
+MAX_REPORTED_ERRORS = 1000
+
+
+def read_records(stream, fmt: str):
+    """Yield (row number, dict or error string) from a text stream."""
+    if fmt == "csv":
+        for number, record in enumerate(csv.DictReader(stream), start=1):
+            # Empty cells fall back to the BookCreate defaults
+            yield number, {key: value for key, value in record.items() if key and value not in ("", None)}
+        return
+
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield number, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield number, "Expected a JSON object"
+            continue
+        yield number, record
+
+
+def _validate(record: dict) -> dict:
+    values = BookCreate(**record).model_dump()
+    values["file_path"] = blob_store.ingest_file_path(values["file_path"])
+    values["picture_url"], values["cover_digest"] = covers.ingest_picture_url(values["picture_url"])
+    return values
+
+
+def _format_error(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in error.errors())
+    return str(error).splitlines()[0]
+
+
+def _upsert_statement(dialect: str):
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    stmt = insert(Book)
+    new = stmt.excluded
+    # Keep outstanding loans when the feed changes total_copies
+    available = Book.available_copies + new.total_copies - Book.total_copies
+    # Optional fields a feed row leaves out keep the book's current values
+    picture_url = func.coalesce(new.picture_url, Book.picture_url)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Book.isbn],
+        set_={
+            "title": new.title,
+            "author": new.author,
+            "description": func.coalesce(new.description, Book.description),
+            "category": func.coalesce(new.category, Book.category),
+            "picture_url": picture_url,
+            # An unchanged remote picture keeps the cover already fetched for it
+            "cover_digest": case(
+                (Book.picture_url.is_not_distinct_from(picture_url), func.coalesce(new.cover_digest, Book.cover_digest)),
+                else_=new.cover_digest,
+            ),
+            "file_path": func.coalesce(new.file_path, Book.file_path),
+            "total_copies": new.total_copies,
+            "available_copies": case((available < 0, 0), else_=available),
+        },
+    )
+    return stmt.returning(Book.id)
+
+
+class CatalogImport:
+    def __init__(self, db, batch_size: int = BATCH_SIZE):
+        self.db = db
+        self.batch_size = batch_size
+        self.statement = _upsert_statement(db.get_bind().dialect.name)
+        self.rows = self.inserted = self.updated = self.failed = 0
+        self.errors = []
+        self._batch = []
+        self._batch_isbns = set()
+
+    def add(self, number: int, record):
+        self.rows += 1
+        if isinstance(record, str):
+            self._fail(number, None, record)
+            return
+        try:
+            values = _validate(record)
+        except (ValidationError, ValueError) as e:
+            self._fail(number, record.get("isbn"), _format_error(e))
+            return
+        # Two rows for one ISBN in the same statement would conflict with each
+        # other, so the second starts a new batch and updates the first
+        if values["isbn"] in self._batch_isbns:
+            self.flush()
+        self._batch.append((number, values))
+        if values["isbn"] is not None:
+            self._batch_isbns.add(values["isbn"])
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        batch, self._batch, self._batch_isbns = self._batch, [], set()
+        if not batch:
+            return
+        try:
+            self._write(batch)
+        except DBAPIError:
+            self.db.rollback()
+            # Retry one row per transaction to find the rows the database rejects
+            for number, values in batch:
+                try:
+                    self._write([(number, values)])
+                except DBAPIError as e:
+                    self.db.rollback()
+                    self._fail(number, values["isbn"], _format_error(e.orig))
+
+    def _write(self, batch):
+        isbns = [values["isbn"] for _, values in batch if values["isbn"] is not None]
+        existing = []
+        if isbns:
+            existing = self.db.execute(select(Book.id).where(Book.isbn.in_(isbns))).scalars().all()
+        ids = self.db.execute(self.statement, [values for _, values in batch]).scalars().all()
+        # A raised total_copies raises available_copies, and new books have no waitlist
+        filled = waitlist.fill(self.db, existing) if existing else []
+        events.record(self.db, "book", ids)
+        self.db.commit()
+        self.updated += len(existing)
+        self.inserted += len(batch) - len(existing)
+        read_cache.invalidate_book(*existing)
+        read_cache.invalidate_borrows(*filled)
+        for digest in {values["cover_digest"] for _, values in batch} - {None}:
+            covers.generate(digest)
+
+    def _fail(self, number: int, isbn, message: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": number, "isbn": isbn, "error": message})
+
+    def result(self) -> dict:
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "failed": self.failed,
+            "errors": self.errors,
+        }
+
+
+def import_books(stream, fmt: str, batch_size: int = BATCH_SIZE, session_factory=SessionLocal) -> dict:
+    """Import every record in stream; returns counts and the first errors."""
+    db = session_factory()
+    try:
+        job = CatalogImport(db, batch_size)
+        for number, record in read_records(stream, fmt):
+            job.add(number, record)
+        job.flush()
+        return job.result()
+    finally:
+        db.close()
+
+
+def guess_format(filename: str | None) -> str:
+    if filename and filename.lower().endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    return "csv"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file")
+    parser.add_argument("--format", choices=["csv", "jsonl"])
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    with open(args.file, encoding="utf-8-sig", newline="") as stream:
+        result = import_books(stream, args.format or guess_format(args.file), args.batch_size)
+    for error in result["errors"]:
+        print(f"Row {error['row']}: {error['error']}")
+    print(f"{result['rows']} rows: {result['inserted']} inserted, {result['updated']} updated, {result['failed']} failed")
+
+
+if __name__ == "__main__":
+    main()
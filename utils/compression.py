@@ -0,0 +1,118 @@
+"""Response compression negotiated from Accept-Encoding.
+
+CompressionMiddleware compresses compressible responses (JSON, text, JS,
+SVG) of at least COMPRESSION_MIN_BYTES with brotli when the client takes it
+and the optional `brotli` package is installed, else with gzip. Streaming
+responses are compressed chunk by chunk; server-sent events and responses
+that already carry a Content-Encoding (precompressed static assets) pass
+through untouched.
+"""
+import gzip
+import zlib
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import IdentityResponder
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from config import Settings
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+settings = Settings()
+
+COMPRESSIBLE_TYPES = ("application/json", "application/javascript", "application/x-ndjson", "image/svg+xml")
+# Preferred first when the client weighs them equally
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def compressible(content_type: str) -> bool:
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type == "text/event-stream":
+        # Each event must reach the client as soon as it is sent
+        return False
+    return media_type.startswith("text/") or media_type in COMPRESSIBLE_TYPES
+
+
+def negotiate(accept_encoding: str | None, available=ENCODINGS) -> str | None:
+    """The encoding from `available` the client accepts with the highest q-value, or None."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                continue
+        weights[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(data: bytes, encoding: str, static: bool = False) -> bytes:
+    """Whole-body compression; `static` spends the most effort, for assets compressed once."""
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if static else settings.BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=9 if static else settings.GZIP_LEVEL, mtime=0)
+
+
+class _Responder(IdentityResponder):
+    async def send_with_compression(self, message: Message) -> None:
+        await super().send_with_compression(message)
+        if message["type"] == "http.response.start":
+            # Starlette only skips event streams; skip everything already compact too
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            self.content_type_is_excluded = not compressible(content_type)
+
+
+class _GZipResponder(_Responder):
+    content_encoding = "gzip"
+
+    def __init__(self, app: ASGIApp, minimum_size: int) -> None:
+        super().__init__(app, minimum_size)
+        # wbits 31: a gzip container around raw deflate
+        self.compressor = zlib.compressobj(settings.GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        data = self.compressor.compress(body)
+        # Flush every chunk so streamed exports reach the client as they are produced
+        return data + self.compressor.flush(zlib.Z_SYNC_FLUSH if more_body else zlib.Z_FINISH)
+
+
+class _BrotliResponder(_Responder):
+    content_encoding = "br"
+
+    def __init__(self, app: ASGIApp, minimum_size: int) -> None:
+        super().__init__(app, minimum_size)
+        self.compressor = brotli.Compressor(quality=settings.BROTLI_QUALITY)
+
+    def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        data = self.compressor.process(body)
+        return data + (self.compressor.flush() if more_body else self.compressor.finish())
+
+
+RESPONDERS = {"gzip": _GZipResponder, "br": _BrotliResponder}
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = settings.COMPRESSION_MIN_BYTES) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await RESPONDERS[encoding](self.app, self.minimum_size)(scope, receive, send)
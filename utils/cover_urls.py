@@ -0,0 +1,6 @@
+"""Cover thumbnail URLs, kept apart from utils.covers so schemas can build
+them without importing Pillow or the database."""
+
+
+def cover_url(digest: str, size: str = "sm") -> str:
+    return f"/covers/{digest}/{size}.jpg"
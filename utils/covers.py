@@ -0,0 +1,422 @@
+"""Book covers: ingested once, served as fixed-size thumbnails.
+
+A cover image is stored once under COVER_STORE_DIR/sources by its sha256, and
+books.cover_digest points at it. Thumbnails, one per SIZES entry, are made
+from the source by a small worker pool and written to COVER_STORE_DIR/thumbs.
+A thumbnail URL names its source digest and size, so its content never
+changes and /covers serves it as immutable. The thumbs directory is only a
+cache: it is trimmed least recently used first (file mtime is the clock) to
+COVER_CACHE_MAX_BYTES, and an evicted thumbnail is rebuilt on its next request.
+
+Usage: python -m utils.covers backfill [--batch-size N]   (ingest existing picture_urls)
+       python -m utils.covers trim
+"""
+import argparse
+import asyncio
+import hashlib
+import http.client
+import io
+import ipaddress
+import logging
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from PIL import Image, ImageOps
+from sqlalchemy import literal, update
+from starlette.concurrency import run_in_threadpool
+from config import Settings
+from database.database import SessionLocal
+from models.books import Book
+from utils import blob_store, events, read_cache
+from utils.cover_urls import cover_url
+
+logger = logging.getLogger(__name__)
+settings = Settings()
+
+STORE_DIR = settings.COVER_STORE_DIR
+SOURCE_DIR = os.path.join(STORE_DIR, "sources")
+THUMB_DIR = os.path.join(STORE_DIR, "thumbs")
+MAX_CACHE_BYTES = settings.COVER_CACHE_MAX_BYTES
+MAX_SOURCE_BYTES = settings.COVER_MAX_SOURCE_BYTES
+
+# Bounding boxes; the aspect ratio is kept. Renaming a size changes its URLs,
+# which is required whenever its box or encoding changes (they are cached forever).
+SIZES = {"sm": (200, 300), "lg": (600, 900)}
+JPEG_QUALITY = 82
+# Hits only refresh a thumbnail's mtime this often, so reads rarely become writes
+TOUCH_INTERVAL = 3600
+
+URL_PATTERN = re.compile(r"^/covers/([0-9a-f]{64})/\w+\.jpg$")
+
+WORKERS = settings.COVER_WORKERS or min(4, os.cpu_count() or 1)
+
+# Pillow releases the GIL while decoding and resampling
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="cover")
+_lock = threading.RLock()
+_trim_lock = threading.Lock()
+_inflight = {}
+# This process's estimate of the thumbs directory size; None until first scanned
+_cache_bytes = None
+
+
+def source_path(digest: str) -> str:
+    return os.path.join(SOURCE_DIR, digest[:2], digest)
+
+
+def thumb_path(digest: str, size: str) -> str:
+    return os.path.join(THUMB_DIR, digest[:2], f"{digest}-{size}.jpg")
+
+
+def cover_url_column(size: str = "sm"):
+    """cover_url() as a SQL expression; NULL for books without a cover."""
+    return (literal("/covers/") + Book.cover_digest + literal(f"/{size}.jpg")).label("cover_url")
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def store_source(data: bytes) -> str:
+    """Check that data is an image Pillow can read and store it; returns its digest."""
+    if len(data) > MAX_SOURCE_BYTES:
+        raise ValueError(f"Cover image is larger than {MAX_SOURCE_BYTES} bytes")
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.verify()
+    except Image.DecompressionBombError:
+        raise ValueError("Cover image has too many pixels")
+    except (OSError, SyntaxError):
+        raise ValueError("Not a supported image")
+    digest = hashlib.sha256(data).hexdigest()
+    if not os.path.exists(source_path(digest)):
+        _write_atomic(source_path(digest), data)
+    return digest
+
+
+def _public_address(host: str, port: int) -> str:
+    """An address of host to connect to; ValueError if any of its addresses is
+    private, loopback, link-local or otherwise not publicly routable."""
+    infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not settings.COVER_FETCH_ALLOW_PRIVATE and (not address.is_global or address.is_multicast):
+            raise ValueError(f"Cover host {host} resolves to a non-public address")
+    return infos[0][4][0]
+
+
+# Picture URLs come from admins and catalog feeds, so fetching one must not
+# reach internal services. The check runs when each connection is opened,
+# redirects included, on the very address connected to, so DNS answering
+# differently the second time does not get around it.
+class _PublicHTTPConnection(http.client.HTTPConnection):
+    def connect(self):
+        self.sock = socket.create_connection((_public_address(self.host, self.port), self.port), self.timeout)
+
+
+class _PublicHTTPSConnection(http.client.HTTPSConnection):
+    def connect(self):
+        sock = socket.create_connection((_public_address(self.host, self.port), self.port), self.timeout)
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_PublicHTTPConnection, req)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_PublicHTTPSConnection, req, context=self._context)
+
+
+def _opener() -> urllib.request.OpenerDirector:
+    # Only http(s), no proxies from the environment; a redirect to any other
+    # scheme fails in UnknownHandler
+    opener = urllib.request.OpenerDirector()
+    for handler in (
+        _PublicHTTPHandler(),
+        _PublicHTTPSHandler(),
+        urllib.request.HTTPRedirectHandler(),
+        urllib.request.HTTPDefaultErrorHandler(),
+        urllib.request.HTTPErrorProcessor(),
+        urllib.request.UnknownHandler(),
+    ):
+        opener.add_handler(handler)
+    return opener
+
+
+def fetch(url: str) -> bytes:
+    if urlsplit(url).scheme not in ("http", "https"):
+        raise ValueError("Only http(s) cover URLs can be fetched")
+    request = urllib.request.Request(url, headers={"User-Agent": "library-system-covers"})
+    with _opener().open(request, timeout=settings.COVER_FETCH_TIMEOUT) as response:
+        data = response.read(MAX_SOURCE_BYTES + 1)
+    if len(data) > MAX_SOURCE_BYTES:
+        raise ValueError(f"Cover image is larger than {MAX_SOURCE_BYTES} bytes")
+    return data
+
+
+def ingest_picture_url(value: str | None) -> tuple[str | None, str | None]:
+    """(picture_url, cover_digest) to store for a submitted picture_url.
+
+    data: URLs are stored right away and replaced by the large thumbnail's
+    URL. URLs of covers already stored keep their digest. Any other URL is
+    kept as given; its digest is filled in once ingest_remote has fetched it.
+    """
+    if not value:
+        return None, None
+    if value.startswith("data:"):
+        digest = store_source(blob_store.decode_data_url(value))
+        return cover_url(digest, "lg"), digest
+    match = URL_PATTERN.match(value)
+    if match and os.path.exists(source_path(match.group(1))):
+        return value, match.group(1)
+    return value, None
+
+
+def _render(digest: str, size: str) -> bytes:
+    """A thumbnail's JPEG bytes, encoded and cached unless already cached."""
+    path = thumb_path(digest, size)
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    box = SIZES[size]
+    with Image.open(source_path(digest)) as image:
+        # Lets JPEG decode straight at a fraction of full size
+        image.draft("RGB", box)
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(box, Image.Resampling.LANCZOS)
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            flat = Image.new("RGB", image.size, "white")
+            flat.paste(image, mask=image.getchannel("A"))
+            image = flat
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        image.save(out, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    data = out.getvalue()
+    _write_atomic(path, data)
+    _account(len(data))
+    return data
+
+
+def _forget(key):
+    with _lock:
+        _inflight.pop(key, None)
+
+
+def submit(digest: str, size: str):
+    """Render one thumbnail in the pool; concurrent requests for it share a future."""
+    key = (digest, size)
+    with _lock:
+        future = _inflight.get(key)
+        if future is None:
+            future = _executor.submit(_render, digest, size)
+            _inflight[key] = future
+            future.add_done_callback(lambda _: _forget(key))
+    return future
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("cover thumbnail failed", exc_info=future.exception())
+
+
+def generate(digest: str):
+    """Queue every thumbnail size of a freshly ingested cover without waiting."""
+    for size in SIZES:
+        submit(digest, size).add_done_callback(_log_failure)
+
+
+def _read_cached(path: str) -> bytes:
+    # Once open, the file can be trimmed without affecting what is read
+    with open(path, "rb") as f:
+        if time.time() - os.fstat(f.fileno()).st_mtime > TOUCH_INTERVAL:
+            _touch(path)
+        return f.read()
+
+
+async def thumbnail(digest: str, size: str) -> bytes:
+    """A thumbnail's JPEG bytes, rendering it first if it is not cached.
+    Raises FileNotFoundError when there is no such source."""
+    try:
+        return await run_in_threadpool(_read_cached, thumb_path(digest, size))
+    except FileNotFoundError:
+        return await asyncio.wrap_future(submit(digest, size))
+
+
+def _touch(path: str):
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+def _account(size: int):
+    global _cache_bytes
+    with _lock:
+        if _cache_bytes is not None:
+            _cache_bytes += size
+        over = _cache_bytes is None or _cache_bytes > MAX_CACHE_BYTES
+    if over:
+        trim()
+
+
+def trim(max_bytes: int = MAX_CACHE_BYTES) -> int:
+    """Delete least recently used thumbnails until the cache is under 90% of
+    max_bytes; returns the number removed (0 if another thread is trimming)."""
+    global _cache_bytes
+    if not _trim_lock.acquire(blocking=False):
+        return 0
+    try:
+        entries = []
+        for root, _, files in os.walk(THUMB_DIR):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        if total > max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+        with _lock:
+            _cache_bytes = total
+        if removed:
+            logger.info("cover cache trimmed", extra={"removed": removed, "bytes": total})
+        return removed
+    finally:
+        _trim_lock.release()
+
+
+def _set_digest(book_id: int, url: str, digest: str) -> bool:
+    db = SessionLocal()
+    try:
+        # Skipped if the picture was changed again while this one was fetched
+        ids = db.execute(
+            update(Book)
+            .where(Book.id == book_id, Book.picture_url == url)
+            .values(cover_digest=digest)
+            .returning(Book.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        events.record(db, "book", ids)
+        db.commit()
+    finally:
+        db.close()
+    if ids:
+        read_cache.invalidate_book(book_id)
+    return bool(ids)
+
+
+def ingest_remote(book_id: int, url: str) -> str:
+    """Fetch a book's picture_url, store it as its cover and render the thumbnails."""
+    digest = store_source(fetch(url))
+    if _set_digest(book_id, url, digest):
+        for size in SIZES:
+            _render(digest, size)
+    return digest
+
+
+def _ingest_remote_logged(book_id: int, url: str):
+    try:
+        ingest_remote(book_id, url)
+    except Exception:
+        logger.warning("cover fetch failed", exc_info=True, extra={"book_id": book_id})
+
+
+def schedule_remote(book_id: int, url: str):
+    """Fetch a remote cover in the pool; the book shows no thumbnail until it is done."""
+    _executor.submit(_ingest_remote_logged, book_id, url)
+
+
+def backfill(batch_size: int = 100) -> tuple[int, int]:
+    """Ingest every picture_url that has no cover yet, in id order; returns (ingested, failed)."""
+    ingested = failed = 0
+    last_id = 0
+    db = SessionLocal()
+    try:
+        while True:
+            rows = (
+                db.query(Book.id, Book.picture_url)
+                .filter(Book.id > last_id, Book.picture_url.isnot(None), Book.cover_digest.is_(None))
+                .order_by(Book.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            for row in rows:
+                try:
+                    url, digest = ingest_picture_url(row.picture_url)
+                    if digest is None:
+                        url, digest = row.picture_url, store_source(fetch(row.picture_url))
+                    for size in SIZES:
+                        _render(digest, size)
+                except (OSError, ValueError) as e:
+                    print(f"Skipping book {row.id}: {e}")
+                    failed += 1
+                    continue
+                db.execute(
+                    update(Book)
+                    .where(Book.id == row.id, Book.picture_url == row.picture_url)
+                    .values(picture_url=url, cover_digest=digest)
+                )
+                events.record(db, "book", [row.id])
+                ingested += 1
+            db.commit()
+            read_cache.invalidate_book(*(row.id for row in rows))
+            last_id = rows[-1].id
+    finally:
+        db.close()
+    return ingested, failed
+
+
+def main():
+    from models import borrow, user  # noqa: F401
+    from utils.log import setup_logging
+
+    parser = argparse.ArgumentParser(description="Cover image maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = commands.add_parser("backfill", help="ingest picture_urls that have no cover yet")
+    backfill_parser.add_argument("--batch-size", type=int, default=100)
+    commands.add_parser("trim", help=f"trim the thumbnail cache to {MAX_CACHE_BYTES} bytes")
+    args = parser.parse_args()
+    setup_logging()
+    if args.command == "backfill":
+        ingested, failed = backfill(args.batch_size)
+        print(f"Ingested {ingested} covers into {STORE_DIR}, {failed} failed")
+    else:
+        print(f"Removed {trim()} thumbnails")
+
+
+if __name__ == "__main__":
+    main()
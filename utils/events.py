@@ -0,0 +1,161 @@
+"""Change feed behind the admin dashboard's live updates.
+
+Mutations call record() inside their transaction. At commit the recorded
+ids are logged under the next version from change_counter, so a reader
+can ask for everything after the version it last saw (router/events.py).
+After such a commit the in-process bus wakes this worker's open streams at
+once; streams also poll, which is how changes made by other workers arrive.
+"""
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import delete, event, func, insert, select, update
+from sqlalchemy.orm import Session
+from config import Settings
+from models.change import ChangeCounter, ChangeLog
+from utils.scheduler import Job
+
+settings = Settings()
+
+ENTITIES = ("borrow", "book", "user")
+
+
+def record(db, entity: str, ids, action: str = "upsert"):
+    """Log changed ids with the caller's transaction, from anywhere inside it.
+
+    Nothing is written here: the ids are queued on the session and
+    _write_changes() takes one version for all of them as the transaction
+    commits, so the change_counter row lock is held only for the commit
+    itself rather than for the rest of the handler.
+    """
+    ids = set(ids)
+    if ids:
+        db.info.setdefault("pending_changes", []).append((entity, ids, action))
+
+
+@event.listens_for(Session, "before_commit")
+def _write_changes(session):
+    pending = session.info.pop("pending_changes", None)
+    if not pending:
+        return
+    version = session.execute(
+        update(ChangeCounter)
+        .where(ChangeCounter.id == 1)
+        .values(version=ChangeCounter.version + 1)
+        .returning(ChangeCounter.version)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    # Later calls win for an id recorded twice (an upsert then a delete)
+    latest = {}
+    for entity, ids, action in pending:
+        for entity_id in ids:
+            latest[(entity, entity_id)] = action
+    now = datetime.utcnow()
+    session.execute(insert(ChangeLog), [
+        {"version": version, "entity": entity, "entity_id": entity_id, "action": action, "created_at": now}
+        for (entity, entity_id), action in sorted(latest.items())
+    ])
+    session.info["change_version"] = version
+
+
+class ChangeBus:
+    """Wakes the streams waiting in this process; safe to notify from any thread."""
+
+    def __init__(self):
+        self._waiters = set()
+        self._lock = threading.Lock()
+        # Set at shutdown; streams end so the worker can drain
+        self.closed = False
+
+    def subscribe(self) -> asyncio.Event:
+        waiter = asyncio.Event()
+        with self._lock:
+            self._waiters.add((asyncio.get_running_loop(), waiter))
+        return waiter
+
+    def unsubscribe(self, waiter: asyncio.Event):
+        with self._lock:
+            self._waiters = {(loop, w) for loop, w in self._waiters if w is not waiter}
+
+    def notify(self):
+        with self._lock:
+            waiters = list(self._waiters)
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(waiter.set)
+            except RuntimeError:
+                # Loop already closed (shutdown)
+                pass
+
+    def close(self):
+        """Wake every stream for the last time; they see `closed` and end."""
+        self.closed = True
+        self.notify()
+
+
+bus = ChangeBus()
+
+
+class VersionClock:
+    """This worker's view of change_counter.version, the validator behind list ETags.
+
+    Its own commits advance it at once; other workers' commits are seen when
+    current() re-reads the counter, at most every max_lag seconds, so a list
+    can be answered 304 without a query in between.
+    """
+
+    def __init__(self, max_lag: float):
+        self.max_lag = max_lag
+        self._version = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, version: int):
+        with self._lock:
+            # Versions commit in order, so a newer one covers every older one
+            self._version = max(version, self._version or 0)
+
+    def current(self, db) -> int:
+        now = time.monotonic()
+        if self._version is None or now - self._checked >= self.max_lag:
+            version = db.execute(select(ChangeCounter.version).where(ChangeCounter.id == 1)).scalar() or 0
+            self._checked = now
+            self.observe(version)
+        return self._version
+
+
+clock = VersionClock(settings.LIST_ETAG_MAX_LAG_SECONDS)
+
+
+@event.listens_for(Session, "after_commit")
+def _notify_after_commit(session):
+    version = session.info.pop("change_version", None)
+    if version is not None:
+        clock.observe(version)
+        bus.notify()
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _forget_after_rollback(session, transaction):
+    # Changes recorded in a transaction that rolled back (or was closed) never happened
+    if transaction.parent is None:
+        session.info.pop("pending_changes", None)
+        session.info.pop("change_version", None)
+
+
+def prune_change_log(db, now) -> int:
+    """Drop log rows older than CHANGE_LOG_RETENTION_HOURS; clients further behind get a reset."""
+    cutoff = now - timedelta(hours=settings.CHANGE_LOG_RETENTION_HOURS)
+    through = db.execute(select(func.max(ChangeLog.version)).where(ChangeLog.created_at < cutoff)).scalar()
+    if through is None:
+        return 0
+    deleted = db.execute(delete(ChangeLog).where(ChangeLog.version <= through)).rowcount
+    db.execute(update(ChangeCounter).where(ChangeCounter.id == 1).values(pruned_through=through))
+    db.commit()
+    return deleted
+
+
+JOBS = [
+    Job("prune_change_log", 3600, prune_change_log),
+]
@@ -0,0 +1,178 @@
+"""Stream the borrow ledger or the catalog as NDJSON or CSV.
+
+Rows are read through a server-side cursor in batches, so memory use stays
+flat however large the table is. Used by the admin export endpoints and as
+a CLI for batch jobs:
+
+    python -m utils.export borrows --format csv --status returned \
+        --date-from 2024-01-01 --out borrows.csv.gz
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+from datetime import datetime
+from sqlalchemy import select
+from database.database import SessionLocal
+from models.books import Book
+from models.borrow import Borrow
+from models.user import User
+from utils.covers import cover_url_column
+
+BATCH_SIZE = 1000
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# Flat columns only. file_path is reduced to has_pdf and picture_url to
+# has_cover plus the thumbnail's cover_url, because either can hold a whole
+# base64 file
+BORROW_COLUMNS = (
+    Borrow.id,
+    Borrow.request_date,
+    Borrow.requested_borrow_date,
+    Borrow.requested_return_date,
+    Borrow.borrow_date,
+    Borrow.return_date,
+    Borrow.status,
+    Borrow.is_returned,
+    Borrow.overdue_since,
+    Borrow.book_id,
+    Book.title.label("book_title"),
+    Book.author.label("book_author"),
+    Borrow.user_id,
+    User.username.label("user_username"),
+    User.email.label("user_email"),
+)
+
+BOOK_COLUMNS = (
+    Book.id,
+    Book.isbn,
+    Book.title,
+    Book.author,
+    Book.category,
+    Book.description,
+    (Book.picture_url.isnot(None)).label("has_cover"),
+    cover_url_column("lg"),
+    (Book.file_path.isnot(None)).label("has_pdf"),
+    Book.total_copies,
+    Book.available_copies,
+)
+
+
+def borrows_query(status=None, date_from=None, date_to=None):
+    """Date filters apply to request_date, as in the /borrow listings."""
+    query = (
+        select(*BORROW_COLUMNS)
+        .join(Book, Book.id == Borrow.book_id)
+        .outerjoin(User, User.id == Borrow.user_id)
+    )
+    if status:
+        query = query.where(Borrow.status == status)
+    if date_from:
+        query = query.where(Borrow.request_date >= date_from)
+    if date_to:
+        query = query.where(Borrow.request_date < date_to)
+    return query.order_by(Borrow.id)
+
+
+def books_query(category=None, author=None):
+    query = select(*BOOK_COLUMNS)
+    if category:
+        query = query.where(Book.category == category)
+    if author:
+        query = query.where(Book.author == author)
+    return query.order_by(Book.id)
+
+
+def iter_rows(query, batch_size: int = BATCH_SIZE):
+    """Yield lists of row mappings from a streamed cursor on a private session.
+
+    The session is opened lazily and closed when the generator finishes or is
+    closed, so a client disconnecting mid-export releases the connection.
+    """
+    db = SessionLocal()
+    try:
+        result = db.execute(query.execution_options(stream_results=True, yield_per=batch_size))
+        for partition in result.mappings().partitions():
+            yield partition
+    finally:
+        db.close()
+
+
+def _value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def encode(batches, fmt: str, columns):
+    """Turn batches of rows into one bytes chunk per batch."""
+    names = [column.key for column in columns]
+    if fmt == "ndjson":
+        for batch in batches:
+            yield "".join(
+                json.dumps({name: _value(row[name]) for name in names}, separators=(",", ":")) + "\n"
+                for row in batch
+            ).encode()
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for batch in batches:
+        for row in batch:
+            writer.writerow([_value(row[name]) for name in names])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, for an empty export
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def export_borrows(fmt: str, **filters):
+    return encode(iter_rows(borrows_query(**filters)), fmt, BORROW_COLUMNS)
+
+
+def export_books(fmt: str, **filters):
+    return encode(iter_rows(books_query(**filters)), fmt, BOOK_COLUMNS)
+
+
+def write_file(chunks, path: str, compress: bool) -> int:
+    """Write chunks to path, gzip-compressed if asked. Returns bytes written before compression."""
+    written = 0
+    opener = gzip.open if compress else open
+    with opener(path, "wb") as out:
+        for chunk in chunks:
+            out.write(chunk)
+            written += len(chunk)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("table", choices=["borrows", "books"])
+    parser.add_argument("--format", choices=list(FORMATS), default="ndjson")
+    parser.add_argument("--out", required=True, help="output file; compressed when it ends in .gz")
+    parser.add_argument("--gzip", action="store_true", help="compress regardless of the file name")
+    parser.add_argument("--status")
+    parser.add_argument("--date-from", type=datetime.fromisoformat)
+    parser.add_argument("--date-to", type=datetime.fromisoformat)
+    parser.add_argument("--category")
+    parser.add_argument("--author")
+    args = parser.parse_args()
+
+    if args.table == "borrows":
+        chunks = export_borrows(args.format, status=args.status, date_from=args.date_from, date_to=args.date_to)
+    else:
+        chunks = export_books(args.format, category=args.category, author=args.author)
+    written = write_file(chunks, args.out, args.gzip or args.out.endswith(".gz"))
+    print(f"Wrote {written} bytes of {args.table} to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
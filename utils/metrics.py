@@ -0,0 +1,166 @@
+import contextvars
+import threading
+import time
+from sqlalchemy import event
+
+# Small in-process Prometheus registry. Each worker process exposes its own
+# numbers on /metrics; sum them on the Prometheus side.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                labels = ",".join(f'{k}="{v}"' for k, v in zip(self.labels, label_values))
+                prefix = labels + "," if labels else ""
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+                suffix = f"{{{labels}}}" if labels else ""
+                lines.append(f"{self.name}_sum{suffix} {total}")
+                lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                labels = ",".join(f'{k}="{v}"' for k, v in zip(self.labels, label_values))
+                suffix = f"{{{labels}}}" if labels else ""
+                lines.append(f"{self.name}{suffix} {value}")
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by route template.",
+    LATENCY_BUCKETS, ("method", "route", "status"),
+)
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements executed per request.",
+    COUNT_BUCKETS, ("method", "route"),
+)
+REQUEST_DB_TIME = Histogram(
+    "http_request_db_seconds", "Time spent in SQL statements per request.",
+    LATENCY_BUCKETS, ("method", "route"),
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection.",
+    LATENCY_BUCKETS,
+)
+
+JOB_DURATION = Histogram(
+    "scheduler_job_duration_seconds", "Background job run time.",
+    LATENCY_BUCKETS + (30.0, 60.0, 300.0), ("job",),
+)
+JOB_ROWS = Counter("scheduler_job_rows_total", "Rows changed by background jobs.", ("job",))
+JOB_RUNS = Counter("scheduler_job_runs_total", "Background job runs by outcome.", ("job", "outcome"))
+RATE_LIMITED = Counter("rate_limited_total", "Requests refused by a rate limit.", ("limit",))
+
+REGISTRY = [
+    REQUEST_LATENCY, REQUEST_DB_QUERIES, REQUEST_DB_TIME, POOL_CHECKOUT_WAIT,
+    JOB_DURATION, JOB_ROWS, JOB_RUNS, RATE_LIMITED,
+]
+
+# Other modules register callables returning (name, help, type, value) samples
+COLLECTORS = []
+
+# Per-request [query count, query seconds]. The list is shared by reference, so
+# statements run from the threadpool or run_sync still add to it.
+_db_stats = contextvars.ContextVar("db_stats", default=None)
+
+
+def instrument_engine(engine):
+    """Count statements and their time against the current request."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        stats = _db_stats.get()
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += time.perf_counter() - context._query_start
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and DB work per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = [0, 0.0]
+        token = _db_stats.set(stats)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _db_stats.reset(token)
+            # The router stores the matched route in the scope; using its
+            # template keeps label cardinality bounded
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            method = scope["method"]
+            REQUEST_LATENCY.observe(elapsed, method, path, status[0])
+            REQUEST_DB_QUERIES.observe(stats[0], method, path)
+            REQUEST_DB_TIME.observe(stats[1], method, path)
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    for collector in COLLECTORS:
+        for name, help, kind, value in collector():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
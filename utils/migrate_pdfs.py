@@ -0,0 +1,51 @@
+"""Move inline base64 PDFs out of books.file_path into the blob store.
+
+Usage: python -m utils.migrate_pdfs [--batch-size N]
+"""
+import argparse
+from database.database import SessionLocal
+from models.books import Book
+from utils import blob_store
+
+
+def migrate(batch_size: int = 100) -> int:
+    """Convert every data: row in id order, committing once per batch."""
+    migrated = 0
+    last_id = 0
+    db = SessionLocal()
+    try:
+        while True:
+            # Only ids are selected first so the payloads are loaded one batch at a time
+            ids = [
+                row.id
+                for row in db.query(Book.id)
+                .filter(Book.id > last_id, Book.file_path.like("data:%"))
+                .order_by(Book.id)
+                .limit(batch_size)
+            ]
+            if not ids:
+                break
+            for book in db.query(Book).filter(Book.id.in_(ids)):
+                try:
+                    book.file_path = blob_store.ingest_file_path(book.file_path)
+                    migrated += 1
+                except ValueError as e:
+                    print(f"Skipping book {book.id}: {e}")
+            db.commit()
+            db.expunge_all()
+            last_id = ids[-1]
+    finally:
+        db.close()
+    return migrated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+    count = migrate(args.batch_size)
+    print(f"Migrated {count} PDFs into {blob_store.STORE_DIR}")
+
+
+if __name__ == "__main__":
+    main()
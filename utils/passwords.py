@@ -0,0 +1,74 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+from passlib.context import CryptContext
+from config import Settings
+
+settings = Settings()
+
+ROUNDS = settings.PASSWORD_HASH_ROUNDS
+
+# Hashes made with any other round count are flagged by verify_and_update and
+# replaced on the user's next successful login
+pwd = CryptContext(
+    schemes=["pbkdf2_sha256"],
+    deprecated="auto",
+    pbkdf2_sha256__default_rounds=ROUNDS,
+    pbkdf2_sha256__min_desired_rounds=ROUNDS,
+    pbkdf2_sha256__max_desired_rounds=ROUNDS,
+)
+
+WORKERS = settings.PASSWORD_HASH_WORKERS or os.cpu_count() or 1
+
+# hashlib's pbkdf2 releases the GIL, so threads give real parallelism here
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="password-hash")
+
+
+class HashLimiter:
+    """Bounds the number of password hashes in flight.
+
+    Up to max_concurrent run at once and up to max_waiting wait for a slot.
+    Anyone beyond that, or waiting longer than timeout, gets a 429 rather than
+    an ever-growing queue.
+    """
+
+    def __init__(self, max_concurrent: int, max_waiting: int, timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def __aenter__(self):
+        if self._semaphore.locked() and self.waiting >= self.max_waiting:
+            raise HTTPException(429, "Too many login attempts in progress, try again shortly", headers={"Retry-After": "1"})
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(429, "Too many login attempts in progress, try again shortly", headers={"Retry-After": "1"})
+        finally:
+            self.waiting -= 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self._semaphore.release()
+
+
+limiter = HashLimiter(
+    max_concurrent=settings.PASSWORD_MAX_CONCURRENT or WORKERS,
+    max_waiting=settings.PASSWORD_MAX_WAITING,
+    timeout=settings.PASSWORD_WAIT_TIMEOUT,
+)
+
+
+async def hash_password(password: str) -> str:
+    async with limiter:
+        return await asyncio.get_running_loop().run_in_executor(_executor, pwd.hash, password)
+
+
+async def verify_password(password: str, hashed: str) -> tuple[bool, str | None]:
+    """Returns (valid, new_hash); new_hash is set when the stored hash should be replaced."""
+    async with limiter:
+        return await asyncio.get_running_loop().run_in_executor(_executor, pwd.verify_and_update, password, hashed)
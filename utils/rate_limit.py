@@ -0,0 +1,216 @@
+"""Token-bucket rate limits shared by every worker.
+
+A limit "N/SECONDS" lets a client burst N requests and refills at N per
+SECONDS. Buckets live in the backend named by RATE_LIMIT_BACKEND_URL:
+
+  sqlite:///PATH   a small SQLite file every worker on the host shares (default)
+  redis://...      any Redis-protocol server, for workers on several hosts;
+                   needs the optional `redis` package
+  memory://        this process only
+
+Each take() is one atomic step in the backend, so concurrent workers can
+never both spend the last token. If the backend fails the request is let
+through and a warning logged: a limiter outage must not become a login
+outage. Client IPs come from the connection, or from X-Forwarded-For when
+the proxy is listed in FORWARDED_ALLOW_IPS (see uvicorn's proxy headers).
+"""
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from config import Settings
+from utils import metrics
+
+settings = Settings()
+logger = logging.getLogger(__name__)
+
+
+def parse(spec: str) -> tuple[float, float]:
+    """Parse "N/SECONDS" into (capacity, tokens per second)."""
+    count, _, seconds = spec.partition("/")
+    capacity = float(count)
+    return capacity, capacity / float(seconds or 1)
+
+
+def _refill(tokens: float | None, updated_at: float, now: float, capacity: float, rate: float) -> float:
+    if tokens is None:
+        return capacity
+    return min(capacity, tokens + max(0.0, now - updated_at) * rate)
+
+
+class MemoryBackend:
+    """Buckets in this process only; each worker enforces the limit on its own."""
+
+    MAX_BUCKETS = 100_000
+
+    def __init__(self):
+        self._buckets = {}  # key -> (tokens, updated_at, full_at)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, rate: float) -> float:
+        """Spend a token; returns 0 if there was one, else seconds until there is."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at, _ = self._buckets.get(key, (None, now, now))
+            tokens = _refill(tokens, updated_at, now, capacity, rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            if len(self._buckets) > self.MAX_BUCKETS:
+                self._buckets = {k: v for k, v in self._buckets.items() if v[2] > now}
+        return wait
+
+
+class SQLiteBackend:
+    """Buckets in a SQLite file shared by the workers on one host.
+
+    A take is a single IMMEDIATE transaction on a WAL-mode connection per
+    thread, so takes from all workers serialize on the file lock; that costs
+    tens of microseconds, which is nothing next to a login. Rows for buckets
+    that have refilled are dropped now and then, since a full bucket and a
+    missing one mean the same.
+    """
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._local = threading.local()
+        self._takes = 0
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, full_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_buckets_full_at ON buckets (full_at)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections are per thread and per process; a forked worker opens its own
+        pid, conn = getattr(self._local, "conn", (None, None))
+        if pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = (os.getpid(), conn)
+        return conn
+
+    def take(self, key: str, capacity: float, rate: float) -> float:
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = _refill(row[0] if row else None, row[1] if row else now, now, capacity, rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            conn.execute(
+                "INSERT INTO buckets (key, tokens, updated_at, full_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, "
+                "updated_at = excluded.updated_at, full_at = excluded.full_at",
+                (key, tokens, now, now + (capacity - tokens) / rate),
+            )
+            self._takes += 1
+            if self._takes % self.PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM buckets WHERE full_at < ?", (now,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+
+# Refill, spend and store in one step on the server, timed by the server's
+# clock so hosts with skewed clocks agree. The wait is returned as a string
+# because Lua numbers are truncated to integers in replies.
+_TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = capacity
+if bucket[1] then
+    tokens = math.min(capacity, tonumber(bucket[1]) + math.max(0, now - tonumber(bucket[2])) * rate)
+end
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisBackend:
+    """Buckets in Redis, shared by workers on any number of hosts.
+
+    Needs the optional `redis` package; any Redis-protocol server with Lua
+    scripting works. Keys expire once their bucket would be full again.
+    """
+
+    def __init__(self, url: str, prefix: str = "library:rate:"):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(_TAKE_SCRIPT)
+        self._prefix = prefix
+
+    def take(self, key: str, capacity: float, rate: float) -> float:
+        return float(self._take(keys=[self._prefix + key], args=[capacity, rate]))
+
+
+def _make_backend():
+    url = settings.RATE_LIMIT_BACKEND_URL
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url.removeprefix("sqlite:///"))
+    return MemoryBackend()
+
+
+backend = _make_backend() if settings.RATE_LIMIT_ENABLED else None
+
+
+class Limiter:
+    """One named limit; check() spends a token of the caller's bucket or raises 429."""
+
+    def __init__(self, name: str, spec: str):
+        self.name = name
+        self.capacity, self.rate = parse(spec)
+
+    async def check(self, identity: str):
+        if backend is None:
+            return
+        try:
+            wait = await run_in_threadpool(backend.take, f"{self.name}:{identity}", self.capacity, self.rate)
+        except Exception:
+            logger.warning("rate limit backend failed; request allowed", exc_info=True, extra={"limit": self.name})
+            return
+        if wait:
+            metrics.RATE_LIMITED.inc(1, self.name)
+            logger.info("rate limited", extra={"limit": self.name, "identity": identity})
+            raise HTTPException(429, "Too many requests, try again later", headers={"Retry-After": str(math.ceil(wait))})
+
+    async def per_ip(self, request: Request):
+        """Route dependency limiting by client IP."""
+        await self.check(f"ip:{request.client.host if request.client else 'unknown'}")
+
+
+login_limit = Limiter("login", settings.RATE_LIMIT_LOGIN)
+signup_limit = Limiter("signup", settings.RATE_LIMIT_SIGNUP)
+borrow_request_limit = Limiter("borrow_request", settings.RATE_LIMIT_BORROW_REQUEST)
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import threading
+import time
+from fastapi import Request, Response
+from config import Settings
+from utils import events
+
+settings = Settings()
+
+
+class MemoryBackend:
+    """Per-process cache. Other workers only see a change once their TTL expires.
+
+    A versioned key ("key@generation", see set_json) shares one slot with every
+    other generation of its key, so a value superseded by an invalidation is
+    replaced by the next fill rather than kept until its key is read again.
+    """
+
+    def __init__(self):
+        self._entries = {}  # slot -> (key, value, expires_at)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _slot(key: str) -> str:
+        return key.rpartition("@")[0] or key
+
+    def get(self, key: str):
+        slot = self._slot(key)
+        with self._lock:
+            entry = self._entries.get(slot)
+            if entry is None or entry[0] != key:
+                return None
+            _, value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[slot]
+                return None
+            return value
+
+    def get_many(self, keys: list[str]) -> dict:
+        return {key: value for key in keys if (value := self.get(key)) is not None}
+
+    def set(self, key: str, value: bytes, ttl: float):
+        with self._lock:
+            self._entries[self._slot(key)] = (key, value, time.monotonic() + ttl)
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(self._slot(key))
+                if entry is not None and entry[0] == key:
+                    del self._entries[self._slot(key)]
+
+    def incr(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                _, value, _ = self._entries.get(key, (key, b"0", None))
+                self._entries[key] = (key, str(int(value) + 1).encode(), float("inf"))
+
+
+class RedisBackend:
+    """Shared cache so invalidations reach every uvicorn worker at once.
+
+    Needs the optional `redis` package; any Redis-protocol server works.
+    """
+
+    def __init__(self, url: str, prefix: str = "library:"):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def get(self, key: str):
+        return self._client.get(self._prefix + key)
+
+    def get_many(self, keys: list[str]) -> dict:
+        if not keys:
+            return {}
+        values = self._client.mget([self._prefix + key for key in keys])
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self._client.set(self._prefix + key, value, px=int(ttl * 1000))
+
+    def delete(self, *keys: str):
+        if keys:
+            self._client.delete(*(self._prefix + key for key in keys))
+
+    def incr(self, *keys: str):
+        if keys:
+            pipe = self._client.pipeline(transaction=False)
+            for key in keys:
+                pipe.incr(self._prefix + key)
+            pipe.execute()
+
+
+def _make_backend():
+    if settings.CACHE_BACKEND_URL:
+        return RedisBackend(settings.CACHE_BACKEND_URL)
+    return MemoryBackend()
+
+
+backend = _make_backend()
+TTL = settings.READ_CACHE_TTL_SECONDS
+
+
+def categories_key() -> str:
+    return "categories"
+
+
+def availability_key(book_id: int) -> str:
+    return f"availability:{book_id}"
+
+
+def borrowed_key(book_id: int) -> str:
+    return f"borrowed:{book_id}"
+
+
+# Every key has a generation that invalidation bumps, and values are stored
+# under key@generation. A fill passes set_json() the generation it read before
+# going to the database, so a value read before a concurrent write commits is
+# stored where no one looks any more instead of being served until the TTL.
+def _generation_key(key: str) -> str:
+    return f"gen:{key}"
+
+
+def invalidate_book(*book_ids: int):
+    """Call after committing a change to books (catalog or copy counts)."""
+    keys = [categories_key()]
+    keys += [availability_key(book_id) for book_id in book_ids]
+    backend.incr(*(_generation_key(key) for key in keys))
+
+
+def invalidate_borrows(*book_ids: int):
+    """Call after committing a change to borrows of these books."""
+    keys = []
+    for book_id in set(book_ids):
+        keys += [availability_key(book_id), borrowed_key(book_id)]
+    backend.incr(*(_generation_key(key) for key in keys))
+
+
+def get_json(key: str) -> tuple:
+    """(cached value or None, generation to pass to set_json on a miss)."""
+    values, generations = get_many_json([key])
+    return values.get(key), generations[key]
+
+
+def get_many_json(keys: list[str]) -> tuple[dict, dict]:
+    """({key: cached value} for the keys cached, {key: generation} for all of them)."""
+    stored = backend.get_many([_generation_key(key) for key in keys])
+    generations = {key: int(stored.get(_generation_key(key), 0)) for key in keys}
+    versioned = {key: f"{key}@{generation}" for key, generation in generations.items()}
+    values = backend.get_many(list(versioned.values()))
+    return {key: json.loads(values[v]) for key, v in versioned.items() if v in values}, generations
+
+
+def set_json(key: str, value, generation: int):
+    backend.set(f"{key}@{generation}", json.dumps(value).encode(), TTL)
+
+
+def json_response(request: Request, payload) -> Response:
+    """JSON response with a content ETag; answers 304 when the client has it."""
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    etag = f'W/"{hashlib.sha1(body).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """If-None-Match check with weak comparison, as GET requires."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag.removeprefix("W/") in candidates
+
+
+def list_validators(db, request: Request, user_id: int | None = None) -> tuple[Response | None, dict]:
+    """Weak ETag for a list endpoint from the change version, without a query
+    unless the worker's view of the version is due for a refresh.
+
+    Returns (a 304 to send, or None) and the headers for the full response.
+    Call it before querying the list: a change committed meanwhile then only
+    makes the tag older than the body, which costs a refetch, never a stale 304.
+    Lists that depend on who asks pass user_id.
+    """
+    version = events.clock.current(db)
+    if user_id is None:
+        headers = {"ETag": f'W/"{version}"', "Cache-Control": "no-cache"}
+    else:
+        headers = {"ETag": f'W/"{version}.{user_id}"', "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers), headers
+    return None, headers
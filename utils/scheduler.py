@@ -0,0 +1,203 @@
+"""In-process scheduler for periodic background jobs.
+
+Every app worker runs the same loops, but a job only runs in the worker that
+holds its row in job_leases. The lease is taken for one interval, renewed
+every half interval while the job runs and, once it finishes, set to one
+interval past the end. So across all workers each job runs about once per
+interval and never twice at a time; if the holder dies the lease simply
+expires and another worker takes over.
+
+Usage: python -m utils.scheduler [JOB ...]   (run jobs once, e.g. from cron)
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+from database.database import SessionLocal
+from models.job import JobLease
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Job:
+    name: str
+    interval: float
+    # fn(db, now) -> rows changed; commits its own batches
+    fn: Callable
+
+
+class Scheduler:
+    def __init__(self, jobs: list[Job]):
+        self.jobs = {job.name: job for job in jobs}
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._tasks = []
+
+    def start(self):
+        for job in self.jobs.values():
+            self._tasks.append(asyncio.create_task(self._loop(job), name=f"job:{job.name}"))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _loop(self, job: Job):
+        # Workers start together; spread their first attempts out
+        await asyncio.sleep(random.uniform(0, min(job.interval, 30)))
+        while True:
+            try:
+                await run_in_threadpool(self.run_once, job.name)
+            except Exception:
+                logger.exception("job failed", extra={"job": job.name})
+            await asyncio.sleep(job.interval)
+
+    def run_once(self, name: str) -> int | None:
+        """Run a job if its lease is free; returns rows changed, or None when another worker holds it."""
+        job = self.jobs[name]
+        db = SessionLocal()
+        try:
+            started = datetime.utcnow()
+            if not _acquire(db, job.name, self.owner, started + timedelta(seconds=job.interval)):
+                return None
+
+            done = threading.Event()
+            keeper = threading.Thread(
+                target=_keep_lease, args=(job, self.owner, done), name=f"lease:{job.name}", daemon=True
+            )
+            keeper.start()
+            start = time.perf_counter()
+            try:
+                rows = job.fn(db, started)
+            except Exception as e:
+                db.rollback()
+                done.set()
+                keeper.join()
+                _record(db, job, self.owner, time.perf_counter() - start, None, str(e))
+                metrics.JOB_RUNS.inc(1, job.name, "error")
+                raise
+            duration = time.perf_counter() - start
+            done.set()
+            keeper.join()
+            _record(db, job, self.owner, duration, rows, None)
+        finally:
+            db.close()
+
+        metrics.JOB_DURATION.observe(duration, job.name)
+        metrics.JOB_ROWS.inc(rows, job.name)
+        metrics.JOB_RUNS.inc(1, job.name, "ok")
+        logger.info("job finished", extra={"job": job.name, "rows": rows, "duration": round(duration, 3)})
+        return rows
+
+
+def _acquire(db, name: str, owner: str, until: datetime) -> bool:
+    """Take the lease unless another owner holds an unexpired one. One UPDATE, so two workers cannot both win."""
+    now = datetime.utcnow()
+    for _ in range(2):
+        result = db.execute(
+            update(JobLease)
+            .where(
+                JobLease.name == name,
+                or_(JobLease.lease_until.is_(None), JobLease.lease_until < now, JobLease.owner == owner),
+            )
+            .values(owner=owner, lease_until=until, last_started_at=now)
+        )
+        db.commit()
+        if result.rowcount == 1:
+            return True
+        if db.get(JobLease, name) is not None:
+            return False
+        # First run of this job anywhere: create its row, then race for it
+        db.add(JobLease(name=name))
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+    return False
+
+
+def _renew(db, name: str, owner: str, until: datetime) -> bool:
+    """Extend a lease this owner still holds; False if it has been lost."""
+    result = db.execute(
+        update(JobLease)
+        .where(JobLease.name == name, JobLease.owner == owner)
+        .values(lease_until=until)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def _keep_lease(job: Job, owner: str, done: threading.Event):
+    # A run can outlast its interval (a large backlog, a slow database); without
+    # renewal the lease would expire and another worker would start the same job
+    while not done.wait(job.interval / 2):
+        db = SessionLocal()
+        try:
+            if not _renew(db, job.name, owner, datetime.utcnow() + timedelta(seconds=job.interval)):
+                logger.warning("job lease lost while running", extra={"job": job.name})
+                return
+        except Exception:
+            # Retried at the next renewal; the lease still has half an interval left
+            logger.warning("job lease renewal failed", exc_info=True, extra={"job": job.name})
+        finally:
+            db.close()
+
+
+def _record(db, job: Job, owner: str, duration: float, rows: int | None, error: str | None):
+    """Store the run's outcome and hold the lease one interval past its end,
+    unless another worker has taken the lease meanwhile."""
+    finished = datetime.utcnow()
+    result = db.execute(
+        update(JobLease)
+        .where(JobLease.name == job.name, JobLease.owner == owner)
+        .values(
+            lease_until=finished + timedelta(seconds=job.interval),
+            last_finished_at=finished,
+            last_duration=duration,
+            last_rows=rows,
+            last_error=error,
+        )
+    )
+    db.commit()
+    if result.rowcount != 1:
+        logger.warning("job lease lost before the run was recorded", extra={"job": job.name})
+
+
+def main():
+    # Borrow's relationships need the other models registered
+    from models import books, user  # noqa: F401
+    from utils.analytics import JOBS as ANALYTICS_JOBS
+    from utils.borrow_jobs import JOBS as BORROW_JOBS
+    from utils.events import JOBS as EVENT_JOBS
+    from utils.log import setup_logging
+    from utils.token import JOBS as TOKEN_JOBS
+
+    JOBS = BORROW_JOBS + EVENT_JOBS + ANALYTICS_JOBS + TOKEN_JOBS
+    parser = argparse.ArgumentParser(description="Run background jobs once")
+    parser.add_argument("jobs", nargs="*", help=f"default: all of {', '.join(job.name for job in JOBS)}")
+    args = parser.parse_args()
+    setup_logging()
+    scheduler = Scheduler(JOBS)
+    unknown = set(args.jobs) - set(scheduler.jobs)
+    if unknown:
+        parser.error(f"unknown job(s): {', '.join(sorted(unknown))}")
+    for name in args.jobs or list(scheduler.jobs):
+        rows = scheduler.run_once(name)
+        print(f"{name}: skipped, another worker holds the lease" if rows is None else f"{name}: {rows} rows")
+
+
+if __name__ == "__main__":
+    main()
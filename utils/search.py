@@ -0,0 +1,120 @@
+import re
+from sqlalchemy import text, column, table
+from models.books import Book
+
+# Catalog search backed by the database's own inverted index:
+#   PostgreSQL: weighted tsvector expression with a GIN index, pg_trgm for typos
+#   SQLite:     FTS5 tables kept in sync by triggers, a trigram FTS5 table for typos
+# Both indexes are maintained by the database inside the same transaction as the
+# INSERT/UPDATE/DELETE on books, so nothing is ever rebuilt from the app. They
+# are created by migration 4 (database/migrations.py); the PostgreSQL
+# expressions below must stay identical to the indexed ones.
+
+FUZZY_CANDIDATES = 200
+FUZZY_MIN_SIMILARITY = 0.4
+
+PG_DOCUMENT = (
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(author, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(category, '')), 'C') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'D')"
+)
+PG_FUZZY_TEXT = "(coalesce(title, '') || ' ' || coalesce(author, ''))"
+
+books_fts = table("books_fts", column("rowid"))
+books_trgm = table("books_trgm", column("rowid"))
+
+
+def _terms(query: str) -> list[str]:
+    return re.findall(r"\w+", query.lower())
+
+
+def _trigrams(value: str) -> set[str]:
+    value = value.lower()
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def _padded_trigrams(value: str) -> set[str]:
+    # Pad every word like pg_trgm so word boundaries count towards similarity
+    grams = set()
+    for word in _terms(value):
+        grams |= _trigrams(f"  {word} ")
+    return grams
+
+
+def search_books(db, query: str, columns, limit: int, offset: int = 0):
+    """Return up to limit + 1 ranked rows of columns matching query.
+
+    Every term is matched as a prefix so partial words work for type-ahead.
+    When nothing matches, typo-tolerant trigram matching is used instead.
+    """
+    terms = _terms(query)
+    if not terms:
+        return []
+    if db.get_bind().dialect.name == "postgresql":
+        return _search_postgres(db, query, terms, columns, limit, offset)
+    return _search_sqlite(db, terms, columns, limit, offset)
+
+
+def _search_postgres(db, query, terms, columns, limit, offset):
+    tsquery = " & ".join(f"{term}:*" for term in terms)
+    match = text(f"({PG_DOCUMENT}) @@ to_tsquery('simple', :tsquery)").bindparams(tsquery=tsquery)
+    base = db.query(*columns).filter(match)
+    if db.query(base.exists()).scalar():
+        rank = text(f"ts_rank({PG_DOCUMENT}, to_tsquery('simple', :tsquery)) DESC").bindparams(tsquery=tsquery)
+        return base.order_by(rank, Book.id).offset(offset).limit(limit + 1).all()
+
+    fuzzy = text(f":raw <% {PG_FUZZY_TEXT}").bindparams(raw=query)
+    similarity = text(f"word_similarity(:raw, {PG_FUZZY_TEXT}) DESC").bindparams(raw=query)
+    return (
+        db.query(*columns)
+        .filter(fuzzy)
+        .order_by(similarity, Book.id)
+        .offset(offset)
+        .limit(limit + 1)
+        .all()
+    )
+
+
+def _search_sqlite(db, terms, columns, limit, offset):
+    # Quote each term so FTS5 operators in user input are treated as text
+    fts_query = " ".join(f'"{term}"*' for term in terms)
+    base = (
+        db.query(*columns)
+        .join(books_fts, books_fts.c.rowid == Book.id)
+        .filter(text("books_fts MATCH :q").bindparams(q=fts_query))
+    )
+    rows = base.order_by(text("bm25(books_fts, 10.0, 5.0, 2.0, 1.0)"), Book.id).offset(offset).limit(limit + 1).all()
+    if rows:
+        return rows
+    # An empty later page is either past the last full-text match or a page
+    # of the fuzzy results the first page fell back to
+    if offset and db.query(base.exists()).scalar():
+        return rows
+    return _fuzzy_sqlite(db, terms, columns, limit, offset)
+
+
+def _fuzzy_sqlite(db, terms, columns, limit, offset):
+    grams = set()
+    for term in terms:
+        grams |= _trigrams(term)
+    if not grams:
+        return []
+    trgm_query = " OR ".join(f'"{gram}"' for gram in sorted(grams))
+    candidates = (
+        db.query(*columns)
+        .join(books_trgm, books_trgm.c.rowid == Book.id)
+        .filter(text("books_trgm MATCH :q").bindparams(q=trgm_query))
+        .order_by(text("bm25(books_trgm)"), Book.id)
+        .limit(FUZZY_CANDIDATES)
+        .all()
+    )
+    # bm25 favours rows sharing many trigrams; drop those sharing too few
+    wanted = _padded_trigrams(" ".join(terms))
+    matches = []
+    for row in candidates:
+        found = _padded_trigrams(f"{row.title or ''} {row.author or ''}")
+        if len(wanted & found) / len(wanted) >= FUZZY_MIN_SIMILARITY:
+            matches.append(row)
+    # Pages are cut from the best FUZZY_CANDIDATES, which is as deep as typo matches go
+    return matches[offset:offset + limit + 1]
@@ -0,0 +1,62 @@
+"""JSON fast path for list endpoints.
+
+Returning models from a route costs two validations: one when the models are
+built, and another when FastAPI checks the result against response_model
+(then jsonable_encoder and json.dumps on top). List endpoints instead build
+plain dicts straight from row tuples and return json_response(): one
+validation pass and JSON encoding, both inside pydantic-core. The route
+keeps response_model for the OpenAPI schema; FastAPI skips it when a
+Response is returned.
+
+The validation and encoding are left to the response's encode(), which
+db_route calls on the threadpool once the database work is done, so in
+DB_ASYNC mode a 1000-row page is not encoded on the event loop.
+"""
+from functools import lru_cache
+from fastapi.responses import Response
+from pydantic import TypeAdapter
+from starlette.concurrency import run_in_threadpool
+
+
+@lru_cache(maxsize=None)
+def adapter(tp) -> TypeAdapter:
+    # Building an adapter compiles its schema; do it once per type
+    return TypeAdapter(tp)
+
+
+def dump_json(tp, payload) -> bytes:
+    """Validate payload (dicts, models or a mix) as tp and encode it to JSON bytes."""
+    ta = adapter(tp)
+    return ta.dump_json(ta.validate_python(payload))
+
+
+class PayloadResponse(Response):
+    """JSON response whose payload is validated and encoded by encode()."""
+
+    media_type = "application/json"
+
+    def __init__(self, tp, payload, status_code: int = 200, headers: dict | None = None):
+        self.tp = tp
+        self.payload = payload
+        self.encoded = False
+        super().__init__(status_code=status_code, headers=headers)
+
+    def encode(self):
+        """CPU work; call it off the event loop while the payload's session is open."""
+        if self.encoded:
+            return
+        self.body = dump_json(self.tp, self.payload)
+        self.payload = None
+        self.raw_headers = [(k, v) for k, v in self.raw_headers if k != b"content-length"]
+        self.raw_headers.append((b"content-length", str(len(self.body)).encode()))
+        self.encoded = True
+
+    async def __call__(self, scope, receive, send):
+        # Returned from outside db_route: encode now, still off the loop
+        if not self.encoded:
+            await run_in_threadpool(self.encode)
+        await super().__call__(scope, receive, send)
+
+
+def json_response(tp, payload, status_code: int = 200, headers: dict | None = None) -> PayloadResponse:
+    return PayloadResponse(tp, payload, status_code=status_code, headers=headers)
@@ -0,0 +1,160 @@
+"""Production runner: N uvicorn workers forked from one preloaded parent.
+
+The parent binds the listening socket and imports the app once (preload):
+schema check, precompressed static assets and every module are done a single
+time, and the forked workers share those pages copy-on-write. All workers
+accept from the same socket. The parent only supervises: a worker that dies
+is replaced, and SIGTERM or SIGINT drains them all. Each worker then stops
+accepting, ends its event streams, gives requests in flight (borrow
+transactions included) up to SHUTDOWN_DRAIN_SECONDS to finish and runs the
+app's shutdown; stragglers are killed after that.
+
+Workers coordinate through the database (job leases, change feed, token
+revocations) and the shared rate-limit backend, so nothing else needs to
+know how many there are.
+
+Usage: python -m utils.server [--workers N] [--host HOST] [--port PORT]
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import time
+import uvicorn
+from config import Settings
+from utils import events, log
+
+settings = Settings()
+logger = logging.getLogger(__name__)
+
+# A worker that dies sooner than this after starting is restarted with a pause,
+# so a broken deploy does not fork in a tight loop
+MIN_WORKER_SECONDS = 1.0
+# Beyond the drain, time for the app's own shutdown before a worker is killed
+SHUTDOWN_GRACE_SECONDS = 5.0
+
+
+class _Server(uvicorn.Server):
+    async def shutdown(self, sockets=None):
+        # Event streams never finish by themselves and would hold up the drain
+        events.bus.close()
+        await super().shutdown(sockets)
+
+
+def bind(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(app, sock: socket.socket, drain_seconds: float):
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, signal.SIG_DFL)
+    config = uvicorn.Config(
+        app,
+        # Logging is already set up by utils.log; uvicorn's records go through it
+        log_config=None,
+        access_log=False,
+        proxy_headers=True,
+        timeout_graceful_shutdown=drain_seconds,
+    )
+    _Server(config).run(sockets=[sock])
+
+
+class Supervisor:
+    def __init__(self, app, sock: socket.socket, workers: int, drain_seconds: float):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.drain_seconds = drain_seconds
+        self.children = {}  # pid -> started (monotonic)
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(self.app, self.sock, self.drain_seconds)
+            except BaseException:
+                logger.exception("worker crashed")
+                code = 1
+            finally:
+                log.stop_logging()
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+        logger.info("worker started", extra={"pid": pid})
+
+    def _stop(self, sig, frame):
+        self.stopping = True
+
+    def _reap(self) -> list[tuple[int, int, float]]:
+        """(pid, exit status, seconds alive) of every child that has exited."""
+        exited = []
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            started = self.children.pop(pid, None)
+            if started is not None:
+                exited.append((pid, os.waitstatus_to_exitcode(status), time.monotonic() - started))
+        return exited
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for _ in range(self.workers):
+            self.spawn()
+
+        while not self.stopping:
+            for pid, code, alive in self._reap():
+                logger.warning("worker exited; replacing it", extra={"pid": pid, "code": code})
+                if alive < MIN_WORKER_SECONDS:
+                    time.sleep(MIN_WORKER_SECONDS)
+                if not self.stopping:
+                    self.spawn()
+            time.sleep(0.2)
+
+        logger.info("draining workers", extra={"workers": len(self.children), "drain_seconds": self.drain_seconds})
+        # New connections now fail fast instead of queueing for workers that are leaving
+        self.sock.close()
+        for pid in self.children:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.drain_seconds + SHUTDOWN_GRACE_SECONDS
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in self.children:
+            logger.error("worker did not drain in time; killing it", extra={"pid": pid})
+            os.kill(pid, signal.SIGKILL)
+        while self.children:
+            pid, _ = os.waitpid(-1, 0)
+            self.children.pop(pid, None)
+        logger.info("all workers stopped")
+        log.stop_logging()
+        return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with several preloaded worker processes")
+    parser.add_argument("--workers", type=int, default=settings.SERVER_WORKERS or os.cpu_count() or 1)
+    parser.add_argument("--host", default=settings.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVER_PORT)
+    parser.add_argument("--drain-seconds", type=float, default=settings.SHUTDOWN_DRAIN_SECONDS)
+    args = parser.parse_args()
+
+    sock = bind(args.host, args.port)
+    # Preload: every worker forks from an already imported app
+    from main import app
+
+    logger.info("serving", extra={"host": args.host, "port": args.port, "workers": args.workers})
+    raise SystemExit(Supervisor(app, sock, args.workers, args.drain_seconds).run())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,317 @@
+"""Access and refresh tokens.
+
+Access tokens are JWTs that live ACCESS_TOKEN_EXPIRE_MINUTES and are checked
+without the database: decoded claims are kept in an LRU keyed by the token's
+sha256, and revocation is a membership test against RevocationList, this
+worker's copy of the unexpired rows of revoked_tokens. Refresh tokens are
+random strings stored hashed in refresh_tokens; each one is good for a
+single /auth/refresh, which hands out a new pair.
+"""
+import hashlib
+import heapq
+import secrets
+import threading
+import time
+import uuid
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from jose import jwt
+from jose import jwt, JWTError
+from sqlalchemy import delete, insert, select, update
 from config import Settings
+from models.token import RefreshToken, RevokedToken
+from utils.scheduler import Job
 
 settings = Settings()
 SECRET_KEY = settings.SECRET_KEY
 ALGORITHM = settings.ALGORITHM
 
+# Revocations are re-read this far back on every sync, so a row committed late
+# (or stamped by a host whose clock is a little behind) is still picked up
+SYNC_OVERLAP = timedelta(seconds=60)
+# Expired revocations are dropped one bucket (minute) at a time
+BUCKET_SECONDS = 60
+
 
-def create_token(data: dict, expires_minutes: int = 60 * 24 * 7):  # 7 days
+def create_token(data: dict, expires_minutes: int | None = None):
+    """Sign an access token; the lifetime defaults to ACCESS_TOKEN_EXPIRE_MINUTES."""
+    if expires_minutes is None:
+        expires_minutes = settings.ACCESS_TOKEN_EXPIRE_MINUTES
+    now = time.time()
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=expires_minutes)
-    to_encode["exp"] = expire
+    to_encode.update({
+        "type": "access",
+        "jti": uuid.uuid4().hex,
+        "iat": int(now),
+        # iat is whole seconds; per-user revocations compare against this so a
+        # token issued later in the same second as one is not caught by it
+        "issued_at": now,
+        "exp": int(now + expires_minutes * 60),
+    })
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+
+# EventSource cannot send headers, so the admin event stream is opened with a
+# ticket in its URL instead of the access token. A ticket is good for nothing
+# else and only for this long, since URLs end up in proxy and access logs.
+STREAM_TICKET_SECONDS = 30
+
+
+def create_stream_ticket(claims: dict) -> str:
+    """Ticket that opens one event stream for the holder of the access token
+    `claims`. The stream lives on that token: it ends at the token's exp and
+    when the token is revoked."""
+    return jwt.encode({
+        "type": "stream",
+        "id": claims["id"],
+        "jti": claims["jti"],
+        "iat": claims["iat"],
+        "issued_at": claims.get("issued_at", claims["iat"]),
+        "access_exp": claims["exp"],
+        "exp": int(time.time() + STREAM_TICKET_SECONDS),
+    }, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def decode_stream_ticket(ticket: str) -> dict:
+    """Claims of the access token an unexpired stream ticket was issued for; raises JWTError otherwise."""
+    claims = jwt.decode(ticket, SECRET_KEY, algorithms=[ALGORITHM])
+    if claims.get("type") != "stream":
+        raise JWTError("Not a stream ticket")
+    return {
+        "id": claims["id"],
+        "jti": claims["jti"],
+        "iat": claims["iat"],
+        "issued_at": claims["issued_at"],
+        "exp": claims["access_exp"],
+    }
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class ClaimsCache:
+    """Bounded LRU of decoded access-token claims keyed by the token's sha256."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def decode(self, token: str) -> dict:
+        """Claims of a valid, unexpired access token; raises JWTError otherwise."""
+        key = hashlib.sha256(token.encode()).digest()
+        with self._lock:
+            claims = self._entries.get(key)
+            if claims is not None:
+                if claims["exp"] > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return claims
+                del self._entries[key]
+            self.misses += 1
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        # Tokens signed before revocation existed have no jti and are refused;
+        # every access token identifies its user by id
+        if claims.get("type") != "access" or "jti" not in claims or "id" not in claims:
+            raise JWTError("Not an access token")
+        with self._lock:
+            self._entries[key] = claims
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return claims
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class RevocationList:
+    """Unexpired revocations, mirrored from revoked_tokens.
+
+    A lookup is two dict probes. Entries are filed under the minute their
+    tokens expire, and a min-heap of those minutes lets prune() drop whole
+    buckets once they are past, so the set only holds revocations that
+    could still match a live token.
+    """
+
+    def __init__(self, sync_seconds: float):
+        self.sync_seconds = sync_seconds
+        self._jtis = {}  # jti -> bucket
+        self._users = {}  # user_id -> (tokens issued before this epoch are revoked, bucket)
+        self._buckets = {}  # bucket -> [(kind, key)]
+        self._heap = []
+        self._lock = threading.Lock()
+        self._synced_through = None
+        self._next_sync = 0.0
+
+    def add(self, jti: str | None, user_id: int | None, revoked_at: datetime, expires_at: datetime):
+        bucket = int(_epoch(expires_at)) // BUCKET_SECONDS + 1
+        with self._lock:
+            if jti is not None:
+                self._jtis[jti] = max(bucket, self._jtis.get(jti, bucket))
+                entry = ("jti", jti)
+            else:
+                cutoff, old_bucket = self._users.get(user_id, (0.0, bucket))
+                self._users[user_id] = (max(cutoff, _epoch(revoked_at)), max(bucket, old_bucket))
+                entry = ("user", user_id)
+            if bucket not in self._buckets:
+                self._buckets[bucket] = []
+                heapq.heappush(self._heap, bucket)
+            self._buckets[bucket].append(entry)
+
+    def is_revoked(self, claims: dict) -> bool:
+        user = self._users.get(claims.get("id"))
+        if user is not None and claims.get("issued_at", claims["iat"]) < user[0]:
+            return True
+        return claims["jti"] in self._jtis
+
+    def prune(self, now: float | None = None):
+        current = int(now or time.time()) // BUCKET_SECONDS
+        with self._lock:
+            while self._heap and self._heap[0] <= current:
+                bucket = heapq.heappop(self._heap)
+                for kind, key in self._buckets.pop(bucket):
+                    # A later revocation may have moved the key to a newer bucket
+                    if kind == "jti" and self._jtis.get(key) == bucket:
+                        del self._jtis[key]
+                    elif kind == "user" and key in self._users and self._users[key][1] == bucket:
+                        del self._users[key]
+
+    def sync_due(self) -> bool:
+        """True for one caller once every sync_seconds; that caller runs sync()."""
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_sync:
+                return False
+            self._next_sync = now + self.sync_seconds
+            return True
+
+    def sync(self, db):
+        """Load revocations made since the last sync (all unexpired ones the first time)."""
+        now = datetime.utcnow()
+        query = select(RevokedToken.jti, RevokedToken.user_id, RevokedToken.revoked_at, RevokedToken.expires_at).where(
+            RevokedToken.expires_at > now
+        )
+        if self._synced_through is not None:
+            query = query.where(RevokedToken.revoked_at >= self._synced_through - SYNC_OVERLAP)
+        for row in db.execute(query):
+            self.add(row.jti, row.user_id, row.revoked_at, row.expires_at)
+        self._synced_through = now
+        self.prune()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"tokens": len(self._jtis), "users": len(self._users)}
+
+
+def _epoch(value: datetime) -> float:
+    return (value - datetime(1970, 1, 1)).total_seconds()
+
+
+def _from_epoch(value: float) -> datetime:
+    return datetime(1970, 1, 1) + timedelta(seconds=value)
+
+
+claims_cache = ClaimsCache(settings.TOKEN_CACHE_SIZE)
+revocations = RevocationList(settings.TOKEN_REVOCATION_SYNC_SECONDS)
+
+
+def issue_refresh_token(db, user_id: int) -> str:
+    """Store a new refresh token in the caller's transaction; returns it."""
+    token = secrets.token_urlsafe(32)
+    now = datetime.utcnow()
+    db.execute(insert(RefreshToken).values(
+        token_hash=hash_token(token),
+        user_id=user_id,
+        created_at=now,
+        expires_at=now + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS),
+    ))
+    return token
+
+
+def use_refresh_token(db, token: str) -> int | None:
+    """Spend a refresh token; returns its user id, or None if it is unknown,
+    expired or already spent. Presenting a spent token revokes every refresh
+    token of its user, since one of the two holders is not the user."""
+    now = datetime.utcnow()
+    token_hash = hash_token(token)
+    user_id = db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.token_hash == token_hash, RefreshToken.revoked_at.is_(None), RefreshToken.expires_at > now)
+        .values(revoked_at=now)
+        .returning(RefreshToken.user_id)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    if user_id is None:
+        reused = db.execute(
+            select(RefreshToken.user_id).where(RefreshToken.token_hash == token_hash, RefreshToken.revoked_at.isnot(None))
+        ).scalar()
+        if reused is not None:
+            _revoke_refresh_tokens(db, reused, now)
+    return user_id
+
+
+def _revoke_refresh_tokens(db, user_id: int, now: datetime):
+    db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.user_id == user_id, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=now)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def revoke_token(db, claims: dict, refresh_token: str | None = None):
+    """Revoke one access token (and optionally its refresh token) in the caller's
+    transaction; call revoked() after the commit."""
+    if refresh_token:
+        db.execute(
+            update(RefreshToken)
+            .where(RefreshToken.token_hash == hash_token(refresh_token), RefreshToken.user_id == claims["id"])
+            .values(revoked_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+    row = {
+        "jti": claims["jti"],
+        "user_id": claims["id"],
+        "revoked_at": datetime.utcnow(),
+        "expires_at": _from_epoch(claims["exp"]),
+    }
+    db.execute(insert(RevokedToken).values(**row))
+    return row
+
+
+def revoke_user(db, user_id: int):
+    """Revoke every access and refresh token of a user issued until now, in the
+    caller's transaction; call revoked() after the commit."""
+    now = datetime.utcnow()
+    _revoke_refresh_tokens(db, user_id, now)
+    row = {
+        "jti": None,
+        "user_id": user_id,
+        "revoked_at": now,
+        # Every access token issued before now has expired by then
+        "expires_at": now + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES),
+    }
+    db.execute(insert(RevokedToken).values(**row))
+    return row
+
+
+def revoked(row: dict | None):
+    """Apply a committed revocation to this worker at once; others see it on their next sync."""
+    if row is not None:
+        revocations.add(**row)
+
+
+def prune_tokens(db, now) -> int:
+    """Drop revocations and refresh tokens whose tokens have expired."""
+    deleted = db.execute(delete(RevokedToken).where(RevokedToken.expires_at < now)).rowcount
+    deleted += db.execute(delete(RefreshToken).where(RefreshToken.expires_at < now)).rowcount
+    db.commit()
+    return deleted
+
+
+JOBS = [
+    Job("prune_tokens", 3600, prune_tokens),
+]
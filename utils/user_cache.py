@@ -0,0 +1,131 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from sqlalchemy import select
+from config import Settings
+from models.change import ChangeCounter, ChangeLog
+
+settings = Settings()
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """Read-only snapshot of a User row used as the request principal.
+
+    It is detached from any session; routes that modify the user must load the
+    row again and call invalidate() after committing.
+    """
+    id: int
+    username: str
+    email: str | None
+    full_name: str | None
+    is_admin: bool
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            full_name=user.full_name,
+            is_admin=bool(user.is_admin),
+        )
+
+
+class UserCache:
+    """Bounded LRU of principals keyed by user id, with a TTL per entry.
+
+    invalidate() bumps one generation counter shared by all users. A loader
+    reads the generation before going to the database and passes it to put(),
+    so a row loaded before any invalidation can never be stored after it,
+    without keeping state for users that are not cached.
+
+    Invalidations made by other workers arrive through sync(), which reads the
+    user changes from the change feed; the TTL only bounds changes made
+    outside the app.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._synced_version = None
+        self._lock = threading.Lock()
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def get(self, user_id: int):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                user, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return user
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+
+    def put(self, user: CachedUser, generation: int):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[user.id] = (user, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *user_ids: int):
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def sync(self, db):
+        """Drop the users changed since the last sync, by this or any other worker."""
+        counter = db.execute(
+            select(ChangeCounter.version, ChangeCounter.pruned_through).where(ChangeCounter.id == 1)
+        ).first()
+        if counter is None:
+            return
+        if self._synced_version is None or counter.pruned_through > self._synced_version:
+            # Nothing to diff against (first sync, or the log was pruned past it)
+            self.clear()
+        else:
+            changed = db.scalars(
+                select(ChangeLog.entity_id).distinct().where(
+                    ChangeLog.entity == "user",
+                    ChangeLog.version > self._synced_version,
+                    ChangeLog.version <= counter.version,
+                )
+            ).all()
+            if changed:
+                self.invalidate(*changed)
+        self._synced_version = counter.version
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+user_cache = UserCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL_SECONDS)
@@ -0,0 +1,118 @@
+"""Hand freed copies of a book to its waitlist before anyone else can take them.
+
+A book only gets a waitlist while it has no available copies, so whatever
+raises available_copies (a return, an admin edit, a catalog import) gives
+the copies to the head of the queue first: each becomes an approved borrow in
+the caller's transaction.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import delete, exists, insert, literal, select, update
+from models.books import Book
+from models.borrow import Borrow
+from models.user import User
+from models.waitlist import WaitlistEntry
+from utils import analytics, events
+
+
+def fill(db, book_ids) -> list[int]:
+    """Hand the available copies of books whose count was just raised to their
+    waitlists; returns the books that got new borrows.
+
+    Call it in the transaction that raised available_copies, while the book
+    rows are still locked by that write, so no approval can take the copies
+    in between.
+    """
+    books = db.execute(
+        select(Book.id, Book.available_copies).where(
+            Book.id.in_(book_ids),
+            Book.available_copies > 0,
+            exists().where(WaitlistEntry.book_id == Book.id),
+        )
+    ).all()
+    filled = []
+    for book in books:
+        handed = hand_over_copies(db, book.id, book.available_copies)
+        if handed:
+            filled.append(book.id)
+            db.execute(
+                update(Book)
+                .where(Book.id == book.id)
+                .values(available_copies=Book.available_copies - handed)
+                .execution_options(synchronize_session=False)
+            )
+            events.record(db, "book", [book.id])
+    return filled
+
+
+def hand_over_copies(db, book_id: int, copies: int) -> int:
+    """Give up to `copies` freed copies straight to the head of the book's waitlist.
+
+    Each one pops the lowest position (an index seek, never a queue scan) and
+    inserts an approved borrow in the caller's transaction, so the copy never
+    passes through available_copies. Returns how many were handed over.
+    """
+    handed = 0
+    now = datetime.utcnow()
+    while handed < copies:
+        # SKIP LOCKED lets concurrent returns of the same book take different
+        # entries on Postgres; SQLite serializes writers anyway
+        head = db.execute(
+            select(WaitlistEntry.id)
+            .where(WaitlistEntry.book_id == book_id)
+            .order_by(WaitlistEntry.position)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).scalar()
+        if head is None:
+            return handed
+        entry = db.execute(
+            delete(WaitlistEntry)
+            .where(WaitlistEntry.id == head)
+            .returning(WaitlistEntry.user_id, WaitlistEntry.loan_days)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if entry is None:
+            continue
+        borrow_id = _create_allocated_borrow(db, book_id, entry.user_id, entry.loan_days, now)
+        if borrow_id is not None:
+            events.record(db, "borrow", [borrow_id])
+            # The allocated borrow is a request and its approval at once
+            analytics.record(db, "request", [(entry.user_id, book_id)])
+            analytics.record(db, "approve", [(entry.user_id, book_id)])
+            handed += 1
+    return handed
+
+
+def _create_allocated_borrow(db, book_id: int, user_id: int, loan_days: int, now: datetime) -> int | None:
+    """Insert an approved borrow unless the user or book is gone or the user
+    already has an open borrow of the book (their entry is then just dropped).
+    Returns the new borrow's id."""
+    return db.execute(
+        insert(Borrow).from_select(
+            ["user_id", "book_id", "request_date", "requested_borrow_date",
+             "requested_return_date", "borrow_date", "status", "is_returned"],
+            select(
+                User.id,
+                Book.id,
+                literal(now, Borrow.request_date.type),
+                literal(now, Borrow.requested_borrow_date.type),
+                literal(now + timedelta(days=loan_days), Borrow.requested_return_date.type),
+                literal(now, Borrow.borrow_date.type),
+                literal("approved"),
+                literal(False, Borrow.is_returned.type),
+            )
+            .select_from(User)
+            .join(Book, Book.id == book_id)
+            .where(User.id == user_id, ~_open_borrow(user_id, book_id)),
+        )
+        .returning(Borrow.id)
+    ).scalar()
+
+
+def _open_borrow(user_id: int, book_id: int):
+    return exists().where(
+        Borrow.user_id == user_id,
+        Borrow.book_id == book_id,
+        Borrow.status.in_(["pending", "approved"]),
+        Borrow.is_returned == False,
+    )